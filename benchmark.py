@@ -0,0 +1,220 @@
+"""Benchmarks of the hot paths of the models against a seeded database
+
+A separate benchmark database is created if it does not exist, emptied and seeded with the given amount of items,
+invoices and persons before the benchmarks are run. Every benchmark is run within its own request context, so it
+starts with nothing remembered, and is timed along with the amount of queries it runs.
+
+The results are written as JSON, and compared against the results of a previous run when a baseline is given. The run
+fails if any benchmark slows down by more than the threshold or runs more queries than the baseline:
+    python benchmark.py --scale 10k --output baseline.json
+    python benchmark.py --scale 10k --baseline baseline.json --threshold 0.25
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, quote_ident
+
+import charts
+import config
+import database
+import migrations
+import pdf_cache
+import totals
+from invoice import Invoice, Item, Person
+from work import app
+
+# The amount of items, invoices and persons seeded for each scale
+SCALES = {
+    '1k': (1000, 100, 10),
+    '10k': (10000, 1000, 100),
+    '100k': (100000, 10000, 1000),
+}
+# The amount of items on each seeded invoice and on each invoice created by the Invoice.create benchmark
+ITEMS_PER_INVOICE = 5
+
+
+def prepare(name):
+    """Create the benchmark database and its tables if they do not exist and use it for every connection"""
+    config.postgres_database = 'postgres'
+    with database.database(pooled=False) as connection:
+        connection.db.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        if not connection.query('SELECT 1 FROM pg_database WHERE datname = %s', name):
+            connection.query('CREATE DATABASE {}'.format(quote_ident(name, connection.cursor)))
+    config.postgres_database = name
+
+    with database.database(pooled=False) as connection:
+        if not database.tables_exist(connection):
+            database.create_tables(connection)
+    with database.database(pooled=False) as connection:
+        migrations.migrate(connection)
+
+
+def seed(items, invoices, persons):
+    """Replace the data of the benchmark database with the given amount of items, invoices and persons
+
+    Each invoice includes ITEMS_PER_INVOICE items where there are enough items, the remaining items are unlogged
+    """
+    with database.database() as db:
+        db.query('TRUNCATE invoice_items, email_outbox, invoices, items, persons, data_versions')
+        db.query("""INSERT INTO persons (person_name, address, email)
+                    SELECT 'Person ' || n, n || ' Benchmark Street', 'person' || n || '@example.com'
+                    FROM generate_series(1, %s) n""", persons)
+        db.query("""INSERT INTO items (date, description, charge)
+                    SELECT date '2018-01-01' + (n / 50), 'Benchmark item ' || n, (n * 7919) / 100.0
+                    FROM generate_series(1, %s) n""", items)
+        db.query("""INSERT INTO invoices (date, payer, payee)
+                    SELECT date '2018-01-01' + (n / 5), 'Person ' || (1 + n * 7 / 3 %% %s), 'Person ' || (1 + n %% %s)
+                    FROM generate_series(1, %s) n""", persons, persons, invoices)
+        # Give the first items to the invoices in order of item code, ITEMS_PER_INVOICE at a time
+        db.query("""INSERT INTO invoice_items (item_code, invoice_number)
+                    SELECT items.item_code, invoices.invoice_number
+                    FROM (SELECT item_code, row_number() OVER (ORDER BY item_code) - 1 AS n FROM items) items
+                    JOIN (SELECT invoice_number, row_number() OVER (ORDER BY invoice_number) - 1 AS n
+                          FROM invoices) invoices ON invoices.n = items.n / %s""", ITEMS_PER_INVOICE)
+        totals.rebuild(db)
+        db.query('ANALYZE')
+
+
+class QueryCounter(object):
+    """A query hook of the database class which counts the queries run"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, query, duration, rows):
+        self.count += 1
+
+
+def measure(function, setup=None, repeat=5):
+    """Time a function after a warm up run, within a new request context each run
+
+    setup: a function run before each run outside of the timing, returning the arguments of the function
+
+    Returns a dictionary of the median and fastest seconds taken and the amount of queries run by the last run
+    """
+    counter = QueryCounter()
+    times = []
+    for attempt in range(repeat + 1):
+        arguments = setup() if setup is not None else ()
+        with app.test_request_context():
+            counter.count = 0
+            database.query_hooks.append(counter)
+            try:
+                started = time.perf_counter()
+                function(*arguments)
+                elapsed = time.perf_counter() - started
+            finally:
+                database.query_hooks.remove(counter)
+        if attempt:
+            times.append(elapsed)
+    return {'seconds': statistics.median(times), 'fastest': min(times), 'queries': counter.count}
+
+
+def run(repeat=5):
+    """Run every benchmark against the seeded database
+
+    Returns a dictionary of the name of each benchmark to its measurements
+    """
+    # Render a new PDF every time rather than serving it from the cache
+    pdf_cache.cache.directory = None
+
+    with database.database() as db:
+        invoice_id = db.query('SELECT max(invoice_number) FROM invoices')[0][0]
+
+    def unlogged_items():
+        with database.database() as db:
+            codes = [row[0] for row in db.query("""INSERT INTO items (date, description, charge)
+                                                   SELECT date '2018-06-01', 'Benchmark invoice item', 10
+                                                   FROM generate_series(1, %s) RETURNING item_code""",
+                                                ITEMS_PER_INVOICE)]
+        return '2018-06-01', 'Person 1', 'Person 2', codes
+
+    def build_pdf():
+        Invoice(invoice_id).build_pdf()
+
+    benchmarks = {
+        'Invoice.get_all': (Invoice.get_all, None),
+        'Item.get_unlogged': (Item.get_unlogged, None),
+        'Person.get_all': (Person.get_all, None),
+        'Invoice.create': (Invoice.create, unlogged_items),
+        'Invoice.statistics': (lambda: charts.render(Invoice.statistics()), None),
+        'Invoice.build_pdf': (build_pdf, None),
+    }
+    results = {}
+    for name, (function, setup) in benchmarks.items():
+        results[name] = measure(function, setup, repeat)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Compare results against the results of a baseline run
+
+    threshold: the fraction by which a benchmark may be slower than the baseline, such as 0.2 for 20% slower
+
+    Returns a list of descriptions of the benchmarks which regressed
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        if result['seconds'] > expected['seconds'] * (1 + threshold):
+            regressions.append('{} took {:.4f}s, {:.0%} slower than the baseline of {:.4f}s'.format(
+                name, result['seconds'], result['seconds'] / expected['seconds'] - 1, expected['seconds']))
+        if result['queries'] > expected['queries']:
+            regressions.append('{} ran {} queries, more than the baseline of {}'.format(
+                name, result['queries'], expected['queries']))
+    return regressions
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmark the models against a seeded database')
+    parser.add_argument('--database', default='work_benchmark',
+                        help='the database to seed and benchmark, which is emptied first')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='1k',
+                        help='the amount of items, invoices and persons to seed')
+    parser.add_argument('--items', type=int, help='the amount of items to seed, overriding the scale')
+    parser.add_argument('--invoices', type=int, help='the amount of invoices to seed, overriding the scale')
+    parser.add_argument('--persons', type=int, help='the amount of persons to seed, overriding the scale')
+    parser.add_argument('--repeat', type=int, default=5, help='the amount of timed runs of each benchmark')
+    parser.add_argument('--output', help='the file to write the results to as JSON')
+    parser.add_argument('--baseline', help='a file of the results of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='the fraction a benchmark may slow down by before failing the run')
+    options = parser.parse_args(arguments)
+
+    if options.database == getattr(config, 'postgres_database', None):
+        parser.error('refusing to empty the configured database {}, benchmark another'.format(options.database))
+    items, invoices, persons = SCALES[options.scale]
+    volumes = {'items': options.items or items, 'invoices': options.invoices or invoices,
+               'persons': max(options.persons or persons, 2)}
+
+    prepare(options.database)
+    seed(**volumes)
+    results = run(options.repeat)
+
+    for name, result in results.items():
+        print('{:<20} {:>10.4f}s {:>10.4f}s {:>6} queries'.format(name, result['seconds'], result['fastest'],
+                                                                  result['queries']))
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump({'volumes': volumes, 'results': results}, file, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get('volumes') != volumes:
+            print('The baseline was seeded with {} rather than {}'.format(baseline.get('volumes'), volumes))
+        regressions = compare(results, baseline['results'], options.threshold)
+        for regression in regressions:
+            print(regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
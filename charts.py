@@ -0,0 +1,98 @@
+"""Renders the statistics charts as SVG images
+
+Charts are drawn with the object-oriented matplotlib Figure API rather than the global pyplot state machine, rendered
+into memory and cached until the global version stamp of the invoices and items is bumped.
+"""
+import threading
+from io import BytesIO
+
+from matplotlib import pyplot
+from matplotlib.backends.backend_svg import FigureCanvasSVG
+from matplotlib.figure import Figure
+
+from database import database
+import versions
+
+# Guards the rendering of charts in the xkcd style, which is applied through the global matplotlib settings
+_lock = threading.Lock()
+# The most recently rendered SVG of each chart along with the version of the data it was drawn from
+_cache = {}
+
+
+def invoice_series():
+    """Retrieve the invoice numbers and amounts of every invoice in order with a single query"""
+    with database() as db:
+        rows = db.query('SELECT invoice_number, amount FROM invoices ORDER BY invoice_number')
+    return [row[0] for row in rows], [row[1] for row in rows]
+
+
+def item_series():
+    """Retrieve the dates and charges of every item ordered by date with a single query"""
+    with database() as db:
+        rows = db.query('SELECT date, charge FROM items ORDER BY date')
+    return [row[0] for row in rows], [row[1] for row in rows]
+
+
+def invoice_figure(numbers, amounts):
+    """Build a figure plotting the amount of each invoice against the invoice number"""
+    figure = Figure()
+    axes = figure.add_subplot()
+    axes.plot(numbers, amounts, marker='o', label='Charge')
+    axes.set_xlabel('Invoice Number')
+    axes.set_ylabel('Money')
+    axes.legend(loc=2)
+    axes.spines['top'].set_visible(False)
+    axes.spines['right'].set_visible(False)
+    axes.tick_params(axis=u'both', which=u'both', length=0)
+    return figure
+
+
+def item_figure(dates, charges):
+    """Build a figure plotting the amount charged for each item over time"""
+    figure = Figure()
+    axes = figure.add_subplot()
+    axes.plot(dates, charges)
+    axes.legend(('Item Charges',))
+    return figure
+
+
+def render(figure):
+    """Render a figure to the bytes of an SVG image"""
+    output = BytesIO()
+    FigureCanvasSVG(figure).print_svg(output)
+    return output.getvalue()
+
+
+def _chart(name, series, build, xkcd=False):
+    """Return the SVG of a chart, only drawing it if the data has changed since it was last drawn
+
+    The global version stamp is looked up before the data is queried, so a chart is never cached under a version newer
+    than the data it was drawn from
+
+    name: the name the chart is cached under
+    series: a function retrieving the data the chart is drawn from, only called when the chart is drawn
+    build: a function building the figure from the series
+    xkcd: whether to draw the chart in the xkcd style
+    """
+    version = versions.get(versions.GLOBAL)[0]
+    cached = _cache.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    data = series()
+    if xkcd:
+        with _lock, pyplot.xkcd():
+            svg = render(build(*data))
+    else:
+        svg = render(build(*data))
+    _cache[name] = (version, svg)
+    return svg
+
+
+def invoices_svg():
+    """Return the SVG image of the invoice amounts chart"""
+    return _chart('invoices', invoice_series, invoice_figure, xkcd=True)
+
+
+def items_svg():
+    """Return the SVG image of the item charges chart"""
+    return _chart('items', item_series, item_figure)
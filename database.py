@@ -1,17 +1,227 @@
+import collections
+import itertools
+import csv
+import math
+import os
+import sqlite3
+import threading
+import time
+
 import psycopg2
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, STATUS_READY, encodings
 
 import config
+import sqlite_backend
+
+# The errors raised by the connections of either backend, caught in the same way as the classes of psycopg2
+Error = (psycopg2.Error, sqlite3.Error)
+InterfaceError = (psycopg2.InterfaceError, sqlite3.InterfaceError)
+IntegrityError = (psycopg2.IntegrityError, sqlite3.IntegrityError)
+
+
+def _copy_value(value):
+    """Format a value of a row the way the CSV written by COPY does, which has no .0 on whole floats and t or f for
+    booleans"""
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return 'Infinity' if value > 0 else '-Infinity'
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return repr(value)
+    return value
+
+
+def backend():
+    """Return the storage backend selected in the configuration file, either postgres or sqlite"""
+    return getattr(config, 'database_backend', 'postgres')
+
+
+def connect():
+    """Open a new connection to the database described in the configuration file"""
+    if backend() == 'sqlite':
+        return sqlite_backend.connect(getattr(config, 'sqlite_path', 'work.sqlite3'),
+                                      timeout=getattr(config, 'sqlite_timeout', 30))
+    return psycopg2.connect(host=config.postgres_host,
+                            user=config.postgres_user,
+                            password=config.postgres_password,
+                            database=config.postgres_database)
+
+
+class ConnectionPool(object):
+    """A thread-safe pool of open connections to the database
+
+    Connections are checked out with getconn and returned with putconn rather than being opened and closed for
+    every query. Idle connections are health checked before being handed out again.
+    """
+
+    def __init__(self, minconn=1, maxconn=10, timeout=30, check_interval=30, factory=connect):
+        """Initialize the pool and open the minimum amount of connections
+
+        minconn: the amount of connections opened up front and kept idle in the pool
+        maxconn: the maximum amount of connections that may be checked out at the same time
+        timeout: the amount of seconds getconn waits for a connection before raising a TimeoutError
+        check_interval: the amount of seconds a connection may sit idle before it is checked with a query
+        factory: a function which opens a new connection
+        """
+        if minconn > maxconn:
+            raise ValueError('The minimum pool size of {} exceeds the maximum of {}'.format(minconn, maxconn))
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.factory = factory
+        self.pid = os.getpid()
+
+        # Idle connections paired with the time they were returned, the most recently used is last
+        self._idle = []
+        # The amount of connections currently handed out or being opened
+        self._used = 0
+        self._condition = threading.Condition()
+        self._closed = False
+
+        for _ in range(minconn):
+            self._idle.append((self.factory(), time.monotonic()))
+
+    def getconn(self):
+        """Check out a healthy connection, opening a new one if the pool is not yet at its maximum size
+
+        Raises a TimeoutError if no connection becomes available within the pool timeout
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._condition:
+                if self._closed:
+                    raise psycopg2.InterfaceError('The connection pool is closed')
+                while not self._idle and self._used >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError('No database connection became available within {} seconds'
+                                           .format(self.timeout))
+                    self._condition.wait(remaining)
+                self._used += 1
+                connection, returned = self._idle.pop() if self._idle else (None, None)
+
+            # Open or health check connections outside of the lock so other threads are not held up
+            try:
+                if connection is None:
+                    return self.factory()
+                if self._healthy(connection, returned):
+                    return connection
+            except Exception:
+                self._release()
+                raise
+            self._discard(connection)
+
+    def putconn(self, connection):
+        """Return a connection to the pool, rolling back anything left uncommitted"""
+        if not connection.closed and connection.status != STATUS_READY:
+            try:
+                connection.rollback()
+            except Error:
+                pass
+        if connection.closed or self._closed:
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._used -= 1
+            self._condition.notify()
+
+    def closeall(self):
+        """Close every idle connection and stop handing out new ones"""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._condition.notify_all()
+        for connection, _ in idle:
+            connection.close()
+
+    def _healthy(self, connection, returned):
+        """Check whether an idle connection can still be used"""
+        if connection.closed:
+            return False
+        if time.monotonic() - returned < self.check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.rollback()
+            return True
+        except Error:
+            return False
+
+    def _discard(self, connection):
+        """Close a connection that is no longer usable and free up its place in the pool"""
+        try:
+            connection.close()
+        except Error:
+            pass
+        self._release()
+
+    def _release(self):
+        with self._condition:
+            self._used -= 1
+            self._condition.notify()
+
+    def __len__(self):
+        """The total amount of connections the pool is responsible for"""
+        with self._condition:
+            return self._used + len(self._idle)
+
+
+# Unique names for the server-side cursors opened by database.iterate
+_cursor_names = itertools.count()
+
+# Functions which take the column names of a query and return a function converting a row, or None to keep tuples
+_row_factories = {
+    'tuple': lambda columns: None,
+    'namedtuple': lambda columns: collections.namedtuple('Row', columns, rename=True)._make,
+    'dict': lambda columns: lambda row: dict(zip(columns, row)),
+}
+
+# Functions called with the SQL statement, the seconds taken and the amount of rows of every query which is run
+query_hooks = []
+
+_pool = None
+_pool_lock = threading.Lock()
+# Pools inherited from a parent process, kept referenced so their connections are never closed from the child
+_inherited_pools = []
+
+
+def get_pool():
+    """Retrieve the connection pool of this process, creating it from the configuration file on first use
+
+    A new pool is created after forking so worker processes never share connections
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            if _pool is not None:
+                _inherited_pools.append(_pool)
+            _pool = ConnectionPool(minconn=getattr(config, 'postgres_pool_min', 1),
+                                   maxconn=getattr(config, 'postgres_pool_max', 10),
+                                   timeout=getattr(config, 'postgres_pool_timeout', 30),
+                                   check_interval=getattr(config, 'postgres_pool_check_interval', 30))
+        return _pool
 
 
 class database:
-    def __init__(self):
-        """Establish a connection to the database and initialize the class"""
-        self.db = psycopg2.connect(host=config.postgres_host,
-                                   user=config.postgres_user,
-                                   password=config.postgres_password,
-                                   database=config.postgres_database)
+    def __init__(self, pooled=True):
+        """Check out a connection to the database and initialize the class
+
+        pooled: if true the connection is borrowed from the connection pool, otherwise a dedicated connection is
+                opened and closed with this object
+        """
+        self.pool = get_pool() if pooled else None
+        self.db = self.pool.getconn() if pooled else connect()
         self.cursor = self.db.cursor()
+        # The SQL dialect of the connection, either postgres or sqlite
+        self.dialect = getattr(self.db, 'dialect', 'postgres')
+        self.closed = False
 
     def commit(self):
         """Commit the queries previously run on the database"""
@@ -22,12 +232,18 @@ class database:
         self.db.rollback()
 
     def close(self):
-        """Close the cursor object and the connection to the database
+        """Close the cursor object and return the connection to the pool, or close it if it is not pooled
 
         Used when closing the context manager or deleting the object
         """
+        if self.closed:
+            return
+        self.closed = True
         self.cursor.close()
-        self.db.close()
+        if self.pool is not None:
+            self.pool.putconn(self.db)
+        else:
+            self.db.close()
 
     def __enter__(self):
         """Allows for the database to have context management"""
@@ -56,14 +272,136 @@ class database:
         *variables: the items to place in the query in the place of %s
         limit: the maximum amount of rows to return
         """
+        started = time.perf_counter()
         self.cursor.execute(query, variables)
+        if self.cursor.description is None:
+            # The statement does not return rows
+            rows = None
+        elif limit:
+            rows = self.cursor.fetchmany(limit)
+        else:
+            rows = self.cursor.fetchall()
+        self._record(query, started, self.cursor.rowcount if rows is None else len(rows))
+        return rows
+
+    def query_values(self, query, rows, template=None, page_size=1000):
+        """Execute a SQL query with a VALUES list of many rows, such as an insert of many rows, and return the
+        results
+
+        The rows are placed in pages of page_size rows, so only one statement is run for every page
+
+        query: a string SQL statement with a single %s in the place of the rows, such as INSERT INTO t (a, b) VALUES %s
+        rows: a list of tuples of the values of each row
+        template: the SQL of each row with a %s for each value, such as (%s, %s::date), by default a %s for each value
+        page_size: the maximum amount of rows placed in one statement
+        """
+        before, after = query.split('%s')
+        if template is None and rows:
+            template = '({})'.format(', '.join(['%s'] * len(rows[0])))
+        results = []
+        for start in range(0, len(rows), page_size):
+            page = rows[start:start + page_size]
+            variables = [value for row in page for value in row]
+            page_rows = self.query(before + ', '.join([template] * len(page)) + after, *variables)
+            results.extend(page_rows or [])
+        return results
+
+    def iterate(self, query, *variables, itersize=1000, batches=False, rows='tuple'):
+        """Execute a SQL query with a server-side cursor and yield the resulting rows as they are fetched
+
+        Rows are fetched from the server itersize at a time so the whole result is never held in memory. The rows
+        can only be iterated while the transaction of the database is open.
+
+        query: a string SQL statement to execute on the database
+        *variables: the items to place in the query in the place of %s
+        itersize: the amount of rows fetched from the server at a time
+        batches: if true lists of up to itersize rows are yielded rather than individual rows
+        rows: the type of the rows, either 'tuple', 'namedtuple' for rows with attributes of the column names or
+              'dict' for dictionaries of the column names to values
+        """
+        if rows not in _row_factories:
+            raise ValueError('Rows cannot be of type {}, use one of {}'.format(rows, ', '.join(_row_factories)))
+
+        cursor = self.db.cursor(name='iterate_{}'.format(next(_cursor_names)))
+        cursor.itersize = itersize
+        started, count = time.perf_counter(), 0
         try:
-            if limit:
-                return self.cursor.fetchmany(limit)
-            else:
-                return self.cursor.fetchall()
-        except psycopg2.ProgrammingError:
-            return None
+            cursor.execute(query, variables)
+            make_row = None
+            while True:
+                batch = cursor.fetchmany(itersize)
+                if not batch:
+                    break
+                count += len(batch)
+                if make_row is None:
+                    # The columns of a server-side cursor are only known once the first rows are fetched
+                    make_row = _row_factories[rows]([column[0] for column in cursor.description])
+                if make_row is not None:
+                    batch = [make_row(row) for row in batch]
+                if batches:
+                    yield batch
+                else:
+                    yield from batch
+        finally:
+            cursor.close()
+            # The duration includes the time spent by the caller between fetches
+            self._record(query, started, count)
+
+    def copy_from(self, file, table, columns):
+        """Load rows of CSV from a file into a table with a single COPY statement
+
+        file: a file-like object of CSV rows without a header
+        table: the database table to load the rows into
+        columns: the names of the columns in the order of the values in each row
+        """
+        if self.dialect == 'sqlite':
+            # SQLite has no COPY, so the rows are inserted many at a time, reading empty values as NULL as COPY does
+            rows = [tuple(value if value != '' else None for value in row) for row in csv.reader(file)]
+            self.query_values('INSERT INTO {} ({}) VALUES %s'.format(table, ', '.join(columns)), rows)
+            return len(rows)
+
+        query = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(table, ', '.join(columns))
+        started = time.perf_counter()
+        self.cursor.copy_expert(query, file)
+        self._record(query, started, self.cursor.rowcount)
+        return self.cursor.rowcount
+
+    def copy_to(self, file, query, *variables, header=True):
+        """Write the results of a SQL query to a file as CSV with a single COPY statement
+
+        The rows are written by the database as they are produced rather than being fetched into memory
+
+        file: a file-like object to write the CSV to
+        query: a string SQL select statement
+        *variables: the items to place in the query in the place of %s
+        header: whether to start the CSV with a row of the column names
+        """
+        if self.dialect == 'sqlite':
+            # SQLite has no COPY, so the rows are fetched and written a batch at a time
+            started, count = time.perf_counter(), 0
+            cursor = self.db.cursor()
+            try:
+                cursor.execute(query, variables)
+                writer = csv.writer(file, lineterminator='\n')
+                if header:
+                    writer.writerow([column[0] for column in cursor.description])
+                while True:
+                    batch = cursor.fetchmany(1000)
+                    if not batch:
+                        break
+                    writer.writerows([[_copy_value(value) for value in row] for row in batch])
+                    count += len(batch)
+            finally:
+                cursor.close()
+            self._record(query, started, count)
+            return count
+
+        started = time.perf_counter()
+        self.cursor.copy_expert('COPY ({}) TO STDOUT WITH (FORMAT csv{})'.format(
+            self.cursor.mogrify(query, variables).decode(encodings[self.db.encoding]), ', HEADER' if header else ''),
+            file)
+        self._record('COPY ({}) TO STDOUT'.format(query), started, self.cursor.rowcount)
+        return self.cursor.rowcount
 
     def exists(self, table, **where):
         """Check if rows exist in a table satisfying the given where clauses
@@ -78,17 +416,34 @@ class database:
             query = 'SELECT COUNT(*) FROM {} WHERE {}'.format(table, wheres)
         else:
             query = 'SELECT COUNT(*) FROM {}'.format(table, wheres)
+        started = time.perf_counter()
         self.cursor.execute(query)
+        exists = bool(self.cursor.fetchone()[0])
+        self._record(query, started, 1)
+
+        return exists
 
-        return bool(self.cursor.fetchone()[0])
+    @staticmethod
+    def _record(query, started, rows):
+        """Call the query hooks with a query which has been run
+
+        query: the SQL statement of the query
+        started: the performance counter time the query was started
+        rows: the amount of rows returned or changed by the query
+        """
+        if query_hooks:
+            duration = time.perf_counter() - started
+            for hook in query_hooks:
+                hook(query, duration, rows)
 
     def __bool__(self):
         """Return true if the database has an open connection, false otherwise"""
-        return not bool(self.db.closed)
+        return not self.closed and not bool(self.db.closed)
 
     def __del__(self):
         """Closes all connections to the database when the object is deleted"""
-        self.close()
+        if hasattr(self, 'closed'):
+            self.close()
 
 
 def create_invoice_items(connection):
@@ -119,6 +474,10 @@ def create_persons(connection):
 
 
 def create_tables(connection):
+    if connection.dialect == 'sqlite':
+        # SQLite cannot add keys to existing tables, so the tables are created as the migrations leave them
+        sqlite_backend.create_tables(connection.db)
+        return
     create_invoice_items(connection)
     create_invoices(connection)
     create_items(connection)
@@ -134,14 +493,16 @@ def tables_exist(connection):
     for table in ("invoice_items", "invoices", "items", "persons"):
         try:
             connection.exists(table)
-        except psycopg2.ProgrammingError:
+        except (psycopg2.ProgrammingError, sqlite3.OperationalError):
             return False
     return True
 
 
 def database_exists():
+    if backend() == 'sqlite':
+        return os.path.exists(getattr(config, 'sqlite_path', 'work.sqlite3'))
     try:
-        test_connection_db = database()
+        test_connection_db = database(pooled=False)
         test_connection_db.close()
         return True
     except psycopg2.OperationalError:
@@ -149,10 +510,13 @@ def database_exists():
 
 
 if __name__ == "__main__":
-    if not database_exists():
+    import migrations
+
+    # A SQLite database is created when it is first connected to
+    if backend() == 'postgres' and not database_exists():
         tmp = config.postgres_database
         config.postgres_database = 'postgres'
-        with database() as connection:
+        with database(pooled=False) as connection:
             connection.db.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
             create_database(connection)
         config.postgres_database = tmp
@@ -162,3 +526,10 @@ if __name__ == "__main__":
         with database() as connection:
             create_tables(connection)
     test_connection.close()
+
+    with database() as connection:
+        for version, description, applied in migrations.migrate(connection):
+            if applied:
+                print('Applied migration {}: {}'.format(version, description))
+            else:
+                print('Recorded migration {}: {} (schema already current)'.format(version, description))
@@ -1,21 +1,115 @@
 import smtplib
+import ssl
+import threading
 from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
 import config
 
+# Errors after which an SMTP session can no longer be used and must be reconnected
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError, ssl.SSLError)
+
+
+def connect():
+    """Open an SMTP session to the server in the configuration file and log in"""
+    if getattr(config, 'smtp_ssl', True):
+        server = smtplib.SMTP_SSL(config.smtp_server, config.smtp_port)
+    else:
+        server = smtplib.SMTP(config.smtp_server, config.smtp_port)
+    server.ehlo()
+    if config.email_login:
+        server.login(config.email_login, config.email_password)
+    return server
+
+
+class SMTPPool(object):
+    """A pool of logged in SMTP sessions which are reused to send many emails
+
+    Sessions are opened as they are needed up to the size of the pool and kept open once an email is sent. A session
+    which has been disconnected is replaced by a new one and the email is sent again.
+    """
+
+    def __init__(self, size=4, factory=connect, retries=1):
+        """Initialize the pool without opening any sessions
+
+        size: the maximum amount of sessions open at once
+        factory: a function which opens and logs in a new session
+        retries: the amount of times to reconnect and send again when a session fails
+        """
+        self.size = size
+        self.factory = factory
+        self.retries = retries
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        """Take an idle session or open a new one, waiting while every session is in use"""
+        self._slots.acquire()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        try:
+            return self.factory()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkin(self, server):
+        """Return a session to the pool, or only free up its place if the session was closed"""
+        if server is not None:
+            with self._lock:
+                self._idle.append(server)
+        self._slots.release()
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.close()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+    def send(self, message):
+        """Send a message over a pooled session, reconnecting if the session has failed"""
+        server = self._checkout()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    server.send_message(message)
+                    return
+                except CONNECTION_ERRORS:
+                    self._close(server)
+                    server = None
+                    if attempt == self.retries:
+                        raise
+                    server = self.factory()
+        finally:
+            self._checkin(server)
+
+    def closeall(self):
+        """Log out of and close every idle session"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server in idle:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                self._close(server)
+
+
+pool = SMTPPool(getattr(config, 'smtp_pool_size', 4))
+
 
 class Email(object):
-    def __init__(self, _to, _from, _subject):
+    def __init__(self, _to, _from, _subject, smtp_pool=None):
         self.msg = MIMEMultipart('mixed')
         self.msg['From'] = _from
         self.msg['To'] = _to
         self.msg['Subject'] = _subject
 
-        self.server = smtplib.SMTP_SSL(config.smtp_server, config.smtp_port)
-        self.server.ehlo()
-        self.server.login(config.email_login, config.email_password)
+        # The pool of SMTP sessions the email is sent with
+        self.pool = smtp_pool if smtp_pool is not None else pool
 
     def __enter__(self):
         return self
@@ -27,14 +121,14 @@ class Email(object):
         text_part = MIMEText(body, 'plain')
         self.msg.attach(text_part)
 
-    def attach_pdf(self, file, name):
-        with open(file, 'rb') as pdf:
-            attach = MIMEApplication(pdf.read(), _subtype="pdf")
-            attach.add_header('content-disposition', 'attachment', filename=('utf-8', '', name))
-            self.msg.attach(attach)
+    def attach_pdf(self, pdf, name):
+        attach = MIMEApplication(pdf, _subtype="pdf")
+        attach.add_header('content-disposition', 'attachment', filename=('utf-8', '', name))
+        self.msg.attach(attach)
 
     def send(self):
-        self.server.send_message(self.msg)
+        self.pool.send(self.msg)
 
     def close(self):
-        self.server.close()
+        """The SMTP session is returned to the pool once sent, so there is nothing left to close"""
+        pass
@@ -0,0 +1,160 @@
+"""Export of every invoice joined with its items, payer and payee as CSV or Parquet
+
+Each row of the export is an item of an invoice alongside the details and totals of the invoice, invoices without
+any items have a single row with empty item columns. The rows are streamed from the database as they are produced so
+the export never holds the whole dataset in memory.
+
+Parquet exports require the optional pyarrow package. Run this file to export to a file, or standard output if no file
+is given:
+    python exporter.py --start 2018-01-01 --end 2018-06-30 invoices.csv
+    python exporter.py --parquet invoices.parquet
+"""
+import csv
+import datetime
+import io
+import sys
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from database import database, _copy_value
+
+# The names of the exported columns paired with the SQL expression of each column
+COLUMNS = (
+    ('invoice_number', 'invoices.invoice_number'),
+    ('invoice_date', 'invoices.date'),
+    ('payer', 'invoices.payer'),
+    ('payer_address', 'payer.address'),
+    ('payer_email', 'payer.email'),
+    ('payee', 'invoices.payee'),
+    ('payee_address', 'payee.address'),
+    ('payee_email', 'payee.email'),
+    ('invoice_amount', 'invoices.amount'),
+    ('invoice_item_count', 'invoices.item_count'),
+    ('item_code', 'items.item_code'),
+    ('item_date', 'items.date'),
+    ('description', 'items.description'),
+    ('charge', 'items.charge'),
+)
+
+
+def parse_date(value):
+    """Return the date of a YYYY-MM-DD string, or None if the string is empty
+
+    Raises a ValueError if the string is not a date
+    """
+    if not value:
+        return None
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def query(start=None, end=None):
+    """Return the SQL select statement of the export and the variables of the statement
+
+    start: the earliest date of the invoices to export, or None for no earliest date
+    end: the latest date of the invoices to export, or None for no latest date
+    """
+    wheres, variables = [], []
+    if start is not None:
+        wheres.append('invoices.date >= %s')
+        variables.append(start)
+    if end is not None:
+        wheres.append('invoices.date <= %s')
+        variables.append(end)
+    sql = """SELECT {}
+             FROM invoices
+             LEFT JOIN persons payer ON payer.person_name = invoices.payer
+             LEFT JOIN persons payee ON payee.person_name = invoices.payee
+             LEFT JOIN invoice_items ON invoice_items.invoice_number = invoices.invoice_number
+             LEFT JOIN items ON items.item_code = invoice_items.item_code
+             WHERE {}
+             ORDER BY invoices.invoice_number, items.item_code""".format(
+        ', '.join('{} AS {}'.format(expression, name) for name, expression in COLUMNS),
+        ' AND '.join(wheres) or 'TRUE')
+    return sql, variables
+
+
+def copy_csv(file, start=None, end=None):
+    """Write the export as CSV with a header to a file using a single COPY statement
+
+    Returns the amount of rows written
+    """
+    sql, variables = query(start, end)
+    with database() as db:
+        return db.copy_to(file, sql, *variables)
+
+
+def iterate_csv(start=None, end=None, itersize=1000):
+    """Yield the export as chunks of CSV with a header, fetching itersize rows from the database at a time"""
+    buffer = io.StringIO()
+    # Written the way COPY writes CSV, so the streamed export is the same as the export written by copy_csv
+    writer = csv.writer(buffer, lineterminator='\n')
+
+    def flush():
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    writer.writerow([name for name, _ in COLUMNS])
+    yield flush()
+    sql, variables = query(start, end)
+    with database() as db:
+        for batch in db.iterate(sql, *variables, itersize=itersize, batches=True):
+            writer.writerows([[_copy_value(value) for value in row] for row in batch])
+            yield flush()
+
+
+def write_parquet(file, start=None, end=None, itersize=10000):
+    """Write the export to a file as Parquet, with a row group of at most itersize rows for each fetch
+
+    file: the path or binary file-like object to write to
+
+    Returns the amount of rows written
+    Raises an ImportError if pyarrow is not installed
+    """
+    if pyarrow is None:
+        raise ImportError('Exporting to Parquet requires the pyarrow package')
+
+    types = {
+        'invoice_number': pyarrow.int32(), 'invoice_item_count': pyarrow.int32(),
+        'invoice_date': pyarrow.date32(), 'item_date': pyarrow.date32(),
+        'invoice_amount': pyarrow.float64(), 'charge': pyarrow.float64(),
+    }
+    schema = pyarrow.schema([(name, types.get(name, pyarrow.string())) for name, _ in COLUMNS])
+
+    count = 0
+    sql, variables = query(start, end)
+    with pyarrow.parquet.ParquetWriter(file, schema) as writer, database() as db:
+        for batch in db.iterate(sql, *variables, itersize=itersize, batches=True):
+            columns = zip(*batch)
+            writer.write_batch(pyarrow.RecordBatch.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+            count += len(batch)
+    return count
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    parquet = '--parquet' in arguments
+    if parquet:
+        arguments.remove('--parquet')
+    dates = {}
+    for option in ('--start', '--end'):
+        if option in arguments:
+            index = arguments.index(option)
+            dates[option[2:]] = parse_date(arguments[index + 1])
+            del arguments[index:index + 2]
+    if len(arguments) > 1 or (parquet and not arguments):
+        sys.exit('Usage: exporter.py [--start YYYY-MM-DD] [--end YYYY-MM-DD] [--parquet FILE | FILE]')
+
+    if parquet:
+        write_parquet(arguments[0], **dates)
+    elif arguments:
+        with open(arguments[0], 'w', newline='', encoding='utf-8') as output:
+            copy_csv(output, **dates)
+    else:
+        copy_csv(sys.stdout, **dates)
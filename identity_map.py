@@ -0,0 +1,66 @@
+"""A request scoped identity map of the rows loaded by the models
+
+Rows are remembered by their table and key for the duration of a single Flask request so that looking up the same
+item, person or invoice again is served from memory. Outside of a request nothing is remembered.
+"""
+from flask import g, has_request_context
+
+
+def _rows():
+    """Retrieve the rows remembered for the current request, or None when outside of a request"""
+    if not has_request_context():
+        return None
+    if '_identity_map' not in g:
+        g._identity_map = {}
+    return g._identity_map
+
+
+def get(table, key):
+    """Return the remembered row of the table with the given key, or None if it has not been loaded"""
+    rows = _rows()
+    if rows is None:
+        return None
+    return rows.get((table, key))
+
+
+def get_many(table, keys):
+    """Split the keys into the rows already remembered and the keys which still have to be loaded
+
+    Returns a dictionary of key to row and a list of the keys that are not remembered
+    """
+    found, missing = {}, []
+    for key in keys:
+        row = get(table, key)
+        if row is None:
+            missing.append(key)
+        else:
+            found[key] = row
+    return found, missing
+
+
+def add(table, key, row):
+    """Remember a row of the table loaded from the database"""
+    rows = _rows()
+    if rows is not None:
+        rows[(table, key)] = row
+
+
+def discard(table, key=None):
+    """Forget the row of the table with the given key, or every row of the table if no key is given"""
+    rows = _rows()
+    if rows is None:
+        return
+    if key is not None:
+        rows.pop((table, key), None)
+    else:
+        for remembered in [remembered for remembered in rows if remembered[0] == table]:
+            del rows[remembered]
+
+
+def clear(exception=None):
+    """Forget every row remembered for the current request
+
+    Registered to run when the request is torn down
+    """
+    if has_request_context():
+        g.pop('_identity_map', None)
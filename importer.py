@@ -0,0 +1,165 @@
+"""Bulk import of items from CSV or newline delimited JSON
+
+Every row is validated before anything is loaded, the item codes are reserved as a single block and the items are
+loaded with one COPY statement in a single transaction, rather than creating items one at a time.
+
+Each row has the date of the item as YYYY-MM-DD, a description and the charge, which may also be named amount.
+CSV files start with a header of the column names. Run this file with the path of the file to import, or - to read
+standard input:
+    python importer.py timesheets.csv
+    python importer.py --format ndjson --skip-invalid timesheets.ndjson
+"""
+import csv
+import datetime
+import io
+import json
+import math
+import sys
+
+import versions
+from database import database
+from item import Item
+
+# The columns of the items table loaded by the import, in the order they are written
+COLUMNS = ('item_code', 'date', 'description', 'charge')
+
+
+class ImportResult(object):
+    """The outcome of an import, the codes of the items loaded and the errors of the rows which were not valid"""
+
+    def __init__(self, codes, errors):
+        """Initialize the result
+
+        codes: a list of the item codes given to the imported items in the order of the rows
+        errors: a list of tuples of the row number, counting from 1 after any header, and why the row is not
+                valid
+        """
+        self.codes = codes
+        self.errors = errors
+
+    def dict(self):
+        """Return the dictionary representation of the result"""
+        return {
+            'imported': len(self.codes),
+            'codes': self.codes,
+            'errors': [{'row': number, 'error': error} for number, error in self.errors],
+        }
+
+
+def read_csv(stream):
+    """Yield the row number and a dictionary of the columns of each row of CSV with a header"""
+    return enumerate(csv.DictReader(stream), 1)
+
+
+def read_ndjson(stream):
+    """Yield the line number and the object of each non-empty line of newline delimited JSON
+
+    A line which is not valid JSON is yielded as None
+    """
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+}
+
+
+def validate(record):
+    """Return the date, description and charge of an item from a dictionary of a row
+
+    Raises a ValueError describing the problem if the row is not a valid item
+    """
+    if not isinstance(record, dict):
+        raise ValueError('Row is not an object of the date, description and charge of an item')
+
+    value = record.get('date')
+    try:
+        date = datetime.datetime.strptime(str(value).strip(), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('Date {!r} is not of the form YYYY-MM-DD'.format(value))
+
+    description = record.get('description')
+    if not isinstance(description, str) or not description.strip():
+        raise ValueError('Description is missing')
+
+    value = record.get('charge', record.get('amount'))
+    try:
+        charge = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('Charge {!r} is not a number'.format(value))
+    if not math.isfinite(charge):
+        raise ValueError('Charge {!r} is not a number'.format(value))
+
+    return date, description, charge
+
+
+def import_items(stream, format='csv', skip_invalid=False):
+    """Validate and load the items of a file in a single transaction
+
+    stream: a text file-like object of the items to import
+    format: the format of the file, either csv or ndjson
+    skip_invalid: if true the valid rows are loaded even when other rows are not valid, otherwise nothing is loaded
+                  unless every row is valid
+
+    Returns an ImportResult of the codes of the items loaded and the errors of the rows which were not valid
+    Raises a ValueError if the format is not supported
+    """
+    if format not in READERS:
+        raise ValueError('Items cannot be imported from {}, use one of {}'.format(format, ', '.join(READERS)))
+
+    rows, errors = [], []
+    for number, record in READERS[format](stream):
+        try:
+            rows.append(validate(record))
+        except ValueError as error:
+            errors.append((number, str(error)))
+    if not rows or (errors and not skip_invalid):
+        return ImportResult([], errors)
+
+    codes = Item.reserve_codes(len(rows))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for code, (date, description, charge) in zip(codes, rows):
+        writer.writerow((code, date.isoformat(), description, repr(charge)))
+    buffer.seek(0)
+
+    with database() as db:
+        db.copy_from(buffer, 'items', COLUMNS)
+        versions.bump(db)
+    return ImportResult(codes, errors)
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    skip = '--skip-invalid' in arguments
+    if skip:
+        arguments.remove('--skip-invalid')
+    file_format = None
+    if '--format' in arguments:
+        index = arguments.index('--format')
+        file_format = arguments[index + 1]
+        del arguments[index:index + 2]
+    if len(arguments) != 1:
+        sys.exit('Usage: importer.py [--format csv|ndjson] [--skip-invalid] FILE')
+
+    path = arguments[0]
+    if file_format is None:
+        file_format = 'ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv'
+    if path == '-':
+        result = import_items(sys.stdin, file_format, skip)
+    else:
+        with open(path, newline='', encoding='utf-8') as file:
+            result = import_items(file, file_format, skip)
+
+    for number, error in result.errors:
+        print('Row {}: {}'.format(number, error))
+    print('Imported {} items'.format(len(result.codes)))
+    if result.errors and not result.codes:
+        sys.exit(1)
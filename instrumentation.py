@@ -0,0 +1,135 @@
+"""Instrumentation of the queries run through the database class
+
+Every query is recorded with the fingerprint of its statement, how long it took, the amount of rows it returned or
+changed and the model method it was run from. The queries of a Flask request are aggregated by fingerprint and logged
+as a single structured line once the request ends, flagging statements run more times than the repeat threshold as a
+likely N+1 pattern. The summaries of recent requests are kept for the query debugging endpoint.
+
+Queries are recorded once this module has been imported, which registers it as a hook of the database class.
+"""
+import collections
+import json
+import logging
+import os
+import re
+import sys
+import threading
+
+from flask import g, has_request_context, request
+
+import config
+import database
+
+logger = logging.getLogger(__name__)
+
+# Literals which are replaced by a placeholder so statements differing only in their values share a fingerprint
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+# Source files whose frames are skipped when finding the code which ran a query
+_SKIPPED = {os.path.abspath(__file__), os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.py')}
+
+# The summaries of the most recent requests which ran queries, the newest is last
+_history = collections.deque(maxlen=getattr(config, 'query_history_size', 50))
+_history_lock = threading.Lock()
+
+
+def fingerprint(sql):
+    """Return the statement of a query with its literals and parameters replaced by ? and whitespace collapsed"""
+    return ' '.join(_LITERALS.sub('?', sql).split())
+
+
+def caller():
+    """Return the module and qualified name of the function which ran the query being recorded"""
+    frame = sys._getframe(1)
+    while frame is not None and (os.path.abspath(frame.f_code.co_filename) in _SKIPPED
+                                 or frame.f_code.co_filename.endswith('contextlib.py')):
+        frame = frame.f_back
+    if frame is None:
+        return None
+    code = frame.f_code
+    return '{}:{}'.format(frame.f_globals.get('__name__'), getattr(code, 'co_qualname', code.co_name))
+
+
+def record(sql, duration, rows):
+    """Record a query which has been run
+
+    sql: the SQL statement of the query before its parameters were placed
+    duration: the seconds the query took
+    rows: the amount of rows returned or changed by the query, or None if it is not known
+    """
+    query = {'fingerprint': fingerprint(sql), 'duration': duration, 'rows': rows, 'caller': caller()}
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(dict(query, event='query')))
+    if has_request_context():
+        g.setdefault('_queries', []).append(query)
+
+
+def summarise(queries):
+    """Aggregate recorded queries by fingerprint
+
+    Returns a dictionary of the total amount and duration of the queries and a list of the statements ordered by how
+    often they were run, where statements run more than the repeat threshold are flagged as repeated
+    """
+    threshold = getattr(config, 'query_repeat_threshold', 10)
+    statements = collections.OrderedDict()
+    for query in queries:
+        statement = statements.setdefault(query['fingerprint'], {
+            'fingerprint': query['fingerprint'], 'count': 0, 'duration': 0.0, 'rows': 0, 'callers': [],
+        })
+        statement['count'] += 1
+        statement['duration'] += query['duration']
+        statement['rows'] += query['rows'] or 0
+        if query['caller'] not in statement['callers']:
+            statement['callers'].append(query['caller'])
+    statements = sorted(statements.values(), key=lambda statement: statement['count'], reverse=True)
+    for statement in statements:
+        statement['repeated'] = statement['count'] > threshold
+    return {
+        'count': len(queries),
+        'duration': sum(query['duration'] for query in queries),
+        'statements': statements,
+        'repeated': [statement['fingerprint'] for statement in statements if statement['repeated']],
+    }
+
+
+def current():
+    """Return the summary of the queries recorded so far in the current request"""
+    return summarise(g.get('_queries', []) if has_request_context() else [])
+
+
+def finish(exception=None):
+    """Log and remember the summary of the queries of the current request and forget the queries
+
+    Registered to run when the request is torn down
+    """
+    if not has_request_context():
+        return
+    queries = g.pop('_queries', None)
+    if not queries:
+        return
+    summary = dict(summarise(queries), method=request.method, path=request.full_path.rstrip('?'))
+    with _history_lock:
+        _history.append(summary)
+    level = logging.WARNING if summary['repeated'] else logging.INFO
+    logger.log(level, json.dumps(dict(summary, event='request_queries'), default=str))
+
+
+def annotate(response):
+    """Add the amount and duration of the queries of the current request to the Server-Timing header of a response,
+    where it is shown by the network panel of browser developer tools
+
+    Registered to run after each request
+    """
+    queries = g.get('_queries')
+    if queries:
+        response.headers.add('Server-Timing', 'db;dur={:.1f};desc="{} queries"'.format(
+            sum(query['duration'] for query in queries) * 1000, len(queries)))
+    return response
+
+
+def history():
+    """Return a list of the summaries of the most recent requests which ran queries, the newest first"""
+    with _history_lock:
+        return list(reversed(_history))
+
+
+database.query_hooks.append(record)
@@ -1,10 +1,13 @@
-from os import remove as os_remove
-
-import pylab
-from flask import render_template
-from xhtml2pdf.pisa import CreatePDF
+from flask import render_template, has_app_context
 
+import charts
 import config
+import identity_map
+import outbox
+import pagination
+import pdf_cache
+import pdf_service
+import versions
 from database import database
 from emailer import Email
 from item import Item
@@ -25,20 +28,59 @@ class Invoice(object):
         invoice_id: The numeric identifier of the invoice
         """
         self.id = int(invoice_id)
-        # The location where the pdf copy of this invoice will be stored if generated
-        self.pdf_file = 'pdfs/{}.pdf'.format(self.id)
-
-        with database() as db:
-            if db.exists('invoices', invoice_number=self.id):
-                sql = 'SELECT date, payer, payee FROM invoices WHERE invoice_number = %s'
-                self.date, self.payer, self.payee = db.query(sql, self.id, limit=1)[0]
-
-                sql = 'SELECT SUM(charge) FROM items WHERE item_code IN (SELECT item_code FROM invoice_items WHERE invoice_number = %s)'
-                self.amount = db.query(sql, self.id, limit=1)[0][0]
-            else:
+        row = identity_map.get('invoices', self.id)
+        if row is None:
+            with database() as db:
+                rows = Invoice._select(db, 'invoices.invoice_number = %s', self.id)
+            if not rows:
                 raise KeyError('No invoice with invoice id of {} exists within the database'.format(self.id))
-        self.payer, self.payee = Person(self.payer), Person(self.payee)
+            row = rows[0]
+        self._load(row)
+
+    def _load(self, row):
+        """Set the attributes of the invoice from a row selected by _select and remember the row for this request"""
+        self.id, self.date = row[0], row[1]
+        self.payer, self.payee = Invoice._person(row[2:5]), Invoice._person(row[5:8])
+        self.amount, self.item_count = row[8], row[9]
         self.name = '{:04d}'.format(self.id)
+        identity_map.add('invoices', self.id, row)
+
+    @staticmethod
+    def _person(row):
+        """Build the payer or payee of an invoice from the columns of a joined persons row"""
+        if row[1] is None:
+            raise KeyError('No person with the name {} exists within the database'.format(row[0]))
+        return Person._from_row(row)
+
+    @classmethod
+    def _from_row(cls, row):
+        """Build an invoice from a row selected by _select without querying the database"""
+        invoice = cls.__new__(cls)
+        invoice._load(row)
+        return invoice
+
+    @staticmethod
+    def _select(db, where, *variables, order='invoices.invoice_number', limit=None):
+        """Select the invoices satisfying the where clause joined with their payer and payee
+
+        db: the database to run the query on
+        where: a SQL condition to filter the invoices by
+        *variables: the items to place in the where clause in the place of %s
+        order: the SQL expression to order the invoices by
+        limit: the maximum amount of invoices to select
+        """
+        sql = """SELECT invoices.invoice_number, invoices.date,
+                        invoices.payer, payer.address, payer.email,
+                        invoices.payee, payee.address, payee.email,
+                        invoices.amount, invoices.item_count
+                 FROM invoices
+                 LEFT JOIN persons payer ON payer.person_name = invoices.payer
+                 LEFT JOIN persons payee ON payee.person_name = invoices.payee
+                 WHERE {}
+                 ORDER BY {}""".format(where, order)
+        if limit is not None:
+            sql += ' LIMIT {:d}'.format(limit)
+        return db.query(sql, *variables)
 
     @staticmethod
     def get_invoice_count():
@@ -50,48 +92,127 @@ class Invoice(object):
     def get_last_invoice():
         """Returns the last lodged invoice"""
         with database() as db:
-            if db.exists('invoices'):
-                return Invoice(db.query("SELECT MAX(invoice_number) FROM invoices")[0][0])
+            rows = Invoice._select(db, """invoices.invoice_number = (SELECT invoice_number FROM invoices
+                                                                     ORDER BY invoice_number DESC LIMIT 1)""")
+        if rows:
+            return Invoice._from_row(rows[0])
+
+    @classmethod
+    def get_many(cls, invoice_ids, strict=True):
+        """Retrieve the invoices with the given invoice ids using a single query
+
+        strict: whether to raise an error for invoice ids which do not exist, otherwise they are given as None
+
+        Returns a list of Invoice instances in the order of the invoice ids given
+        Raises a KeyError if strict and any of the invoice ids do not exist within the database
+        """
+        invoice_ids = [int(invoice_id) for invoice_id in invoice_ids]
+        rows, unloaded = identity_map.get_many('invoices', invoice_ids)
+        if unloaded:
+            with database() as db:
+                rows.update((row[0], row) for row in cls._select(db, 'invoices.invoice_number = ANY(%s)', unloaded))
+        invoices = {invoice_id: cls._from_row(row) for invoice_id, row in rows.items()}
+
+        missing = [str(invoice_id) for invoice_id in invoice_ids if invoice_id not in invoices]
+        if missing and strict:
+            raise KeyError('No invoices with invoice ids of {} exist within the database'.format(', '.join(missing)))
+        return [invoices.get(invoice_id) for invoice_id in invoice_ids]
 
     @staticmethod
     def get_all(start=1, end=None):
         """Retrieve all the invoices that are stored in the database
-        If start and end are specified it will only retrieve that range of invoices from the database
+        If start and end are specified it will only retrieve the invoices with ids after start up to and including end
 
         Returns a list of Invoice instances
         """
-        if end is None:
-            end = Invoice.get_invoice_count()
         with database() as db:
-            return [Invoice(inv_id) for inv_id in range(start + 1, end + 1)]
+            if end is None:
+                rows = Invoice._select(db, 'invoices.invoice_number > %s', start)
+            else:
+                rows = Invoice._select(db, 'invoices.invoice_number > %s AND invoices.invoice_number <= %s',
+                                       start, end)
+        return [Invoice._from_row(row) for row in rows]
+
+    @classmethod
+    def get_page(cls, cursor=None, size=5):
+        """Retrieve a page of invoices, newest first, along with their items using two queries
+
+        cursor: the cursor token of the page to retrieve, or None for the first page
+
+        Returns a pagination Page of Invoice instances
+        Raises a ValueError if the cursor is not a valid cursor token
+        """
+        with database() as db:
+            def select(where, *variables, **options):
+                return cls._select(db, where, *variables, **options)
+            page = pagination.paginate(select, 'invoices.invoice_number', cursor, size, descending=True,
+                                       key_type=int)
+        page.items = [cls._from_row(row) for row in page.items]
+        cls.load_items(page.items)
+        return page
+
+    @staticmethod
+    def load_items(invoices):
+        """Load the items of many invoices with a single query so accessing their items does not query again"""
+        by_id = {invoice.id: invoice for invoice in invoices}
+        for invoice in invoices:
+            invoice._items = []
+        if not by_id:
+            return
+        with database() as db:
+            rows = db.query("""SELECT invoice_items.invoice_number, items.item_code, items.date, items.description,
+                                      items.charge
+                               FROM invoice_items JOIN items ON items.item_code = invoice_items.item_code
+                               WHERE invoice_items.invoice_number = ANY(%s)""", list(by_id))
+        for row in rows:
+            by_id[row[0]]._items.append(Item._from_row(row[1:]))
 
     @classmethod
     def create(cls, date, payer, payee, items):
-        """Insert a new invoice into the database and return the instance"""
+        """Insert a new invoice into the database and return the instance
+
+        Raises a KeyError naming every item code which does not exist within the database, in which case no invoice
+        is created
+        """
+        codes = list(dict.fromkeys(items))
         with database() as db:
-            # Calculate the next invoice id
-            max = db.query('SELECT MAX(invoice_number) FROM invoices')[0][0]
-            id = int(max) + 1 if max is not None else 1
+            found = {row[0] for row in db.query('SELECT item_code FROM items WHERE item_code = ANY(%s)', codes)}
+            missing = [code for code in codes if code not in found]
+            if missing:
+                raise KeyError('No items with ids of {} exist, thus invoice creation canceled'
+                               .format(', '.join(missing)))
 
-            sql = 'INSERT INTO invoices (invoice_number, date, payer, payee) VALUES (%s, %s, %s, %s)'
-            db.query(sql, id, date, payer, payee)
+            # The invoice number is issued by the invoice_number_seq sequence
+            sql = 'INSERT INTO invoices (date, payer, payee) VALUES (%s, %s, %s) RETURNING invoice_number'
+            id = db.query(sql, date, payer, payee)[0][0]
+            db.query_values('INSERT INTO invoice_items (item_code, invoice_number) VALUES %s',
+                            [(code, id) for code in codes])
 
-            for item in items:
-                if db.exists('items', item_code=item):
-                    sql = 'INSERT INTO invoice_items (item_code, invoice_number) VALUES (%s, %s)'
-                    db.query(sql, item, id)
-                else:
-                    raise KeyError('No item with id of {} exists, thus invoice creation canceled'.format(item))
-        return Invoice(id)
+            # Store the totals of the items attached to the invoice
+            db.query("""UPDATE invoices SET (amount, item_count) =
+                            (SELECT COALESCE(SUM(items.charge), 0), COUNT(*) FROM invoice_items
+                             JOIN items ON items.item_code = invoice_items.item_code
+                             WHERE invoice_items.invoice_number = %s)
+                        WHERE invoice_number = %s""", id, id)
+            versions.bump(db, [id])
+        identity_map.discard('invoices', id)
+        invoice = Invoice(id)
+        # Render the PDF in the background so it is ready by the time it is first viewed
+        if has_app_context():
+            pdf_service.service.prerender(invoice.id, invoice.html())
+        return invoice
 
     def delete(self):
-        """Remove the invoice from the database and it's links to items"""
+        """Remove the invoice from the database along with it's items and links to items"""
         with database() as db:
-            items = db.query('SELECT item_code FROM invoice_items WHERE invoice_number = %s', self.id)
-            db.query('DELETE FROM invoice_items WHERE invoice_number = %s', self.id)
+            rows = db.query('DELETE FROM invoice_items WHERE invoice_number = %s RETURNING item_code', self.id)
+            items = [row[0] for row in rows]
             db.query('DELETE FROM invoices WHERE invoice_number = %s', self.id)
-            for item in items:
-                db.query('DELETE FROM items WHERE item_code = %s', item[0])
+            db.query('DELETE FROM items WHERE item_code = ANY(%s)', items)
+            versions.bump(db, [self.id])
+        identity_map.discard('invoices', self.id)
+        for item in items:
+            identity_map.discard('items', item)
         self.delete_pdf()
 
     @property
@@ -108,42 +229,48 @@ class Invoice(object):
 
         Returns a list of Item instances
         """
+        if '_items' in self.__dict__:
+            return self._items
         with database() as db:
-            return [Item(item[0])
-                    for item in db.query('SELECT item_code FROM invoice_items WHERE invoice_number = %s', self.id)]
+            rows = Item._select(db, 'item_code IN (SELECT item_code FROM invoice_items WHERE invoice_number = %s)',
+                                self.id)
+        return [Item._from_row(row) for row in rows]
 
     def build_pdf(self):
-        """Creates and exports a PDF version of the invoice"""
-        with open(self.pdf_file, 'wb+') as output:
-            CreatePDF(self.html(), dest=output)
+        """Creates a PDF version of the invoice in memory and returns it's bytes
+
+        The PDF is taken from the PDF cache if the invoice has not changed since it was last rendered, otherwise it
+        is rendered by the PDF rendering service, joining a render of the invoice which is already in progress
+        """
+        return pdf_service.service.render(self.id, self.html())
 
     def delete_pdf(self):
-        """Deletes the pdf copy of the invoice"""
-        try:
-            os_remove(self.pdf_file)
-        except OSError:
-            pass
+        """Deletes the cached pdf copies of the invoice"""
+        pdf_cache.cache.invalidate(self.id)
 
     def pdf(self):
-        """Builds and opens the PDF file of the invoice and returns it's bytes in a http inline format"""
-        self.build_pdf()
-        with open(self.pdf_file, 'rb') as pdf:
-            return pdf.read(), 200, {'Content-Type': 'application/pdf',
-                                     'Content-Disposition': 'inline; filename="Invoice #{}.pdf"'.format(self.name)}
+        """Builds the PDF of the invoice and returns it's bytes in a http inline format"""
+        disposition = 'inline; filename="Invoice #{}.pdf"'.format(self.name)
+        return self.build_pdf(), 200, {'Content-Type': 'application/pdf', 'Content-Disposition': disposition}
 
     def download(self):
-        """Builds and opens the PDF file of the invoice and returns it's bytes in a http attachment format"""
-        self.build_pdf()
-        with open(self.pdf_file, 'rb') as pdf:
-            return pdf.read(), 200, {'Content-Type': 'application/pdf',
-                                     'Content-Disposition': 'attachment; filename="Invoice #{}.pdf"'.format(self.name)}
+        """Builds the PDF of the invoice and returns it's bytes in a http attachment format"""
+        disposition = 'attachment; filename="Invoice #{}.pdf"'.format(self.name)
+        return self.build_pdf(), 200, {'Content-Type': 'application/pdf', 'Content-Disposition': disposition}
 
     def html(self):
         """Renders the invoice html template providing the details of the invoice"""
         return render_template('invoices/invoice.html', invoice=self)
 
     def email(self, body):
-        """Builds a PDF of this invoice and attaches it to an invoice
+        """Queue an email of this invoice in the outbox to be sent by the outbox worker
+
+        Returns the id of the message in the outbox
+        """
+        return outbox.enqueue(self.id, body)
+
+    def send_email(self, body, pdf=None):
+        """Builds a PDF of this invoice, unless the bytes of the PDF are given, and sends it in an email
 
         Email:
         - From: Payee
@@ -151,30 +278,34 @@ class Invoice(object):
         - Subject: Invoice {invoicename}
         - Body: the body parameter provided
         """
-        self.build_pdf()
+        if pdf is None:
+            pdf = self.build_pdf()
         with Email(self.payer.email, self.payee.email, 'Invoice {}'.format(self.name)) as email:
-            email.attach_pdf(self.pdf_file, 'Invoice #{}'.format(self.name))
+            email.attach_pdf(pdf, 'Invoice #{}'.format(self.name))
             email.set_body(body)
             email.send()
-        return 'Email Sent!'
+
+    @classmethod
+    def email_many(cls, invoice_ids, body):
+        """Queue emails of many invoices with the same body in the outbox to be sent by the outbox worker
+
+        invoice_ids: the ids of the invoices to email
+        body: the body of every email
+
+        Returns a list of tuples of each invoice id, the id of its message in the outbox and None, or None and the
+        error which prevented queueing it, including invoice ids which do not exist
+        """
+        invoice_ids = [int(invoice_id) for invoice_id in invoice_ids]
+        results = []
+        for invoice_id, invoice in zip(invoice_ids, cls.get_many(invoice_ids, strict=False)):
+            if invoice is None:
+                results.append((invoice_id, None,
+                                'No invoice with invoice id of {} exists within the database'.format(invoice_id)))
+            else:
+                results.append((invoice_id, invoice.email(body), None))
+        return results
 
     @staticmethod
     def statistics():
-        """Builds a pylab plot with information about all invoices in the database"""
-        dates = []
-        costs = []
-        pylab.xkcd()
-        pylab.figure()
-        for invoice in Invoice.get_all():
-            dates.append(invoice.id)
-            costs.append(invoice.amount)
-        pylab.legend(('Invoice Amounts',))
-        pylab.plot(dates, costs, marker='o', label='Charge')
-        pylab.xlabel('Invoice Number')
-        pylab.ylabel('Money')
-        pylab.legend(loc=2)
-        ax = pylab.axes()
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.tick_params(axis=u'both', which=u'both', length=0)
-        return pylab
+        """Builds a matplotlib figure with information about all invoices in the database"""
+        return charts.invoice_figure(*charts.invoice_series())
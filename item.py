@@ -1,5 +1,10 @@
-import pylab
+import datetime
 
+import charts
+import identity_map
+import pagination
+import pdf_cache
+import versions
 from database import database
 
 
@@ -17,65 +22,259 @@ class Item(object):
         and amount retrieved from the database
         """
         self.code = item_code
-        with database() as db:
-            if db.exists('items', item_code=self.code):
-                sql = 'SELECT date, description, charge FROM items WHERE item_code = %s'
-                self.date, self.description, self.amount = db.query(sql, self.code, limit=1)[0]
-            else:
+        row = identity_map.get('items', self.code)
+        if row is None:
+            with database() as db:
+                rows = Item._select(db, 'item_code = %s', self.code)
+            if not rows:
                 raise KeyError('No item with item code of {} exists within the database'.format(self.code))
+            row = rows[0]
+        self._load(row)
+
+    def _load(self, row):
+        """Set the attributes of the item from a row of the items table and remember the row for this request"""
+        self.code, self.date, self.description, self.amount = row
+        identity_map.add('items', self.code, row)
+
+    @classmethod
+    def _from_row(cls, row):
+        """Build an item from a row of the items table without querying the database"""
+        item = cls.__new__(cls)
+        item._load(row)
+        return item
+
+    @staticmethod
+    def _select(db, where, *variables, order=None, limit=None):
+        """Select the rows of the items table satisfying the where clause
+
+        db: the database to run the query on
+        where: a SQL condition to filter the items by
+        *variables: the items to place in the where clause in the place of %s
+        order: the SQL expression to order the items by
+        limit: the maximum amount of items to select
+        """
+        sql = 'SELECT item_code, date, description, charge FROM items WHERE ' + where
+        if order is not None:
+            sql += ' ORDER BY ' + order
+        if limit is not None:
+            sql += ' LIMIT {:d}'.format(limit)
+        return db.query(sql, *variables)
 
     @staticmethod
-    def _generate_code():
-        import random, string
-        return ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(4))
+    def reserve_codes(count):
+        """Reserve a block of unused item codes from the item code sequence, such as for a bulk import
+
+        The codes are never issued again, so items can be inserted with them without checking for collisions
+        Returns a list of count item codes
+        """
+        codes = []
+        with database() as db:
+            # Skip any codes already taken by items which were given a code before the sequence existed
+            sql = """SELECT code FROM (SELECT item_code(nextval('item_code_seq')) AS code
+                                       FROM generate_series(1, %s)) reserved
+                     WHERE code NOT IN (SELECT item_code FROM items)"""
+            while len(codes) < count:
+                codes.extend(row[0] for row in db.query(sql, count - len(codes)))
+        return codes
 
     @classmethod
     def create(cls, date, description, charge):
         """Create a new item with the given information
 
-        Generate a random item code and associate it with the information provided in the database"""
+        The item code is issued by the database from the item code sequence"""
         with database() as db:
-            # Generate a new item code until one is generated which is not already in use
-            id = cls._generate_code()
-            while db.exists('items', item_code=id):
-                id = cls._generate_code()
-
-            # Insert the new item into the database
-            sql = 'INSERT INTO items (item_code, date, description, charge) VALUES (%s, %s, %s, %s)'
-            db.query(sql, id, date, description, charge)
+            sql = """INSERT INTO items (date, description, charge) VALUES (%s, %s, %s)
+                     ON CONFLICT (item_code) DO NOTHING RETURNING item_code"""
+            rows = db.query(sql, date, description, charge)
+            # Only a code given to an item before the sequence existed can conflict, in which case take the next code
+            while not rows:
+                rows = db.query(sql, date, description, charge)
+            id = rows[0][0]
+            versions.bump(db)
+        identity_map.discard('items', id)
         return cls(id)
 
     def delete(self):
         """Delete an item from the database"""
         with database() as db:
+            self._lock(db)
+            invoices = self._forget(db)
+            # Remove the item from the totals of the invoice including it
+            db.query("""UPDATE invoices
+                        SET amount = invoices.amount - items.charge, item_count = invoices.item_count - 1
+                        FROM invoice_items, items
+                        WHERE invoice_items.invoice_number = invoices.invoice_number
+                        AND items.item_code = invoice_items.item_code AND items.item_code = %s""", self.code)
             sql = 'DELETE FROM items WHERE item_code = %s'
             db.query(sql, self.code)
+            versions.bump(db, invoices)
+
+    @classmethod
+    def get_many(cls, item_codes):
+        """Retrieve the items with the given item codes using a single query
+
+        Returns a list of Item instances in the order of the item codes given
+        Raises a KeyError if any of the item codes do not exist within the database
+        """
+        item_codes = list(item_codes)
+        rows, unloaded = identity_map.get_many('items', item_codes)
+        if unloaded:
+            with database() as db:
+                rows.update((row[0], row) for row in cls._select(db, 'item_code = ANY(%s)', unloaded))
+        items = {code: cls._from_row(row) for code, row in rows.items()}
+
+        missing = [code for code in item_codes if code not in items]
+        if missing:
+            raise KeyError('No items with item codes of {} exist within the database'.format(', '.join(missing)))
+        return [items[code] for code in item_codes]
 
     @staticmethod
     def get_all():
         """Retrieve an instance of all items that are currently stored in the database"""
         with database() as db:
-            return [Item(item[0]) for item in db.query('SELECT item_code FROM items')]
+            return [Item._from_row(row) for row in Item._select(db, 'TRUE')]
+
+    @classmethod
+    def get_page(cls, cursor=None, size=100):
+        """Retrieve a page of items ordered by item code using a single query
+
+        cursor: the cursor token of the page to retrieve, or None for the first page
+
+        Returns a pagination Page of Item instances
+        Raises a ValueError if the cursor is not a valid cursor token
+        """
+        with database() as db:
+            def select(where, *variables, **options):
+                return cls._select(db, where, *variables, **options)
+            page = pagination.paginate(select, 'item_code', cursor, size, key_type=str)
+        page.items = [cls._from_row(row) for row in page.items]
+        return page
+
+    @staticmethod
+    def iterate_dicts(itersize=1000):
+        """Yield the dictionary representation of every item ordered by item code as they are fetched
+
+        The items are streamed from a server-side cursor and are not remembered for the request, so iterating every
+        item uses the same memory no matter how many items there are
+        """
+        sql = """SELECT item_code AS code, date, description, charge AS amount FROM items
+                 ORDER BY item_code"""
+        with database() as db:
+            yield from db.iterate(sql, itersize=itersize, rows='dict')
 
     @staticmethod
     def get_unlogged():
         """Retrieve an instance of all items which have not been added to an invoice currently in the database"""
         with database() as db:
-            sql = 'SELECT item_code FROM items WHERE item_code NOT IN (SELECT item_code FROM invoice_items)'
-            return [Item(item[0]) for item in db.query(sql)]
+            rows = Item._select(db, 'item_code NOT IN (SELECT item_code FROM invoice_items)')
+            return [Item._from_row(row) for row in rows]
 
     def update(self, date=None, description=None, charge=None):
         """Update the values of the attributes which are not empty or None"""
+        item, = Item.update_many({self.code: {'date': date, 'description': description, 'charge': charge}})
+        self.date, self.description, self.amount = item.date, item.description, item.amount
+
+    @classmethod
+    def update_many(cls, changes):
+        """Update the attributes of many items with a single set-based UPDATE in one transaction
+
+        changes: a dictionary of item codes to dictionaries of the new date, description and charge of the item,
+                 attributes which are missing, empty or None are left unchanged
+
+        Returns a list of the updated Item instances in the order of the item codes given
+        Raises a KeyError if any of the item codes do not exist within the database, in which case nothing is updated
+        Raises a ValueError if an item code or description is not a string, a date is not a date or of the form
+        YYYY-MM-DD or a charge is not a number
+        """
+        codes = list(changes)
+        if not codes:
+            return []
+        if not all(isinstance(code, str) for code in codes):
+            raise ValueError('Item codes must be strings')
+
+        def new_values(attribute):
+            return [None if changes[code].get(attribute) == '' else changes[code].get(attribute) for code in codes]
+
+        def parse_date(date):
+            if date is None or isinstance(date, datetime.date):
+                return date
+            try:
+                return datetime.datetime.strptime(str(date).strip(), '%Y-%m-%d').date()
+            except ValueError:
+                raise ValueError('Date {!r} is not of the form YYYY-MM-DD'.format(date))
+
+        dates, descriptions, charges = new_values('date'), new_values('description'), new_values('charge')
+        dates = [parse_date(date) for date in dates]
+        if not all(description is None or isinstance(description, str) for description in descriptions):
+            raise ValueError('Descriptions of items must be strings')
+        try:
+            charges = [None if charge is None else float(charge) for charge in charges]
+        except TypeError:
+            raise ValueError('Charges of items must be numbers')
+        changes = list(zip(codes, dates, descriptions, charges))
+        # The changes as a table of the item code and the new values, where NULL leaves a value unchanged
+        changed = """(SELECT column1 AS item_code, column2 AS date, column3 AS description, column4 AS charge
+                      FROM (VALUES %s) AS changed) AS changes"""
+        template = '(%s, %s::date, %s, %s::double precision)'
+
         with database() as db:
-            if date:
-                db.query('UPDATE items SET date = %s where item_code = %s', date, self.code)
-                self.date = date
-            if description:
-                db.query('UPDATE items SET description = %s where item_code = %s', description, self.code)
-                self.description = description
-            if charge:
-                db.query('UPDATE items SET charge = %s where item_code = %s', charge, self.code)
-                self.amount = charge
+            # Lock the items in a consistent order so concurrent changes to the same invoice totals cannot deadlock
+            locked = {row[0] for row in db.query("""SELECT item_code FROM items WHERE item_code = ANY(%s)
+                                                    ORDER BY item_code FOR UPDATE""", codes)}
+            missing = [code for code in codes if code not in locked]
+            if missing:
+                raise KeyError('No items with item codes of {} exist within the database'.format(', '.join(missing)))
+            invoices = Item._forget_many(db, codes)
+
+            # Adjust the totals of the invoices including the items by the change in their charges
+            db.query_values("""UPDATE invoices SET amount = invoices.amount + delta.amount
+                               FROM (SELECT invoice_items.invoice_number, sum(changes.charge - items.charge) AS amount
+                                     FROM {} JOIN items ON items.item_code = changes.item_code
+                                     JOIN invoice_items ON invoice_items.item_code = changes.item_code
+                                     WHERE changes.charge IS NOT NULL
+                                     GROUP BY invoice_items.invoice_number) delta
+                               WHERE invoices.invoice_number = delta.invoice_number""".format(changed),
+                            changes, template)
+            rows = db.query_values("""UPDATE items SET date = coalesce(changes.date, items.date),
+                                                      description = coalesce(changes.description, items.description),
+                                                      charge = coalesce(changes.charge, items.charge)
+                                      FROM {} WHERE items.item_code = changes.item_code
+                                      RETURNING items.item_code, items.date, items.description, items.charge"""
+                                   .format(changed), changes, template)
+            versions.bump(db, invoices)
+        items = {row[0]: cls._from_row(row) for row in rows}
+        return [items[code] for code in codes]
+
+    def _lock(self, db):
+        """Lock the row of the item until the transaction ends so concurrent changes to the invoice totals the item
+        is part of are applied one after the other
+        """
+        db.query('SELECT charge FROM items WHERE item_code = %s FOR UPDATE', self.code)
+
+    def _forget(self, db):
+        """Forget everything derived from this item before it changes
+
+        Returns a list of the invoice numbers of the invoices which include the item
+        """
+        return Item._forget_many(db, [self.code])
+
+    @staticmethod
+    def _forget_many(db, item_codes):
+        """Forget everything derived from the items before they change
+
+        This is the rows of the items and invoice totals remembered for this request and the cached PDFs of the
+        invoices which include the items
+
+        Returns a list of the invoice numbers of the invoices which include the items
+        """
+        for code in item_codes:
+            identity_map.discard('items', code)
+        identity_map.discard('invoices')
+        invoices = [row[0] for row in db.query('SELECT DISTINCT invoice_number FROM invoice_items '
+                                               'WHERE item_code = ANY(%s)', list(item_codes))]
+        for invoice in invoices:
+            pdf_cache.cache.invalidate(invoice)
+        return invoices
 
     def __lt__(self, other):
         """The __lt__ magic method allows items to be sorted according to their date"""
@@ -92,13 +291,5 @@ class Item(object):
 
     @staticmethod
     def statistics():
-        """Generate a pylab figure demonstrating the amount charged for each item over time"""
-        dates = []
-        costs = []
-        pylab.figure()
-        for item in sorted(Item.get_all()):
-            dates.append(item.date)
-            costs.append(item.amount)
-        pylab.legend(('Item Charges',))
-        pylab.plot(dates, costs)
-        return pylab
+        """Generate a matplotlib figure demonstrating the amount charged for each item over time"""
+        return charts.item_figure(*charts.item_series())
@@ -0,0 +1,380 @@
+"""Load test of the web server with a realistic mix of routes driven by concurrent simulated users
+
+A server running work.py is started on a local port unless the URL of a running server is given. Each user repeatedly
+picks a route from the weighted mix, pages through the invoices, logs, views, edits and deletes items, downloads
+invoice PDFs and views the statistics charts until the duration is up.
+
+The latency of every route is recorded in a histogram of logarithmic buckets with a fixed relative precision, as an
+HDR histogram does, and reported along with the error rate and throughput of each route:
+    python loadtest.py --concurrency 16 --duration 60 --output results.json
+
+The invoices whose PDFs are downloaded are found by paging through the invoices of the server being tested. The items
+logged by the load test are deleted again, but the load test changes the database of the server, so run it against a
+development or staging server.
+"""
+import argparse
+import http.client
+import json
+import math
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+import pagination
+
+# The routes of the mix and their relative weights
+MIX = {
+    'GET /': 15,
+    'GET /invoices': 20,
+    'GET /api/item': 10,
+    'POST /api/item': 8,
+    'GET /api/item/<item>': 12,
+    'PUT /api/item/<item>': 6,
+    'DELETE /api/item/<item>': 6,
+    'GET /invoice/<invoice>.pdf': 13,
+    'GET /statistics/invoices.svg': 5,
+    'GET /statistics/items.svg': 5,
+}
+
+_INVOICE_PAGE = re.compile(r'href="/invoices\?cursor=([^"]+)"')
+_INVOICE_PDF = re.compile(r'href="/invoice/(\d+)\.pdf"')
+
+
+class Histogram(object):
+    """A histogram of latencies in microseconds with buckets of a fixed relative precision
+
+    Values below 2 ** precision microseconds are counted exactly, larger values are counted within buckets whose
+    width doubles with every power of two, so every value is recorded to within 2 ** -precision of itself while the
+    histogram stays small no matter how many values are recorded
+    """
+
+    def __init__(self, precision=7):
+        """Initialize an empty histogram
+
+        precision: the amount of bits of each value kept, 7 keeps values to within 1%
+        """
+        self.precision = precision
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, value):
+        """Return the lowest value of the bucket a value is counted within"""
+        shift = max(value.bit_length() - self.precision, 0)
+        return (value >> shift) << shift
+
+    def record(self, seconds):
+        """Count a latency given in seconds"""
+        value = max(int(seconds * 1000000), 0)
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """Add the counts of another histogram of the same precision to this histogram"""
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent):
+        """Return the latency in microseconds which the given percent of the values are at or below, or None if the
+        histogram is empty
+        """
+        if not self.count:
+            return None
+        rank = max(math.ceil(self.count * percent / 100), 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                # Report the highest value of the bucket, but never more than the largest value recorded
+                return min(bucket + (1 << max(bucket.bit_length() - self.precision, 0)) - 1, self.max)
+        return self.max
+
+    def dict(self):
+        """Return the dictionary representation of the histogram in milliseconds"""
+        def milliseconds(value):
+            return None if value is None else value / 1000
+        return {
+            'count': self.count,
+            'mean': milliseconds(self.total / self.count if self.count else None),
+            'min': milliseconds(self.min),
+            'max': milliseconds(self.max),
+            'percentiles': {str(percent): milliseconds(self.percentile(percent))
+                            for percent in (50, 75, 90, 95, 99, 99.9)},
+            'buckets': [[milliseconds(bucket), self.counts[bucket]] for bucket in sorted(self.counts)],
+        }
+
+
+class RouteStats(object):
+    """The latencies and errors of the requests of one route"""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.statuses = {}
+
+    def record(self, seconds, status):
+        """Record a request which took the given seconds and returned the status, or None if it failed to send"""
+        self.latency.record(seconds)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status is None or status >= 500:
+            self.errors += 1
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.errors += other.errors
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+
+class User(object):
+    """A simulated user sending requests from the mix one after the other over a persistent connection"""
+
+    def __init__(self, host, port, invoices, seed):
+        """Initialize the user
+
+        host, port: the address of the server
+        invoices: a list of invoice numbers of the server to download the PDFs of
+        seed: the seed of the random choices of the user
+        """
+        self.host, self.port = host, port
+        self.invoices = invoices
+        self.random = random.Random(seed)
+        self.connection = None
+        self.stats = {route: RouteStats() for route in MIX}
+        # The items logged by this user which have not been deleted, and the next page of invoices to view
+        self.items = []
+        self.next_page = None
+
+    def request(self, route, method, path, form=None):
+        """Send a request and record its latency and status against the route
+
+        Returns the body of the response, or None if the request failed
+        """
+        body = urllib.parse.urlencode(form) if form is not None else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if form is not None else {}
+        started = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            content = response.read()
+            status = response.status
+        except (http.client.HTTPException, OSError):
+            self.close()
+            content, status = None, None
+        self.stats[route].record(time.perf_counter() - started, status)
+        return content if status is not None and status < 400 else None
+
+    def step(self):
+        """Send the request of a route chosen at random from the mix"""
+        route = self.random.choices(list(MIX), weights=list(MIX.values()))[0]
+        if route.endswith('<item>') and not self.items:
+            route = 'POST /api/item'
+
+        if route == 'GET /':
+            self.request(route, 'GET', '/')
+        elif route == 'GET /invoices':
+            content = self.request(route, 'GET', self.next_page or '/invoices')
+            # Follow the link to the next page, or go back to the first page from the last page
+            self.next_page = next_page(content.decode('utf-8')) if content else None
+        elif route == 'GET /api/item':
+            self.request(route, 'GET', '/api/item?limit=100')
+        elif route == 'POST /api/item':
+            content = self.request(route, 'POST', '/api/item', {
+                'date': '2018-06-01', 'description': 'Load test item', 'charge': self.random.randint(1, 500)})
+            if content:
+                self.items.append(json.loads(content.decode('utf-8'))['code'])
+        elif route == 'GET /api/item/<item>':
+            self.request(route, 'GET', '/api/item/{}'.format(self.random.choice(self.items)))
+        elif route == 'PUT /api/item/<item>':
+            self.request(route, 'PUT', '/api/item/{}'.format(self.random.choice(self.items)),
+                         {'charge': self.random.randint(1, 500)})
+        elif route == 'DELETE /api/item/<item>':
+            self.request(route, 'DELETE', '/api/item/{}'.format(self.items.pop()))
+        elif route == 'GET /invoice/<invoice>.pdf':
+            if self.invoices:
+                self.request(route, 'GET', '/invoice/{}.pdf'.format(self.random.choice(self.invoices)))
+        else:
+            self.request(route, *route.split(' '))
+
+    def run(self, deadline):
+        """Send requests until the deadline, then delete the items left logged by this user"""
+        while time.monotonic() < deadline:
+            self.step()
+        while self.items:
+            self.request('DELETE /api/item/<item>', 'DELETE', '/api/item/{}'.format(self.items.pop()))
+        self.close()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def serve(host, port):
+    """Run the web server on the address with a thread for each connection"""
+    from werkzeug.serving import make_server
+    from work import app
+
+    make_server(host, port, app, threaded=True).serve_forever()
+
+
+def start_server(host, port, timeout=30):
+    """Start the web server in a new process and wait until it accepts connections
+
+    Returns the process of the server
+    """
+    process = subprocess.Popen([sys.executable, __file__, '--serve', '--host', host, '--port', str(port)])
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return process
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError('The server did not start listening on {}:{}'.format(host, port))
+            time.sleep(0.1)
+
+
+def next_page(content):
+    """Return the path of the page of invoices following the invoices page content, or None if it is the last page"""
+    for cursor in _INVOICE_PAGE.findall(content):
+        cursor = urllib.parse.unquote(cursor)
+        if pagination.decode_cursor(cursor)[0] == pagination.AFTER:
+            return '/invoices?' + urllib.parse.urlencode({'cursor': cursor})
+    return None
+
+
+def discover_invoices(host, port, limit=100):
+    """Find the numbers of up to limit invoices of the server being tested by paging through its invoices
+
+    Returns a list of invoice numbers
+    """
+    invoices, path = [], '/invoices'
+    connection = http.client.HTTPConnection(host, port, timeout=60)
+    try:
+        while path is not None and len(invoices) < limit:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            content = response.read().decode('utf-8')
+            if response.status != 200:
+                break
+            invoices.extend(int(invoice) for invoice in _INVOICE_PDF.findall(content) if int(invoice) not in invoices)
+            path = next_page(content)
+    finally:
+        connection.close()
+    return invoices[:limit]
+
+
+def load(host, port, concurrency, duration, seed=None):
+    """Run the load test with the given amount of concurrent users for the given seconds
+
+    Returns a dictionary of the results of each route and of every request together
+    """
+    invoices = discover_invoices(host, port)
+
+    seeds = random.Random(seed)
+    users = [User(host, port, invoices, seeds.random()) for _ in range(concurrency)]
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=user.run, args=(deadline,)) for user in users]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    routes = {route: RouteStats() for route in MIX}
+    total = RouteStats()
+    for user in users:
+        for route, stats in user.stats.items():
+            routes[route].merge(stats)
+            total.merge(stats)
+
+    def result(stats):
+        return {
+            'requests': stats.latency.count,
+            'errors': stats.errors,
+            'error_rate': stats.errors / stats.latency.count if stats.latency.count else 0,
+            'throughput': stats.latency.count / elapsed,
+            'statuses': {str(status): count for status, count in stats.statuses.items()},
+            'latency': stats.latency.dict(),
+        }
+    return {
+        'concurrency': concurrency,
+        'duration': elapsed,
+        'total': result(total),
+        'routes': {route: result(stats) for route, stats in routes.items() if stats.latency.count},
+    }
+
+
+def report(results):
+    """Print a table of the throughput, error rate and latency percentiles of each route"""
+    print('{:<30} {:>8} {:>8} {:>8} {:>9} {:>9} {:>9} {:>9}'.format(
+        'Route', 'Requests', 'Req/s', 'Errors', 'p50 ms', 'p90 ms', 'p99 ms', 'Max ms'))
+    rows = sorted(results['routes'].items()) + [('Total', results['total'])]
+    for route, result in rows:
+        percentiles = result['latency']['percentiles']
+        print('{:<30} {:>8} {:>8.1f} {:>7.1%} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            route, result['requests'], result['throughput'], result['error_rate'], percentiles['50'],
+            percentiles['90'], percentiles['99'], result['latency']['max']))
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Load test the web server with concurrent simulated users')
+    parser.add_argument('--url', help='the URL of a running server, otherwise a server is started locally')
+    parser.add_argument('--host', default='127.0.0.1', help='the address to start the local server on')
+    parser.add_argument('--port', type=int, default=5050, help='the port to start the local server on')
+    parser.add_argument('--concurrency', type=int, default=8, help='the amount of simulated users')
+    parser.add_argument('--duration', type=float, default=30, help='the seconds to send requests for')
+    parser.add_argument('--seed', type=int, help='the seed of the choices of the users, for repeatable runs')
+    parser.add_argument('--output', help='the file to write the results to as JSON')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    options = parser.parse_args(arguments)
+
+    if options.serve:
+        serve(options.host, options.port)
+        return 0
+
+    server = None
+    if options.url:
+        url = urllib.parse.urlsplit(options.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        host, port = options.host, options.port
+        server = start_server(host, port)
+    try:
+        results = load(host, port, options.concurrency, options.duration, options.seed)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report(results)
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    return 1 if results['total']['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""Versioned schema migrations applied on top of the tables created by database.create_tables
+
+Every migration is recorded in the schema_migrations table once it has been applied, so migrate can be run against
+an existing database any number of times and only applies the versions the database is missing.
+"""
+import sqlite_backend
+import totals
+
+
+# The tables given a primary key of a single column by add_primary_keys and their key columns
+KEYS = [('persons', 'person_name'), ('items', 'item_code'), ('invoices', 'invoice_number')]
+
+
+def duplicate_keys(connection, table, column):
+    """Return a sorted list of the values of a column which appear in more than one row of a table"""
+    return [row[0] for row in connection.query('SELECT {1} FROM {0} GROUP BY {1} HAVING COUNT(*) > 1 ORDER BY {1}'
+                                               .format(table, column))]
+
+
+def add_primary_keys(connection):
+    """Give every table a primary key, removing duplicated invoice item links which would violate it
+
+    Duplicated persons, items and invoices cannot be merged automatically, so if there are any a ValueError listing
+    them is raised before anything is changed. Rename or delete the duplicated rows by hand and migrate again.
+    """
+    duplicates = []
+    for table, column in KEYS:
+        keys = duplicate_keys(connection, table, column)
+        if keys:
+            duplicates.append('{} {}'.format(table, ', '.join(str(key) for key in keys)))
+    if duplicates:
+        raise ValueError('Duplicated keys must be removed before adding primary keys: {}'.format('; '.join(duplicates)))
+    connection.query("""DELETE FROM invoice_items duplicate USING invoice_items original
+                        WHERE duplicate.ctid > original.ctid
+                        AND duplicate.item_code = original.item_code
+                        AND duplicate.invoice_number = original.invoice_number""")
+    for table, column in KEYS:
+        connection.query('ALTER TABLE {} ADD PRIMARY KEY ({})'.format(table, column))
+    # Leading with the invoice number allows the key to serve lookups of the items of an invoice
+    connection.query('ALTER TABLE invoice_items ADD PRIMARY KEY (invoice_number, item_code)')
+
+
+def add_foreign_keys(connection):
+    """Constrain invoice item links to existing items and invoices, removing links which no longer have either"""
+    connection.query("""DELETE FROM invoice_items
+                        WHERE item_code NOT IN (SELECT item_code FROM items)
+                        OR invoice_number NOT IN (SELECT invoice_number FROM invoices)""")
+    connection.query("""ALTER TABLE invoice_items ADD CONSTRAINT invoice_items_item_code_fkey
+                        FOREIGN KEY (item_code) REFERENCES items (item_code) ON DELETE CASCADE""")
+    connection.query("""ALTER TABLE invoice_items ADD CONSTRAINT invoice_items_invoice_number_fkey
+                        FOREIGN KEY (invoice_number) REFERENCES invoices (invoice_number) ON DELETE CASCADE""")
+
+
+def add_invoice_item_indexes(connection):
+    """Index the invoice item links by item code for finding the invoice of an item and the unlogged items"""
+    connection.query('CREATE INDEX IF NOT EXISTS invoice_items_item_code_idx ON invoice_items (item_code)')
+
+
+def add_invoice_number_sequence(connection):
+    """Issue invoice numbers from a sequence starting after the largest existing invoice number"""
+    connection.query('CREATE SEQUENCE IF NOT EXISTS invoice_number_seq OWNED BY invoices.invoice_number')
+    connection.query("""SELECT setval('invoice_number_seq', COALESCE(MAX(invoice_number), 0) + 1, false)
+                        FROM invoices""")
+    connection.query("ALTER TABLE invoices ALTER COLUMN invoice_number SET DEFAULT nextval('invoice_number_seq')")
+
+
+def add_item_code_sequence(connection):
+    """Issue item codes from a sequence through the item_code function
+
+    Numbers within the four character keyspace are scattered by multiplying with a constant coprime to it so codes do
+    not read as consecutive, numbers beyond it are encoded directly in five or more characters so codes never repeat.
+    """
+    connection.query('CREATE SEQUENCE IF NOT EXISTS item_code_seq')
+    connection.query("""CREATE OR REPLACE FUNCTION item_code(number bigint) RETURNS text AS $$
+                        DECLARE
+                            digits CONSTANT text := '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ';
+                            remaining bigint := CASE WHEN number < 1679616 THEN mod(number * 1234577, 1679616)
+                                                     ELSE number END;
+                            code text := '';
+                        BEGIN
+                            LOOP
+                                code := substr(digits, mod(remaining, 36)::integer + 1, 1) || code;
+                                remaining := remaining / 36;
+                                EXIT WHEN remaining = 0 AND length(code) >= 4;
+                            END LOOP;
+                            RETURN code;
+                        END
+                        $$ LANGUAGE plpgsql IMMUTABLE""")
+    connection.query("ALTER TABLE items ALTER COLUMN item_code SET DEFAULT item_code(nextval('item_code_seq'))")
+
+
+def add_invoice_totals(connection):
+    """Store the amount and item count of each invoice on the invoice row, calculated from the existing items"""
+    connection.query("""ALTER TABLE invoices ADD COLUMN IF NOT EXISTS amount double precision NOT NULL DEFAULT 0,
+                        ADD COLUMN IF NOT EXISTS item_count integer NOT NULL DEFAULT 0""")
+    totals.rebuild(connection)
+
+
+def add_email_outbox(connection):
+    """Create the outbox of invoice emails waiting to be delivered by the outbox worker"""
+    connection.query("""CREATE TABLE IF NOT EXISTS email_outbox (
+                        id serial PRIMARY KEY,
+                        invoice_number integer NOT NULL REFERENCES invoices (invoice_number) ON DELETE CASCADE,
+                        body text NOT NULL,
+                        dedupe_key text NOT NULL,
+                        status text NOT NULL DEFAULT 'pending',
+                        attempts integer NOT NULL DEFAULT 0,
+                        last_error text,
+                        created_at timestamp NOT NULL DEFAULT now(),
+                        next_attempt_at timestamp NOT NULL DEFAULT now(),
+                        sent_at timestamp)""")
+    # Only one message with the same invoice and body may be waiting to be delivered at a time
+    connection.query("""CREATE UNIQUE INDEX IF NOT EXISTS email_outbox_dedupe_key_idx ON email_outbox (dedupe_key)
+                        WHERE status IN ('pending', 'sending')""")
+    connection.query("""CREATE INDEX IF NOT EXISTS email_outbox_due_idx ON email_outbox (next_attempt_at)
+                        WHERE status IN ('pending', 'sending')""")
+
+
+def add_data_versions(connection):
+    """Create the table of the version stamps of the data pages are rendered from, used for conditional requests"""
+    connection.query("""CREATE TABLE IF NOT EXISTS data_versions (
+                        name text PRIMARY KEY,
+                        version bigint NOT NULL DEFAULT 1,
+                        modified_at timestamp with time zone NOT NULL DEFAULT now())""")
+
+
+# The ordered list of migrations as tuples of the version, a description and the function applying it
+MIGRATIONS = [
+    (1, 'Add primary keys', add_primary_keys),
+    (2, 'Add foreign keys to invoice items', add_foreign_keys),
+    (3, 'Index invoice items by item code', add_invoice_item_indexes),
+    (4, 'Issue invoice numbers from a sequence', add_invoice_number_sequence),
+    (5, 'Issue item codes from a sequence', add_item_code_sequence),
+    (6, 'Store invoice totals on invoices', add_invoice_totals),
+    (7, 'Add the email outbox', add_email_outbox),
+    (8, 'Add data version stamps', add_data_versions),
+]
+
+
+def create_migrations_table(connection):
+    connection.query("""CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version integer PRIMARY KEY,
+                        description text NOT NULL,
+                        applied_at timestamp NOT NULL DEFAULT now());""")
+
+
+def applied_versions(connection):
+    """Return the set of migration versions which have been applied to the database"""
+    return {row[0] for row in connection.query('SELECT version FROM schema_migrations')}
+
+
+def migrate(connection):
+    """Apply every migration which has not yet been applied to the database in order of version
+
+    Each migration is committed along with its record in schema_migrations, so a failing migration leaves the
+    previous versions applied. Concurrent runs are serialised by locking the schema_migrations table.
+
+    SQLite databases are created with the schema the migrations up to sqlite_backend.SCHEMA_VERSION leave behind, so
+    those migrations are only recorded. SQLite serialises writers itself, so the table is not locked.
+
+    Returns a list of tuples of the version and description of each migration newly recorded, and whether it was
+    applied rather than only recorded as the SQLite schema already includes it
+    """
+    create_migrations_table(connection)
+    connection.commit()
+
+    sqlite = connection.dialect == 'sqlite'
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        if not sqlite:
+            connection.query('LOCK TABLE schema_migrations IN EXCLUSIVE MODE')
+        if version in applied_versions(connection):
+            connection.rollback()
+            continue
+        apply_migration = not sqlite or version > sqlite_backend.SCHEMA_VERSION
+        if apply_migration:
+            apply(connection)
+        connection.query('INSERT INTO schema_migrations (version, description) VALUES (%s, %s)', version, description)
+        connection.commit()
+        applied.append((version, description, apply_migration))
+    return applied
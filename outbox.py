@@ -0,0 +1,154 @@
+"""A durable queue of invoice emails stored in the email_outbox table
+
+Emailing an invoice only adds a message to the outbox, which is delivered by running this file as a separate worker
+process. Messages which fail to send are retried with an exponential backoff until they have been attempted the
+maximum amount of times.
+"""
+import hashlib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from database import database
+
+# The states of a message, pending and sending messages are still to be delivered
+PENDING, SENDING, SENT, FAILED = 'pending', 'sending', 'sent', 'failed'
+
+
+def dedupe_key(invoice_id, body):
+    """Return the key identifying messages with the same invoice and body"""
+    return hashlib.sha256('{}\n{}'.format(invoice_id, body).encode('utf-8')).hexdigest()
+
+
+def enqueue(invoice_id, body):
+    """Add an email of the invoice with the given body to the outbox
+
+    A message with the same invoice and body which is yet to be delivered is not added again
+
+    Returns the id of the message in the outbox
+    """
+    key = dedupe_key(invoice_id, body)
+    with database() as db:
+        rows = db.query("""INSERT INTO email_outbox (invoice_number, body, dedupe_key) VALUES (%s, %s, %s)
+                           ON CONFLICT (dedupe_key) WHERE status IN ('pending', 'sending') DO NOTHING
+                           RETURNING id""", invoice_id, body, key)
+        if not rows:
+            rows = db.query("""SELECT id FROM email_outbox
+                               WHERE dedupe_key = %s AND status IN ('pending', 'sending')""", key)
+    return rows[0][0]
+
+
+def status(message_id):
+    """Return a dictionary of the delivery status of a message, or None if there is no message with the id"""
+    with database() as db:
+        rows = db.query("""SELECT id, invoice_number, status, attempts, last_error, created_at, next_attempt_at,
+                                  sent_at
+                           FROM email_outbox WHERE id = %s""", message_id)
+    if not rows:
+        return None
+    keys = ('id', 'invoice', 'status', 'attempts', 'error', 'created', 'next_attempt', 'sent')
+    return dict(zip(keys, rows[0]))
+
+
+def claim(db, limit, lease, invoice_ids=None):
+    """Claim pending messages which are due to be sent so no other worker sends them
+
+    Messages claimed by a worker which has not reported back within the lease are claimed again
+
+    db: the database to run the query on, committed straight away so the claim is seen by other workers
+    limit: the maximum amount of messages to claim
+    lease: the amount of seconds other workers leave the claimed messages alone for
+    invoice_ids: if given only the messages of these invoices are claimed
+
+    Returns a list of tuples of the message id, invoice number, body and the amount of attempts including this one
+    """
+    invoices, variables = '', (lease, limit)
+    if invoice_ids is not None:
+        invoices, variables = 'AND invoice_number = ANY(%s)', (lease, list(invoice_ids), limit)
+    rows = db.query("""UPDATE email_outbox
+                       SET status = 'sending', attempts = attempts + 1,
+                           next_attempt_at = now() + %s * interval '1 second'
+                       WHERE id IN (SELECT id FROM email_outbox
+                                    WHERE status IN ('pending', 'sending') AND next_attempt_at <= now() {}
+                                    ORDER BY next_attempt_at LIMIT %s
+                                    FOR UPDATE SKIP LOCKED)
+                       RETURNING id, invoice_number, body, attempts""".format(invoices), *variables)
+    db.commit()
+    return rows
+
+
+def backoff(attempts, base, maximum):
+    """Return the seconds to wait before the next attempt after the given amount of failed attempts"""
+    return min(base * 2 ** (attempts - 1), maximum)
+
+
+def record(db, message_id, attempts, error=None):
+    """Record the outcome of an attempt at sending a message
+
+    error: None if the message was sent, otherwise a description of why it failed
+    """
+    if error is None:
+        db.query("UPDATE email_outbox SET status = 'sent', sent_at = now(), last_error = NULL WHERE id = %s",
+                 message_id)
+    elif attempts >= getattr(config, 'outbox_max_attempts', 8):
+        db.query("UPDATE email_outbox SET status = 'failed', last_error = %s WHERE id = %s", error, message_id)
+    else:
+        delay = backoff(attempts, getattr(config, 'outbox_retry_delay', 30), getattr(config, 'outbox_retry_max', 3600))
+        db.query("""UPDATE email_outbox SET status = 'pending', last_error = %s,
+                    next_attempt_at = now() + %s * interval '1 second' WHERE id = %s""", error, delay, message_id)
+
+
+def process(send, limit=None, concurrency=None, invoice_ids=None):
+    """Claim and send a batch of due messages
+
+    send: a function sending the email of an invoice number with a body
+    limit: the maximum amount of messages to send
+    concurrency: the maximum amount of messages sent at the same time
+    invoice_ids: if given only the messages of these invoices are sent
+
+    Returns the amount of messages attempted
+    """
+    limit = limit or getattr(config, 'outbox_batch_size', 20)
+    concurrency = concurrency or getattr(config, 'email_concurrency', 4)
+    with database() as db:
+        messages = claim(db, limit, getattr(config, 'outbox_lease', 300), invoice_ids)
+
+    def attempt(message):
+        message_id, invoice_id, body, attempts = message
+        try:
+            send(invoice_id, body)
+        except Exception as error:
+            return message_id, attempts, str(error) or type(error).__name__
+        return message_id, attempts, None
+
+    if messages:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(attempt, messages))
+        with database() as db:
+            for message_id, attempts, error in outcomes:
+                record(db, message_id, attempts, error)
+    return len(messages)
+
+
+def run(send, once=False):
+    """Deliver messages until stopped, waiting for the poll interval whenever the outbox has nothing due
+
+    once: stop as soon as there is nothing left due to be sent
+    """
+    while True:
+        if not process(send):
+            if once:
+                return
+            time.sleep(getattr(config, 'outbox_poll_interval', 5))
+
+
+if __name__ == "__main__":
+    from work import app
+    from invoice import Invoice
+
+    def send_invoice(invoice_id, body):
+        with app.app_context():
+            Invoice(invoice_id).send_email(body)
+
+    run(send_invoice, once='--once' in sys.argv[1:])
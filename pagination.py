@@ -0,0 +1,89 @@
+"""Keyset pagination of rows ordered by a unique key
+
+Rather than counting and skipping rows, each page continues from the key of the last row shown using an opaque
+cursor token, so selecting a page costs the same no matter how many rows come before it.
+"""
+import base64
+import json
+
+AFTER, BEFORE = 'after', 'before'
+
+
+class Page(object):
+    """A page of items along with the cursors of the pages either side of it"""
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        """Initialize the page
+
+        items: the items shown on the page
+        next_cursor: the cursor of the following page, or None if this is the last page
+        previous_cursor: the cursor of the preceding page, or None if this is the first page
+        """
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(direction, key):
+    """Create a cursor token for the page in the direction, after or before, of the row with the given key"""
+    return base64.urlsafe_b64encode(json.dumps([direction, key]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return the direction and key of a cursor token
+
+    Raises a ValueError if the cursor is not a valid cursor token
+    """
+    try:
+        direction, key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, UnicodeError, ValueError):
+        raise ValueError('The cursor {} is not valid'.format(cursor))
+    # Keys are only ever strings or integers, anything else cannot be compared with a key column
+    if direction not in (AFTER, BEFORE) or isinstance(key, bool) or not isinstance(key, (str, int)):
+        raise ValueError('The cursor {} is not valid'.format(cursor))
+    return direction, key
+
+
+def paginate(select, key, cursor=None, size=10, descending=False, key_type=None):
+    """Select a page of rows ordered by a unique key
+
+    select: a function selecting rows given a where clause, the variables of the where clause and order and limit
+            keyword arguments, where the first column of each row is the key
+    key: the SQL expression of the unique key the rows are ordered by
+    cursor: the cursor token of the page to select, or None for the first page
+    size: the amount of rows on a page
+    descending: whether the pages are ordered by descending key
+    key_type: the type of the values of the key, str or int, which the key of the cursor must be
+
+    Returns a Page of the rows
+    Raises a ValueError if the cursor is not a valid cursor token
+    """
+    direction, value = decode_cursor(cursor) if cursor else (AFTER, None)
+    if key_type is not None and value is not None and not isinstance(value, key_type):
+        raise ValueError('The cursor {} is not valid'.format(cursor))
+    forward = direction == AFTER
+    # Whether the rows are selected by ascending key, reversed when moving back towards the first page
+    ascending = forward != descending
+
+    if value is None:
+        where, variables = 'TRUE', ()
+    else:
+        where, variables = '{} {} %s'.format(key, '>' if ascending else '<'), (value,)
+    # Select an extra row to find out whether there are more rows past this page
+    rows = select(where, *variables, order='{} {}'.format(key, 'ASC' if ascending else 'DESC'), limit=size + 1)
+    more = len(rows) > size
+    rows = list(rows[:size])
+    if not forward:
+        rows.reverse()
+
+    has_next = more if forward else value is not None
+    has_previous = value is not None if forward else more
+    next_cursor = encode_cursor(AFTER, rows[-1][0]) if rows and has_next else None
+    previous_cursor = encode_cursor(BEFORE, rows[0][0]) if rows and has_previous else None
+    return Page(rows, next_cursor, previous_cursor)
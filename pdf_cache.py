@@ -0,0 +1,114 @@
+import hashlib
+import os
+import threading
+
+import config
+
+
+class PDFCache(object):
+    """A size bounded on-disk store of rendered invoice PDFs keyed by a hash of the invoice html
+
+    Files are named after the invoice id and the hash of the html they were rendered from, so an invoice which has
+    not changed is served from disk while an invoice which has changed misses the cache. The least recently used
+    files are evicted once the store grows beyond its maximum size.
+    """
+
+    def __init__(self, directory, max_size):
+        """Initialize the cache
+
+        directory: the directory the PDF files are stored within, created when the first PDF is stored, or None to
+                   disable the cache
+        max_size: the maximum amount of bytes of PDF files to keep
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(html):
+        """Return the hash of the invoice html a PDF is stored under"""
+        return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+    def path(self, invoice_id, html):
+        """Return the location a PDF rendered from the invoice html is stored at"""
+        return os.path.join(self.directory, '{}-{}.pdf'.format(invoice_id, self.key(html)))
+
+    def get(self, invoice_id, html):
+        """Return the bytes of the PDF rendered from the invoice html, or None if it is not cached"""
+        if self.directory is None:
+            return None
+        path = self.path(invoice_id, html)
+        try:
+            with open(path, 'rb') as pdf:
+                data = pdf.read()
+            # The modification time records when the file was last used for eviction
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def put(self, invoice_id, html, pdf):
+        """Store the bytes of the PDF rendered from the invoice html, replacing older copies of the invoice"""
+        if self.directory is None:
+            return
+        path = self.path(invoice_id, html)
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temporary file first so a partially written PDF is never served
+        temporary = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temporary, 'wb') as output:
+            output.write(pdf)
+        os.replace(temporary, path)
+
+        self.invalidate(invoice_id, keep=path)
+        self.evict()
+
+    def invalidate(self, invoice_id, keep=None):
+        """Remove every cached PDF of the invoice, except for the file at keep if given"""
+        prefix = '{}-'.format(invoice_id)
+        for name in self._files():
+            path = os.path.join(self.directory, name)
+            if name.startswith(prefix) and path != keep:
+                self._remove(path)
+
+    def evict(self):
+        """Remove the least recently used PDFs until the cache is within its maximum size"""
+        with self._lock:
+            files = []
+            for name in self._files():
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+
+            size = sum(file_size for _, file_size, _ in files)
+            for _, file_size, name in sorted(files):
+                if size <= self.max_size:
+                    break
+                self._remove(os.path.join(self.directory, name))
+                size -= file_size
+
+    def clear(self):
+        """Remove every cached PDF"""
+        for name in self._files():
+            self._remove(os.path.join(self.directory, name))
+
+    def _files(self):
+        """List the names of the PDF files within the cache directory"""
+        if self.directory is None:
+            return []
+        try:
+            return [name for name in os.listdir(self.directory) if name.endswith('.pdf')]
+        except OSError:
+            return []
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+cache = PDFCache(getattr(config, 'pdf_cache_directory', 'pdfs/cache'),
+                 getattr(config, 'pdf_cache_size', 256 * 1024 * 1024))
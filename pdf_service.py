@@ -0,0 +1,185 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import config
+import pdf_cache
+
+
+def _render(html):
+    """Render invoice html to the bytes of a PDF within a worker process
+
+    Reportlab is run in its invariant mode, which fixes the creation date and document id written into the PDF, so
+    renders of the same html are byte for byte the same and can share a strong entity tag
+
+    Returns the bytes of the PDF and the amount of seconds spent rendering it
+    """
+    from reportlab import rl_config
+    from xhtml2pdf.pisa import CreatePDF
+    rl_config.invariant = 1
+    started = time.perf_counter()
+    output = BytesIO()
+    CreatePDF(html, dest=output)
+    return output.getvalue(), time.perf_counter() - started
+
+
+class RenderService(object):
+    """Renders invoice PDFs within a pool of worker processes so rendering does not hold up the web server
+
+    Jobs are identified by the invoice id and the hash of the invoice html, so asking for a PDF which is already being
+    rendered waits on the job in flight rather than starting another. Finished PDFs are stored in the PDF cache before
+    anyone waiting on the job is woken, and a pool whose worker process died is replaced by the next submit.
+    """
+
+    def __init__(self, workers=None, max_queue=32, timeout=60):
+        """Initialize the service, the worker processes are started when the first job is submitted
+
+        workers: the amount of worker processes, defaults to the amount of CPUs
+        max_queue: the maximum amount of jobs queued or rendering at once
+        timeout: the amount of seconds to wait for a place in the queue or for a PDF to render
+        """
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max_queue)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._metrics = {'submitted': 0, 'reused': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'restarted': 0,
+                         'render_seconds_total': 0.0, 'render_seconds_max': 0.0, 'render_seconds_last': 0.0}
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Spawn rather than fork the workers as forking the threaded web server is unsafe
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _discard_executor(self, executor):
+        """Stop using a pool which broke as one of its worker processes died, the next submit starts a new pool"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self._metrics['restarted'] += 1
+        # Do not wait as this may be called from the thread of the pool which manages its workers
+        executor.shutdown(wait=False)
+
+    def submit(self, invoice_id, html, block=True):
+        """Queue the invoice html to be rendered, or join the job already rendering the same html
+
+        block: whether to wait for a place in the queue when it is full, if false None is returned instead
+
+        Returns a Future of the bytes of the PDF and the seconds spent rendering it, which is done once the PDF has
+        been stored in the cache
+        Raises a TimeoutError if blocking and no place in the queue becomes available within the timeout
+        """
+        key = (invoice_id, pdf_cache.PDFCache.key(html))
+        with self._lock:
+            if key in self._jobs:
+                self._metrics['reused'] += 1
+                return self._jobs[key]
+
+        if not self._slots.acquire(blocking=block, timeout=self.timeout if block else None):
+            with self._lock:
+                self._metrics['rejected'] += 1
+            if block:
+                raise TimeoutError('The PDF render queue remained full for {} seconds'.format(self.timeout))
+            return None
+
+        with self._lock:
+            # Another thread may have submitted the same job while waiting for a place in the queue
+            if key in self._jobs:
+                self._slots.release()
+                self._metrics['reused'] += 1
+                return self._jobs[key]
+            job = Future()
+            self._jobs[key] = job
+            self._metrics['submitted'] += 1
+
+        try:
+            executor, rendering = self._start(html)
+        except Exception as error:
+            self._finish(key, html, job, None, error)
+            return job
+
+        def finished(rendering):
+            self._finish(key, html, job, executor, rendering.exception(),
+                         None if rendering.exception() else rendering.result())
+        rendering.add_done_callback(finished)
+        return job
+
+    def _start(self, html):
+        """Submit the invoice html to a worker process, starting a new pool if the current one has broken
+
+        Returns the pool and the Future of the render
+        """
+        executor = self._get_executor()
+        try:
+            return executor, executor.submit(_render, html)
+        except BrokenProcessPool:
+            # A worker process died while the pool was idle
+            with self._lock:
+                self._metrics['failed'] += 1
+            self._discard_executor(executor)
+            executor = self._get_executor()
+            return executor, executor.submit(_render, html)
+
+    def _finish(self, key, html, job, executor, error, result=None):
+        """Store a rendered PDF in the cache and record the outcome of the job, then wake anyone waiting on it"""
+        if error is None:
+            try:
+                pdf_cache.cache.put(key[0], html, result[0])
+            except OSError:
+                # The PDF can still be served when it cannot be cached
+                pass
+        if isinstance(error, BrokenProcessPool) and executor is not None:
+            self._discard_executor(executor)
+        with self._lock:
+            self._jobs.pop(key, None)
+            if error is not None:
+                self._metrics['failed'] += 1
+            else:
+                seconds = result[1]
+                self._metrics['completed'] += 1
+                self._metrics['render_seconds_total'] += seconds
+                self._metrics['render_seconds_last'] = seconds
+                self._metrics['render_seconds_max'] = max(self._metrics['render_seconds_max'], seconds)
+        self._slots.release()
+        if error is not None:
+            job.set_exception(error)
+        else:
+            job.set_result(result)
+
+    def render(self, invoice_id, html):
+        """Return the bytes of the PDF of the invoice html, from the cache if possible, otherwise by waiting on a job"""
+        pdf = pdf_cache.cache.get(invoice_id, html)
+        if pdf is None:
+            pdf = self.submit(invoice_id, html).result(self.timeout)[0]
+        return pdf
+
+    def prerender(self, invoice_id, html):
+        """Render the invoice html in the background if it is not cached and there is a place in the queue"""
+        if pdf_cache.cache.get(invoice_id, html) is None:
+            self.submit(invoice_id, html, block=False)
+
+    def metrics(self):
+        """Return a dictionary of the queue depth and the render counts and times of the service"""
+        with self._lock:
+            metrics = dict(self._metrics, queue_depth=len(self._jobs), queue_size=self.max_queue)
+        metrics['render_seconds_mean'] = (metrics['render_seconds_total'] / metrics['completed']
+                                          if metrics['completed'] else 0.0)
+        return metrics
+
+    def shutdown(self):
+        """Stop the worker processes once the queued jobs have finished"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+service = RenderService(workers=getattr(config, 'pdf_render_workers', None),
+                        max_queue=getattr(config, 'pdf_render_queue', 32),
+                        timeout=getattr(config, 'pdf_render_timeout', 60))
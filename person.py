@@ -1,3 +1,6 @@
+import identity_map
+import pagination
+import versions
 from database import database
 
 
@@ -10,16 +13,48 @@ class Person(object):
     def __init__(self, name):
         """Initialize the class by retrieving the person data from the database based on the name"""
         self.name = name
-        with database() as db:
-            if db.exists('persons', person_name=self.name):
-                self.address, self.email = \
-                    db.query('SELECT address, email FROM persons WHERE person_name = %s', self.name)[0]
-            else:
+        row = identity_map.get('persons', self.name)
+        if row is None:
+            with database() as db:
+                rows = Person._select(db, 'person_name = %s', self.name)
+            if not rows:
                 raise KeyError('No person with the name {} exists within the database'.format(self.name))
+            row = rows[0]
+        self._load(row)
+
+    def _load(self, row):
+        """Set the attributes of the person from a row of the persons table and remember the row for this request"""
+        self.name, self.address, self.email = row
+        identity_map.add('persons', self.name, row)
+
+    @classmethod
+    def _from_row(cls, row):
+        """Build a person from a row of the persons table without querying the database"""
+        person = cls.__new__(cls)
+        person._load(row)
+        return person
+
+    @staticmethod
+    def _select(db, where, *variables, order=None, limit=None):
+        """Select the rows of the persons table satisfying the where clause
+
+        db: the database to run the query on
+        where: a SQL condition to filter the persons by
+        *variables: the items to place in the where clause in the place of %s
+        order: the SQL expression to order the persons by
+        limit: the maximum amount of persons to select
+        """
+        sql = 'SELECT person_name, address, email FROM persons WHERE ' + where
+        if order is not None:
+            sql += ' ORDER BY ' + order
+        if limit is not None:
+            sql += ' LIMIT {:d}'.format(limit)
+        return db.query(sql, *variables)
 
     @classmethod
     def create(cls, name, email, address):
         """Add a new person to the database if the name is not already in use"""
+        identity_map.discard('persons', name)
         with database() as db:
             if not db.exists('persons', person_name=name):
                 sql = 'INSERT INTO persons (person_name, address, email) VALUES (%s, %s, %s)'
@@ -32,9 +67,49 @@ class Person(object):
         """Remove the person data from the database"""
         with database() as db:
             db.query('DELETE FROM persons WHERE person_name = %s', self.name)
+            invoices = db.query('SELECT invoice_number FROM invoices WHERE payer = %s OR payee = %s',
+                                self.name, self.name)
+            versions.bump(db, [row[0] for row in invoices])
+        identity_map.discard('persons', self.name)
+        identity_map.discard('invoices')
+
+    @classmethod
+    def get_many(cls, names):
+        """Retrieve the persons with the given names using a single query
+
+        Returns a list of Person instances in the order of the names given
+        Raises a KeyError if any of the names do not exist within the database
+        """
+        names = list(names)
+        rows, unloaded = identity_map.get_many('persons', names)
+        if unloaded:
+            with database() as db:
+                rows.update((row[0], row) for row in cls._select(db, 'person_name = ANY(%s)', unloaded))
+        persons = {name: cls._from_row(row) for name, row in rows.items()}
+
+        missing = [name for name in names if name not in persons]
+        if missing:
+            raise KeyError('No persons with the names {} exist within the database'.format(', '.join(missing)))
+        return [persons[name] for name in names]
+
+    @classmethod
+    def get_page(cls, cursor=None, size=10):
+        """Retrieve a page of persons ordered by name using a single query
+
+        cursor: the cursor token of the page to retrieve, or None for the first page
+
+        Returns a pagination Page of Person instances
+        Raises a ValueError if the cursor is not a valid cursor token
+        """
+        with database() as db:
+            def select(where, *variables, **options):
+                return cls._select(db, where, *variables, **options)
+            page = pagination.paginate(select, 'person_name', cursor, size, key_type=str)
+        page.items = [cls._from_row(row) for row in page.items]
+        return page
 
     @staticmethod
     def get_all():
         """Retrieve all persons stored in the database"""
         with database() as db:
-            return [Person(person[0]) for person in db.query('SELECT person_name FROM persons')]
+            return [Person._from_row(row) for row in Person._select(db, 'TRUE')]
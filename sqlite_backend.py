@@ -0,0 +1,278 @@
+"""An embedded SQLite storage backend for single node installs which need no database server
+
+The connections returned by connect provide the parts of the psycopg2 connection and cursor interface used by the
+database class, so the models run unchanged against a SQLite file. Queries written for PostgreSQL are translated as
+they are run: placeholders become ?, casts are dropped, = ANY(%s) is expanded into an IN list, now() and intervals
+become strftime calls, and generate_series becomes a recursive common table expression. SQLite has no row locks, so a
+query locking rows with FOR UPDATE instead starts the transaction with BEGIN IMMEDIATE, which holds the write lock of
+the whole database until the transaction ends. The nextval and item_code functions are provided as SQL functions
+backed by the sequences table.
+
+The schema is created in its fully migrated form by create_tables, as SQLite cannot add keys to existing tables.
+Invoice numbers are issued by AUTOINCREMENT, which like the invoice number sequence never issues a number twice.
+"""
+import datetime
+import re
+import sqlite3
+
+from psycopg2.extensions import STATUS_IN_TRANSACTION, STATUS_READY
+
+# The version of the migrations the schema below is equal to, migrations up to it are recorded without being applied
+SCHEMA_VERSION = 8
+
+# The timestamp format of now(), which sorts in time order as text
+_NOW = "(strftime('%Y-%m-%d %H:%M:%f', 'now'))"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS persons (
+    person_name text PRIMARY KEY,
+    address text NOT NULL,
+    email text NOT NULL);
+
+CREATE TABLE IF NOT EXISTS items (
+    item_code text PRIMARY KEY DEFAULT (item_code(nextval('item_code_seq'))),
+    date date NOT NULL,
+    description text NOT NULL,
+    charge double precision NOT NULL);
+
+CREATE TABLE IF NOT EXISTS invoices (
+    invoice_number integer PRIMARY KEY AUTOINCREMENT,
+    date date NOT NULL,
+    payer text NOT NULL,
+    payee text NOT NULL,
+    amount double precision NOT NULL DEFAULT 0,
+    item_count integer NOT NULL DEFAULT 0);
+
+CREATE TABLE IF NOT EXISTS invoice_items (
+    item_code text NOT NULL REFERENCES items (item_code) ON DELETE CASCADE,
+    invoice_number integer NOT NULL REFERENCES invoices (invoice_number) ON DELETE CASCADE,
+    PRIMARY KEY (invoice_number, item_code));
+CREATE INDEX IF NOT EXISTS invoice_items_item_code_idx ON invoice_items (item_code);
+
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id integer PRIMARY KEY,
+    invoice_number integer NOT NULL REFERENCES invoices (invoice_number) ON DELETE CASCADE,
+    body text NOT NULL,
+    dedupe_key text NOT NULL,
+    status text NOT NULL DEFAULT 'pending',
+    attempts integer NOT NULL DEFAULT 0,
+    last_error text,
+    created_at timestamp NOT NULL DEFAULT {now},
+    next_attempt_at timestamp NOT NULL DEFAULT {now},
+    sent_at timestamp);
+CREATE UNIQUE INDEX IF NOT EXISTS email_outbox_dedupe_key_idx ON email_outbox (dedupe_key)
+    WHERE status IN ('pending', 'sending');
+CREATE INDEX IF NOT EXISTS email_outbox_due_idx ON email_outbox (next_attempt_at)
+    WHERE status IN ('pending', 'sending');
+
+CREATE TABLE IF NOT EXISTS data_versions (
+    name text PRIMARY KEY,
+    version integer NOT NULL DEFAULT 1,
+    modified_at timestamptz NOT NULL DEFAULT {now});
+
+CREATE TABLE IF NOT EXISTS sequences (
+    name text PRIMARY KEY,
+    value integer NOT NULL);
+""".format(now=_NOW)
+
+# The parts of PostgreSQL queries which are translated, string literals are matched so they are left untouched
+_TOKENS = re.compile(r"""
+    (?P<literal>'(?:[^']|'')*')
+  | (?P<percent>%%)
+  | (?P<any>=\s*ANY\(\s*%s\s*\))
+  | (?P<interval>\bnow\(\)\s*\+\s*%s\s*\*\s*interval\s*'1\s+second')
+  | (?P<now>\bnow\(\))
+  | (?P<series>\bgenerate_series\(\s*(?P<first>%s|\d+)\s*,\s*(?P<last>%s|\d+)\s*\))
+  | (?P<placeholder>%s)
+  | (?P<cast>::\s*(?:double\s+precision|timestamp\s+with\s+time\s+zone|\w+)(?:\[\])?)
+  | (?P<lock>\s+FOR\s+UPDATE(?:\s+SKIP\s+LOCKED)?\b)
+""", re.IGNORECASE | re.VERBOSE)
+
+
+def translate(query, variables):
+    """Translate a PostgreSQL query with %s placeholders into a SQLite query with ? placeholders
+
+    Returns the translated query and the list of its parameters
+    """
+    variables = list(variables)
+    parameters = []
+
+    def take():
+        if not variables:
+            raise IndexError('Not enough variables for the placeholders of the query')
+        return variables.pop(0)
+
+    def bound(value):
+        """Return the SQL of a generate_series bound, either a number or a placeholder"""
+        if value.lower() == '%s':
+            parameters.append(take())
+            return '?'
+        return value
+
+    def replace(match):
+        kind = match.lastgroup if match.lastgroup not in ('first', 'last') else 'series'
+        if kind == 'literal':
+            return match.group().replace('%%', '%')
+        if kind == 'percent':
+            return '%'
+        if kind == 'any':
+            values = list(take())
+            parameters.extend(values)
+            return 'IN ({})'.format(', '.join('?' * len(values)))
+        if kind == 'interval':
+            parameters.append(take())
+            return "(strftime('%Y-%m-%d %H:%M:%f', 'now', ? || ' seconds'))"
+        if kind == 'now':
+            return _NOW
+        if kind == 'series':
+            first, last = bound(match.group('first')), bound(match.group('last'))
+            return ('(WITH RECURSIVE series(value) AS (SELECT {} UNION ALL SELECT value + 1 FROM series '
+                    'WHERE value < {}) SELECT value AS generate_series FROM series)'.format(first, last))
+        if kind == 'placeholder':
+            parameters.append(take())
+            return '?'
+        return ''
+
+    query = _TOKENS.sub(replace, query)
+    if variables:
+        raise TypeError('Not all variables were placed within the query')
+    return query, parameters
+
+
+def locks(query):
+    """Check whether a PostgreSQL query locks the rows it selects with FOR UPDATE"""
+    return any(match.lastgroup == 'lock' for match in _TOKENS.finditer(query))
+
+
+def item_code(number):
+    """Return the item code issued for a number of the item code sequence, as the item_code SQL function does"""
+    digits = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    remaining = number * 1234577 % 1679616 if number < 1679616 else number
+    code = ''
+    while True:
+        code = digits[remaining % 36] + code
+        remaining //= 36
+        if remaining == 0 and len(code) >= 4:
+            return code
+
+
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('date', lambda value: datetime.date.fromisoformat(value.decode('utf-8')))
+sqlite3.register_converter('timestamp', lambda value: datetime.datetime.fromisoformat(value.decode('utf-8')))
+sqlite3.register_converter('timestamptz', lambda value: datetime.datetime.fromisoformat(value.decode('utf-8'))
+                           .replace(tzinfo=datetime.timezone.utc))
+
+
+class Cursor(object):
+    """A cursor translating PostgreSQL queries for SQLite"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        # Rows are always fetched from SQLite as they are stepped through, so itersize is only kept for compatibility
+        self.itersize = 1000
+        self.closed = False
+
+    def _check(self):
+        """Raise the InterfaceError psycopg2 raises when a closed cursor is used, rather than a ProgrammingError"""
+        if self.closed:
+            raise sqlite3.InterfaceError('cursor already closed')
+
+    def execute(self, query, variables=()):
+        self._check()
+        # sqlite3 only begins a transaction before a change, so take the write lock before the locked rows are read
+        if locks(query) and not self._cursor.connection.in_transaction:
+            self._cursor.execute('BEGIN IMMEDIATE')
+        self._cursor.execute(*translate(query, variables))
+
+    def fetchone(self):
+        self._check()
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size):
+        self._check()
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        self._check()
+        return self._cursor.fetchall()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
+
+
+class Connection(object):
+    """A connection to a SQLite database providing the parts of the psycopg2 connection interface that are used"""
+
+    dialect = 'sqlite'
+    encoding = 'UTF8'
+
+    def __init__(self, path, timeout):
+        self.path = path
+        self.dsn = 'database={} user=sqlite'.format(path)
+        self._connection = sqlite3.connect(path, timeout=timeout, detect_types=sqlite3.PARSE_DECLTYPES,
+                                           check_same_thread=False)
+        self._connection.create_function('item_code', 1, item_code, deterministic=True)
+        self._connection.create_function('nextval', 1, self._nextval)
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.execute('PRAGMA synchronous = NORMAL')
+        self._connection.execute('PRAGMA foreign_keys = ON')
+
+    def _nextval(self, sequence):
+        """Return the next value of a sequence stored in the sequences table, starting from 1"""
+        return self._connection.execute("""INSERT INTO sequences (name, value) VALUES (?, 1)
+                                           ON CONFLICT (name) DO UPDATE SET value = value + 1
+                                           RETURNING value""", (sequence,)).fetchone()[0]
+
+    def cursor(self, name=None):
+        """Open a cursor, SQLite steps through results as they are fetched so named cursors are the same"""
+        return Cursor(self._connection.cursor())
+
+    def executescript(self, script):
+        self._connection.executescript(script)
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        self._connection.close()
+        self._closed = True
+
+    @property
+    def closed(self):
+        return getattr(self, '_closed', False)
+
+    @property
+    def status(self):
+        return STATUS_IN_TRANSACTION if self._connection.in_transaction else STATUS_READY
+
+
+def connect(path, timeout=30):
+    """Open a connection to the SQLite database stored at the path, creating the file if it does not exist
+
+    timeout: the amount of seconds to wait for another connection writing to the database
+    """
+    return Connection(path, timeout)
+
+
+def create_tables(connection):
+    """Create the tables of the fully migrated schema"""
+    connection.executescript(SCHEMA)
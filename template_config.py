@@ -1,14 +1,60 @@
+# The storage backend, either postgres for a PostgreSQL server or sqlite for an embedded database stored in the
+# sqlite_path file, which waits up to sqlite_timeout seconds for other connections writing to it
+database_backend = 'postgres'
+sqlite_path = 'work.sqlite3'
+sqlite_timeout = 30
+
 postgres_host = '127.0.0.1'
 postgres_user = 'postgres'
 postgres_password = ''
 postgres_database = 'work'
 
+# Connection pool sizing, the seconds to wait for a free connection and the seconds before idle connections are checked
+postgres_pool_min = 1
+postgres_pool_max = 10
+postgres_pool_timeout = 30
+postgres_pool_check_interval = 30
+
 secret_key = ''
 
+# The directory rendered invoice PDFs are cached within (None to only render in memory) and the maximum size of the
+# cache in bytes
+pdf_cache_directory = 'pdfs/cache'
+pdf_cache_size = 256 * 1024 * 1024
+
+# The amount of processes rendering PDFs (None for one per CPU), the maximum amount of queued renders and the seconds
+# to wait for a render
+pdf_render_workers = None
+pdf_render_queue = 32
+pdf_render_timeout = 60
+
 smtp_server = 'smtp.gmail.com'
 smtp_port = 465
+# Whether to connect with SSL, disable to send through a local SMTP server
+smtp_ssl = True
 email_login = ''
 email_password = ''
+# The maximum amount of open SMTP sessions and of emails sent at once by the outbox worker
+smtp_pool_size = 4
+email_concurrency = 4
+
+# The outbox worker sends up to outbox_batch_size emails at a time, checking for more every outbox_poll_interval
+# seconds. Failed emails are retried after outbox_retry_delay seconds, doubling each attempt up to outbox_retry_max,
+# until they have been attempted outbox_max_attempts times. Emails being sent are retried after outbox_lease seconds
+# if the worker sending them stops.
+outbox_batch_size = 20
+outbox_poll_interval = 5
+outbox_retry_delay = 30
+outbox_retry_max = 3600
+outbox_max_attempts = 8
+outbox_lease = 300
+
+# Statements run more than query_repeat_threshold times in one request are logged as a likely N+1 pattern. The query
+# summaries of the last query_history_size requests are served by /api/debug/queries when query_debug is enabled or
+# the server is run in debug mode.
+query_repeat_threshold = 10
+query_history_size = 50
+query_debug = False
 
 # ABSTRACT BELOW
 abn = 0
@@ -0,0 +1,31 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_compare(self):
+        """Ensure that comparing against a baseline reports benchmarks which are slower or run more queries by
+
+        a) Accepting results within the threshold of the baseline
+        b) Reporting results slower than the threshold
+        c) Reporting results running more queries than the baseline
+        d) Ignoring benchmarks missing from the baseline
+        """
+        baseline = {'Item.get_unlogged': {'seconds': 1.0, 'fastest': 0.9, 'queries': 1}}
+        self.assertEqual(benchmark.compare({'Item.get_unlogged': {'seconds': 1.1, 'fastest': 1, 'queries': 1},
+                                            'Person.get_all': {'seconds': 5, 'fastest': 5, 'queries': 9}},
+                                           baseline, 0.2), [])
+
+        regressions = benchmark.compare({'Item.get_unlogged': {'seconds': 1.5, 'fastest': 1.4, 'queries': 2}},
+                                        baseline, 0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertIn('50% slower', regressions[0])
+        self.assertIn('2 queries', regressions[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import sys
+import unittest
+import datetime
+
+sys.path.insert(0, os.path.abspath('..'))
+import charts
+import versions
+from database import database
+
+
+class TestCharts(unittest.TestCase):
+    def test_render(self):
+        """Ensure that a figure is rendered to the bytes of an SVG image"""
+        svg = charts.render(charts.item_figure([datetime.date(1990, 5, 5), datetime.date(1995, 5, 5)], [23.4, 45]))
+        self.assertIn(b'<svg', svg)
+
+    def test_cache(self):
+        """Ensure that a chart is only drawn again, and its data only queried again, once the data version changes"""
+        queried, built = [], []
+
+        def series():
+            queried.append(True)
+            return [1, 2], [30, 10.7]
+
+        def build(numbers, amounts):
+            built.append(numbers)
+            return charts.invoice_figure(numbers, amounts)
+
+        first = charts._chart('test', series, build)
+        second = charts._chart('test', series, build)
+        self.assertIs(first, second)
+        self.assertEqual((len(queried), len(built)), (1, 1))
+
+        with database() as db:
+            versions.bump(db)
+        charts._chart('test', series, build)
+        self.assertEqual((len(queried), len(built)), (2, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,10 @@
 import os
 import sys
 import unittest
-from psycopg2 import InterfaceError
 
 sys.path.insert(0, os.path.abspath('..'))
 import config
-from database import database
+from database import database, ConnectionPool, InterfaceError
 
 
 class TestDatabase(unittest.TestCase):
@@ -103,6 +102,31 @@ class TestDatabase(unittest.TestCase):
             result = db.query('SELECT * FROM test_data')
             self.assertEqual(result, [(1,), (2,), (3,), (4,), (5,)])
 
+    def test_iterate(self):
+        """Ensure that iterating a query with a server-side cursor yields every row in order across fetches"""
+        with database() as db:
+            db.query('INSERT INTO test_data (variable) VALUES (1), (2), (3), (4), (5)')
+            rows = db.iterate('SELECT * FROM test_data ORDER BY variable', itersize=2)
+            self.assertEqual(list(rows), [(1,), (2,), (3,), (4,), (5,)])
+
+    def test_iterate_batches(self):
+        """Ensure that iterating in batches yields lists of at most itersize rows"""
+        with database() as db:
+            db.query('INSERT INTO test_data (variable) VALUES (1), (2), (3), (4), (5)')
+            batches = db.iterate('SELECT * FROM test_data ORDER BY variable', itersize=2, batches=True)
+            self.assertEqual(list(batches), [[(1,), (2,)], [(3,), (4,)], [(5,)]])
+
+    def test_iterate_rows(self):
+        """Ensure that iterating can yield rows as named tuples or dictionaries of the column names"""
+        with database() as db:
+            db.query('INSERT INTO test_data (variable) VALUES (1), (2)')
+            rows = list(db.iterate('SELECT * FROM test_data ORDER BY variable', rows='namedtuple'))
+            self.assertEqual([row.variable for row in rows], [1, 2])
+            rows = list(db.iterate('SELECT * FROM test_data ORDER BY variable', rows='dict'))
+            self.assertEqual(rows, [{'variable': 1}, {'variable': 2}])
+            with self.assertRaises(ValueError):
+                list(db.iterate('SELECT * FROM test_data', rows='list'))
+
     def test_exists(self):
         """Ensure that the exists method accurately reports the existence of rows in the database"""
         with database() as db:
@@ -125,6 +149,47 @@ class TestDatabase(unittest.TestCase):
             db.__del__()
             db.query('SELECT * FROM test_data')
 
+    def test_pool_reuse(self):
+        """Ensure that closing a pooled database returns the connection to be reused by the next database"""
+        db = database()
+        connection = db.db
+        db.close()
+        db = database()
+        self.assertIs(db.db, connection)
+        db.close()
+        self.assertFalse(connection.closed)
+
+    def test_pool_uncommitted(self):
+        """Ensure that changes left uncommitted when a pooled database is closed are not seen by later users"""
+        db = database()
+        db.query('INSERT INTO test_data (variable) VALUES (1)')
+        db.close()
+        with database() as db:
+            self.assertEqual(db.query('SELECT * FROM test_data'), [])
+
+    def test_pool_timeout(self):
+        """Ensure that checking out more connections than the maximum pool size times out"""
+        pool = ConnectionPool(minconn=0, maxconn=1, timeout=0.1)
+        connection = pool.getconn()
+        with self.assertRaises(TimeoutError):
+            pool.getconn()
+        pool.putconn(connection)
+        self.assertIs(pool.getconn(), connection)
+        pool.putconn(connection)
+        pool.closeall()
+
+    def test_pool_health_check(self):
+        """Ensure that a connection closed while idle in the pool is replaced by a new connection"""
+        pool = ConnectionPool(minconn=1, maxconn=1, check_interval=0)
+        connection = pool.getconn()
+        pool.putconn(connection)
+        connection.close()
+        replacement = pool.getconn()
+        self.assertIsNot(replacement, connection)
+        self.assertFalse(replacement.closed)
+        pool.putconn(replacement)
+        pool.closeall()
+
 
 if __name__ == '__main__':
     unittest.main()
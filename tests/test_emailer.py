@@ -0,0 +1,83 @@
+import os
+import sys
+import smtplib
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+from emailer import Email, SMTPPool
+
+
+class StandInSMTP(object):
+    """A stand-in for an SMTP session which records the messages sent, failing the amount of sends given"""
+
+    def __init__(self, sent, failures=0):
+        self.sent = sent
+        self.failures = failures
+        self.closed = False
+
+    def send_message(self, message):
+        if self.failures:
+            self.failures -= 1
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        self.sent.append(message)
+
+    def close(self):
+        self.closed = True
+
+    def quit(self):
+        self.close()
+
+
+class TestEmailer(unittest.TestCase):
+    def setUp(self):
+        """Create a pool of stand-in SMTP sessions"""
+        self.sent = []
+        self.sessions = []
+        self.failures = 0
+        self.pool = SMTPPool(size=2, factory=self.connect)
+
+    def connect(self):
+        """Open a stand-in session, failing the amount of sends set for the next session"""
+        session = StandInSMTP(self.sent, self.failures)
+        self.failures = 0
+        self.sessions.append(session)
+        return session
+
+    def email(self, subject):
+        """Create a test email sent through the pool of stand-in sessions"""
+        email = Email('payer@example.com', 'payee@example.com', subject, smtp_pool=self.pool)
+        email.set_body('Test body')
+        email.attach_pdf(b'%PDF', 'Invoice #0424')
+        return email
+
+    def test_send(self):
+        """Ensure that an email is sent with its subject, body and attachment"""
+        self.email('Invoice 0424').send()
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.sent[0]['Subject'], 'Invoice 0424')
+        self.assertEqual(len(self.sent[0].get_payload()), 2)
+
+    def test_reuse(self):
+        """Ensure that sending several emails one after the other reuses a single session"""
+        for number in range(3):
+            self.email('Invoice {}'.format(number)).send()
+        self.assertEqual(len(self.sent), 3)
+        self.assertEqual(len(self.sessions), 1)
+
+    def test_reconnect(self):
+        """Ensure that a disconnected session is replaced and the email sent again"""
+        self.failures = 1
+        self.email('Invoice 0424').send()
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(len(self.sessions), 2)
+        self.assertTrue(self.sessions[0].closed)
+
+    def test_closeall(self):
+        """Ensure that closing the pool closes the idle sessions"""
+        self.email('Invoice 0424').send()
+        self.pool.closeall()
+        self.assertTrue(self.sessions[0].closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import io
+import os
+import csv
+import sys
+import unittest
+import datetime
+
+sys.path.insert(0, os.path.abspath('..'))
+import exporter
+from database import database
+
+
+class TestExporter(unittest.TestCase):
+    def setUp(self):
+        """Setup an invoice of two items and an invoice without items to export"""
+        with database() as db:
+            db.query("INSERT INTO persons (person_name, address, email) VALUES ('test_payer', '123 Fake Street', 'test@braewebb.com'), ('test_payee', '124 Fake Street', 'test@braewebb.com')")
+            db.query("INSERT INTO invoices (invoice_number, date, payer, payee, amount, item_count) VALUES (424, '1990-02-05', 'test_payer', 'test_payee', 40.7, 2), (425, '1990-03-05', 'test_payer', 'test_payee', 0, 0)")
+            db.query("INSERT INTO items (item_code, date, description, charge) VALUES ('XDSA', '1990-02-04', 'Test Item', 30), ('SDWF', '1990-02-03', 'Test Item 2', 10.7)")
+            db.query("INSERT INTO invoice_items (item_code, invoice_number) VALUES ('XDSA', 424), ('SDWF', 424)")
+
+    def tearDown(self):
+        """Remove the test data from the database"""
+        with database() as db:
+            db.query("DELETE FROM persons WHERE person_name = 'test_payer' OR person_name = 'test_payee'")
+            db.query("DELETE FROM invoice_items WHERE item_code = 'XDSA' OR item_code = 'SDWF'")
+            db.query("DELETE FROM invoices WHERE invoice_number = 424 OR invoice_number = 425")
+            db.query("DELETE FROM items WHERE item_code = 'XDSA' OR item_code = 'SDWF'")
+
+    def rows(self, export):
+        """Return the rows of the test invoices in CSV text, keeping the header"""
+        rows = list(csv.reader(io.StringIO(export)))
+        return [rows[0]] + [row for row in rows[1:] if row[0] in ('424', '425')]
+
+    def test_copy_csv(self):
+        """Ensure that the export written by COPY has a row for each item and invoice without items"""
+        output = io.StringIO()
+        exporter.copy_csv(output, start=datetime.date(1990, 1, 1), end=datetime.date(1990, 12, 31))
+        rows = self.rows(output.getvalue())
+        self.assertEqual(rows[0], [name for name, _ in exporter.COLUMNS])
+        self.assertEqual([(row[0], row[10], row[13]) for row in rows[1:]],
+                         [('424', 'SDWF', '10.7'), ('424', 'XDSA', '30'), ('425', '', '')])
+        self.assertEqual(rows[1][2:5], ['test_payer', '123 Fake Street', 'test@braewebb.com'])
+        self.assertNotIn('\r', output.getvalue())
+
+    def test_iterate_csv(self):
+        """Ensure that the streamed export matches the export written by COPY, down to the formatting of values"""
+        streamed = self.rows(''.join(exporter.iterate_csv(itersize=1)))
+        output = io.StringIO()
+        exporter.copy_csv(output)
+        copied = self.rows(output.getvalue())
+        self.assertEqual(streamed, copied)
+        self.assertNotIn('\r', ''.join(exporter.iterate_csv()))
+
+    def test_date_range(self):
+        """Ensure that only the invoices between the start and end dates are exported"""
+        rows = self.rows(''.join(exporter.iterate_csv(start=datetime.date(1990, 3, 1),
+                                                      end=datetime.date(1990, 3, 31))))
+        self.assertEqual([row[0] for row in rows[1:]], ['425'])
+
+        with self.assertRaises(ValueError):
+            exporter.parse_date('05/03/1990')
+
+    @unittest.skipIf(exporter.pyarrow is None, 'pyarrow is not installed')
+    def test_write_parquet(self):
+        """Ensure that the Parquet export has the rows and types of the export"""
+        output = io.BytesIO()
+        exporter.write_parquet(output, start=datetime.date(1990, 2, 1), end=datetime.date(1990, 2, 28))
+        output.seek(0)
+        table = exporter.pyarrow.parquet.read_table(output).to_pydict()
+        self.assertEqual(table['item_code'][:2], ['SDWF', 'XDSA'])
+        self.assertEqual(table['invoice_date'][0], datetime.date(1990, 2, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import unittest
+from flask import Flask
+
+sys.path.insert(0, os.path.abspath('..'))
+import identity_map
+
+
+class TestIdentityMap(unittest.TestCase):
+    def setUp(self):
+        """Create a flask app to provide the request context the identity map is scoped to"""
+        self.app = Flask('test_app')
+
+    def tearDown(self):
+        """Delete the flask app"""
+        del self.app
+
+    def test_request_scope(self):
+        """Ensure that rows are remembered within a request but not outside of one or in the next request"""
+        identity_map.add('items', 'DPWV', ('DPWV',))
+        self.assertIsNone(identity_map.get('items', 'DPWV'))
+
+        with self.app.test_request_context():
+            identity_map.add('items', 'DPWV', ('DPWV',))
+            self.assertEqual(identity_map.get('items', 'DPWV'), ('DPWV',))
+        with self.app.test_request_context():
+            self.assertIsNone(identity_map.get('items', 'DPWV'))
+
+    def test_get_many(self):
+        """Ensure that get_many separates the remembered rows from the keys which still need to be loaded"""
+        with self.app.test_request_context():
+            identity_map.add('items', 'DPWV', ('DPWV',))
+            found, missing = identity_map.get_many('items', ['SDWF', 'DPWV'])
+            self.assertEqual(found, {'DPWV': ('DPWV',)})
+            self.assertEqual(missing, ['SDWF'])
+
+    def test_discard(self):
+        """Ensure that discard forgets a single row or every row of a table"""
+        with self.app.test_request_context():
+            identity_map.add('items', 'DPWV', ('DPWV',))
+            identity_map.add('items', 'SDWF', ('SDWF',))
+            identity_map.add('invoices', 424, (424,))
+
+            identity_map.discard('items', 'DPWV')
+            self.assertIsNone(identity_map.get('items', 'DPWV'))
+            self.assertEqual(identity_map.get('items', 'SDWF'), ('SDWF',))
+
+            identity_map.discard('items')
+            self.assertIsNone(identity_map.get('items', 'SDWF'))
+            self.assertEqual(identity_map.get('invoices', 424), (424,))
+
+    def test_clear(self):
+        """Ensure that clear forgets every row remembered in the request"""
+        with self.app.test_request_context():
+            identity_map.add('persons', 'test_person', ('test_person',))
+            identity_map.clear()
+            self.assertIsNone(identity_map.get('persons', 'test_person'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import io
+import os
+import sys
+import unittest
+import datetime
+
+sys.path.insert(0, os.path.abspath('..'))
+import importer
+from database import database
+
+
+class TestImporter(unittest.TestCase):
+    def tearDown(self):
+        """Remove any imported test items from the database"""
+        with database() as db:
+            db.query("DELETE FROM items WHERE description LIKE 'Imported Item %%'")
+
+    def test_validate(self):
+        """Ensure that rows are validated by
+
+        a) Converting a valid row to the date, description and charge of an item
+        b) Accepting the charge of a row named amount
+        c) Raising a ValueError for rows missing or with invalid fields
+        """
+        self.assertEqual(importer.validate({'date': '2018-03-04', 'description': 'Item', 'charge': '12.5'}),
+                         (datetime.date(2018, 3, 4), 'Item', 12.5))
+        self.assertEqual(importer.validate({'date': '2018-03-04', 'description': 'Item', 'amount': 3})[2], 3)
+
+        for record in (None, [], {'date': '04/03/2018', 'description': 'Item', 'charge': 1},
+                       {'date': '2018-03-04', 'description': ' ', 'charge': 1},
+                       {'date': '2018-03-04', 'description': 'Item', 'charge': 'free'},
+                       {'date': '2018-03-04', 'description': 'Item', 'charge': 'inf'},
+                       {'date': '2018-03-04', 'description': 'Item'}):
+            with self.assertRaises(ValueError):
+                importer.validate(record)
+
+    def test_read_ndjson(self):
+        """Ensure that newline delimited JSON is read by line number, skipping blank lines"""
+        rows = list(importer.read_ndjson(io.StringIO('{"date": "2018-03-04"}\n\nnot json\n')))
+        self.assertEqual(rows, [(1, {'date': '2018-03-04'}), (3, None)])
+
+    def test_import_csv(self):
+        """Ensure that every row of a valid CSV file is loaded with a unique item code"""
+        stream = io.StringIO('date,description,charge\n'
+                             '2018-03-04,"Imported Item A, with a comma",12.5\n'
+                             '2018-03-05,Imported Item B,30\n')
+        result = importer.import_items(stream)
+        self.assertEqual(result.errors, [])
+        self.assertEqual(len(set(result.codes)), 2)
+        with database() as db:
+            rows = db.query('SELECT item_code, date, description, charge FROM items WHERE item_code = ANY(%s) '
+                            'ORDER BY date', result.codes)
+        self.assertEqual(rows, [(result.codes[0], datetime.date(2018, 3, 4), 'Imported Item A, with a comma', 12.5),
+                                (result.codes[1], datetime.date(2018, 3, 5), 'Imported Item B', 30)])
+
+    def test_import_errors(self):
+        """Ensure that invalid rows are reported by
+
+        a) Loading nothing when any row is invalid
+        b) Loading only the valid rows when skipping invalid rows
+        c) Raising a ValueError for an unsupported format
+        """
+        ndjson = ('{"date": "2018-03-04", "description": "Imported Item A", "charge": 12.5}\n'
+                  '{"date": "2018-03-04", "description": "Imported Item B"}\n')
+        result = importer.import_items(io.StringIO(ndjson), 'ndjson')
+        self.assertEqual(result.codes, [])
+        self.assertEqual([number for number, _ in result.errors], [2])
+        with database() as db:
+            self.assertFalse(db.exists('items', description='Imported Item A'))
+
+        result = importer.import_items(io.StringIO(ndjson), 'ndjson', skip_invalid=True)
+        self.assertEqual(len(result.codes), 1)
+        self.assertEqual([number for number, _ in result.errors], [2])
+        with database() as db:
+            self.assertTrue(db.exists('items', description='Imported Item A'))
+
+        with self.assertRaises(ValueError):
+            importer.import_items(io.StringIO(''), 'xml')
+
+
+if __name__ == '__main__':
+    unittest.main()
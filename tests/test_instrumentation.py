@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+from flask import Flask
+
+sys.path.insert(0, os.path.abspath('..'))
+import config
+import instrumentation
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        """Create a flask app to provide the request context queries are aggregated by"""
+        self.app = Flask('test_app')
+
+    def tearDown(self):
+        """Delete the flask app"""
+        del self.app
+
+    def test_fingerprint(self):
+        """Ensure that statements differing only in their values and whitespace share a fingerprint"""
+        self.assertEqual(instrumentation.fingerprint("SELECT * FROM items\n    WHERE item_code = 'DPWV' LIMIT 5"),
+                         'SELECT * FROM items WHERE item_code = ? LIMIT ?')
+        self.assertEqual(instrumentation.fingerprint('SELECT * FROM items WHERE item_code = %s'),
+                         instrumentation.fingerprint("SELECT * FROM items WHERE item_code = 'it''s'"))
+        self.assertEqual(instrumentation.fingerprint('SELECT item_code(nextval(%s)) FROM invoice_items2'),
+                         'SELECT item_code(nextval(?)) FROM invoice_items2')
+
+    def test_caller(self):
+        """Ensure that the function recording a query is found as its caller"""
+        self.assertEqual(instrumentation.caller(), '{}:TestInstrumentation.test_caller'.format(__name__))
+
+    def test_summarise(self):
+        """Ensure that queries are aggregated by fingerprint and those repeated past the threshold are flagged"""
+        threshold = getattr(config, 'query_repeat_threshold', 10)
+        with self.app.test_request_context('/invoices'):
+            for _ in range(threshold + 1):
+                instrumentation.record('SELECT * FROM items WHERE item_code = %s', 0.5, 1)
+            instrumentation.record('SELECT * FROM invoices', 1, 5)
+            summary = instrumentation.current()
+            instrumentation.finish()
+            self.assertEqual(instrumentation.current()['count'], 0)
+
+        self.assertEqual(summary['count'], threshold + 2)
+        self.assertEqual(summary['repeated'], ['SELECT * FROM items WHERE item_code = ?'])
+        statement = summary['statements'][0]
+        self.assertEqual((statement['count'], statement['rows']), (threshold + 1, threshold + 1))
+        self.assertAlmostEqual(statement['duration'], (threshold + 1) * 0.5)
+        self.assertEqual(summary['statements'][1]['repeated'], False)
+        self.assertEqual(instrumentation.history()[0]['path'], '/invoices')
+
+    def test_outside_request(self):
+        """Ensure that queries recorded outside of a request are not kept"""
+        instrumentation.record('SELECT 1', 0.1, 1)
+        self.assertEqual(instrumentation.current()['count'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
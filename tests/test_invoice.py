@@ -9,13 +9,16 @@ from invoice import Invoice
 from person import Person
 from item import Item
 from database import database
+import outbox
+import pdf_cache
+import totals
 
 class TestInvoice(unittest.TestCase):
     def setUp(self):
         """Setup the invoice unit test by creating fake data to test and setting up the directory and flask app"""
         with database() as db:
             db.query("INSERT INTO persons (person_name, address, email) VALUES ('test_payer', '123 Fake Street', 'test@braewebb.com'), ('test_payee', '124 Fake Street', 'test@braewebb.com')")
-            db.query("INSERT INTO invoices (invoice_number, date, payer, payee) VALUES (424, '1990-02-05', 'test_payer', 'test_payee')")
+            db.query("INSERT INTO invoices (invoice_number, date, payer, payee, amount, item_count) VALUES (424, '1990-02-05', 'test_payer', 'test_payee', 40.7, 2)")
             db.query("INSERT INTO items (item_code, date, description, charge) VALUES ('XDSA', '1990-02-04', 'Test Item', 30), ('SDWF', '1990-02-03', 'Test Item 2', 10.7)")
             db.query("INSERT INTO invoice_items (item_code, invoice_number) VALUES ('XDSA', 424), ('SDWF', 424)")
         os.chdir('..')
@@ -28,6 +31,7 @@ class TestInvoice(unittest.TestCase):
             db.query("DELETE FROM invoice_items WHERE item_code = 'XDSA' OR item_code = 'SDWF'")
             db.query("DELETE FROM invoices WHERE invoice_number=424")
             db.query("DELETE FROM items WHERE item_code = 'XDSA' OR item_code = 'SDWF'")
+            db.query("DELETE FROM data_versions WHERE name = 'invoice/424'")
         os.chdir('tests')
         del self.app
 
@@ -37,7 +41,6 @@ class TestInvoice(unittest.TestCase):
 
         Also ensure an error is raised if an invalid ID is used"""
         invoice = Invoice(424)
-        self.assertEqual(invoice.pdf_file, 'pdfs/424.pdf')
         self.assertEqual(invoice.date, datetime.date(1990, 2, 5))
         # TODO: After implementation of __eq__ in Person
         # self.assertEqual(invoice.payer, Person('test_payer'))
@@ -47,6 +50,19 @@ class TestInvoice(unittest.TestCase):
         with self.assertRaises(KeyError):
             Invoice(9895)
 
+    def test_get_many(self):
+        """Ensure that get_many hydrates invoices, including their payer, payee and amount, in a single call"""
+        invoice, = Invoice.get_many([424])
+        self.assertEqual(invoice.date, datetime.date(1990, 2, 5))
+        self.assertEqual(invoice.payer.name, 'test_payer')
+        self.assertEqual(invoice.payee.address, '124 Fake Street')
+        self.assertEqual(invoice.amount, 40.7)
+        with self.assertRaises(KeyError):
+            Invoice.get_many([424, 9895])
+        invoice, missing = Invoice.get_many([424, 9895], strict=False)
+        self.assertEqual(invoice.id, 424)
+        self.assertIsNone(missing)
+
     #TODO: test_get_all
 
     def test_create(self):
@@ -55,11 +71,21 @@ class TestInvoice(unittest.TestCase):
         id = invoice.id
         with database() as db:
             results = db.query('SELECT * FROM invoices WHERE invoice_number = %s', id)
-            self.assertEqual(results, [(id, datetime.date(1999, 1, 1), 'test_payer', 'test_payee')])
-            results = db.query('SELECT * FROM invoice_items WHERE invoice_number = %s', id)
-            self.assertEqual(results, [('XDSA', id), ('SDWF', id)])
+            self.assertEqual(results, [(id, datetime.date(1999, 1, 1), 'test_payer', 'test_payee', 40.7, 2)])
+            results = db.query('SELECT * FROM invoice_items WHERE invoice_number = %s ORDER BY item_code', id)
+            self.assertEqual(results, [('SDWF', id), ('XDSA', id)])
         invoice.delete()
 
+    def test_create_missing_items(self):
+        """Ensure that creating an invoice with unknown items names each of them and creates nothing"""
+        with database() as db:
+            count = db.query('SELECT COUNT(*) FROM invoices')[0][0]
+        with self.assertRaises(KeyError) as context:
+            Invoice.create(datetime.date(1999, 1, 1), 'test_payer', 'test_payee', ['XDSA', 'DEIG', 'DPWV'])
+        self.assertIn('DEIG, DPWV', str(context.exception))
+        with database() as db:
+            self.assertEqual(db.query('SELECT COUNT(*) FROM invoices')[0][0], count)
+
     def test_delete(self):
         """Ensures that the delete method works by checking the data is removed from the database"""
         Invoice(424).delete()
@@ -68,6 +94,31 @@ class TestInvoice(unittest.TestCase):
             self.assertEqual(results, [])
             results = db.query('SELECT * FROM invoice_items WHERE invoice_number = %s', 424)
             self.assertEqual(results, [])
+            results = db.query("SELECT * FROM items WHERE item_code = 'XDSA' OR item_code = 'SDWF'")
+            self.assertEqual(results, [])
+
+    def test_totals(self):
+        """Ensure that the stored invoice totals follow changes to the charges and deletion of items"""
+        Item('SDWF').update(charge=20)
+        invoice = Invoice(424)
+        self.assertEqual(invoice.amount, 50)
+        self.assertEqual(invoice.item_count, 2)
+
+        Item('XDSA').delete()
+        invoice = Invoice(424)
+        self.assertEqual(invoice.amount, 20)
+        self.assertEqual(invoice.item_count, 1)
+        with database() as db:
+            self.assertEqual([row for row in totals.check(db) if row[0] == 424], [])
+
+    def test_update_many_totals(self):
+        """Ensure that updating the charges of many items adjusts the invoice totals by the change in charges"""
+        Item.update_many({'XDSA': {'charge': 35}, 'SDWF': {'charge': 5.7, 'description': 'Repriced'}})
+        self.assertAlmostEqual(Invoice(424).amount, 40.7)
+        Item.update_many({'XDSA': {'charge': 45}})
+        self.assertAlmostEqual(Invoice(424).amount, 50.7)
+        with database() as db:
+            self.assertEqual([row for row in totals.check(db) if row[0] == 424], [])
 
     # def test_items(self):
     #     """Ensures the correct items are in the items attribute"""
@@ -76,43 +127,63 @@ class TestInvoice(unittest.TestCase):
     #     # self.assertEqual(items, [Item('XDSA'), Item('SDWF')])
 
     def test_build(self):
-        """Builds a PDF and ensures it was properly created"""
+        """Builds a PDF in memory and ensures it was properly created
+
+        Also ensure that rendering the invoice again without the cached copy gives the same bytes, as the PDF is
+        served with a strong entity tag"""
         invoice = Invoice(424)
-        invoice.pdf_file = 'tests/invoices/build_test.pdf'
         with self.app.app_context():
-            invoice.build_pdf()
-        self.assertTrue(os.path.isfile('tests/invoices/build_test.pdf'))
+            pdf = invoice.build_pdf()
+            invoice.delete_pdf()
+            self.assertEqual(invoice.build_pdf(), pdf)
+        self.assertTrue(pdf.startswith(b'%PDF'))
         invoice.delete_pdf()
 
     def test_delete_pdf(self):
-        """Ensure that a PDF was deleted by checking the file path"""
+        """Ensure that deleting the PDF removes the cached copy of the invoice"""
         invoice = Invoice(424)
-        invoice.pdf_file = 'tests/invoices/delete_test.pdf'
         with self.app.app_context():
+            html = invoice.html()
             invoice.build_pdf()
         invoice.delete_pdf()
-        self.assertFalse(os.path.isfile('tests/invoices/build_test.pdf'))
+        self.assertIsNone(pdf_cache.cache.get(invoice.id, html))
 
     def test_pdf(self):
-        """Ensure the pdf method returns the file correctly"""
+        """Ensure the pdf method returns the PDF correctly"""
         invoice = Invoice(424)
-        invoice.pdf_file = 'tests/invoices/pdf_test.pdf'
         with self.app.app_context():
+            html = invoice.html()
             response = invoice.pdf()
-        with open('tests/invoices/pdf_test.pdf', 'rb') as f:
-            self.assertEqual(f.read(), response[0])
+        self.assertTrue(response[0].startswith(b'%PDF'))
+        if pdf_cache.cache.directory is not None:
+            self.assertEqual(pdf_cache.cache.get(invoice.id, html), response[0])
+        self.assertEqual(response[1], 200)
+        self.assertEqual(response[2]['Content-Type'], 'application/pdf')
+        self.assertTrue(response[2]['Content-Disposition'].startswith('inline'))
         invoice.delete_pdf()
 
     def test_download(self):
-        """Ensure the download method returns the file correctly"""
+        """Ensure the download method returns the PDF correctly"""
         invoice = Invoice(424)
-        invoice.pdf_file = 'tests/invoices/download_test.pdf'
         with self.app.app_context():
+            html = invoice.html()
             response = invoice.download()
-        with open('tests/invoices/download_test.pdf', 'rb') as f:
-            self.assertEqual(f.read(), response[0])
+        self.assertTrue(response[0].startswith(b'%PDF'))
+        if pdf_cache.cache.directory is not None:
+            self.assertEqual(pdf_cache.cache.get(invoice.id, html), response[0])
+        self.assertEqual(response[1], 200)
+        self.assertEqual(response[2]['Content-Type'], 'application/pdf')
+        self.assertTrue(response[2]['Content-Disposition'].startswith('attachment'))
         invoice.delete_pdf()
 
+    def test_email_many(self):
+        """Ensure that emailing many invoices queues a message for each invoice and reports unknown invoices"""
+        (invoice, message, error), missing = Invoice.email_many([424, 9895], 'Please pay')
+        self.assertEqual((invoice, error), (424, None))
+        self.assertEqual(outbox.status(message)['status'], outbox.PENDING)
+        self.assertEqual(missing[:2], (9895, None))
+        self.assertIn('9895', missing[2])
+
     # TODO: test_email
 
 
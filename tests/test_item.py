@@ -36,20 +36,27 @@ class TestItem(unittest.TestCase):
         with self.assertRaises(KeyError):
             Item('DEIG')
 
-    def test_generate(self):
-        """Ensure that the generate_code method works by testing properties of the code
+    def test_reserve_codes(self):
+        """Ensure that the reserve_codes method works by testing properties of the codes
 
         Properties:
+        - The amount requested
+        - All unique and not in use
         - Of type string
-        - Of length 4
+        - At least of length 4
         - Consisting of alphanumeric characters
         - All uppercase
         """
-        code = Item._generate_code()
-        self.assertEqual(len(code), 4)
-        self.assertEqual(type(code), type(''))
-        self.assertTrue(code.isalnum())
-        self.assertTrue(code.isupper())
+        codes = Item.reserve_codes(5)
+        self.assertEqual(len(codes), 5)
+        self.assertEqual(len(set(codes)), 5)
+        with database() as db:
+            for code in codes:
+                self.assertFalse(db.exists('items', item_code=code))
+                self.assertEqual(type(code), type(''))
+                self.assertGreaterEqual(len(code), 4)
+                self.assertTrue(code.isalnum())
+                self.assertTrue(code.isupper() or code.isdigit())
 
     def test_create(self):
         """Ensure item creation works by using the create method and checking changes are made to the database"""
@@ -68,6 +75,48 @@ class TestItem(unittest.TestCase):
             item.delete()
             self.assertFalse(db.exists('items', item_code = 'DPWV'))
 
+    def test_get_many(self):
+        """Ensure that get_many returns the requested items in order and raises an error for unknown item codes"""
+        items = Item.get_many(['SDWF', 'DPWV'])
+        self.assertEqual([item.code for item in items], ['SDWF', 'DPWV'])
+        self.assertEqual(items[1].description, 'Test Item A')
+        self.assertEqual(items[1].amount, 23.4)
+
+        with self.assertRaises(KeyError):
+            Item.get_many(['DPWV', 'DEIG'])
+
+    def test_update(self):
+        """Ensure that updating an item changes only the attributes given, in the item and the database"""
+        item = Item('DPWV')
+        item.update(description='Updated Item A', charge=10)
+        self.assertEqual((item.date, item.description, item.amount),
+                         (datetime.date(1990, 5, 5), 'Updated Item A', 10))
+        with database() as db:
+            self.assertEqual(db.query('SELECT description, charge FROM items WHERE item_code = %s', 'DPWV'),
+                             [('Updated Item A', 10)])
+
+    def test_update_many(self):
+        """Ensure that update_many works by
+
+        a) Applying a different mix of changes to each item and returning the items in order
+        b) Raising a KeyError and changing nothing if an item code does not exist
+        c) Raising a ValueError and changing nothing if an item code, date or charge is invalid
+        """
+        items = Item.update_many({'SDWF': {'charge': '50.5'},
+                                  'DPWV': {'date': '2000-01-01', 'description': ''}})
+        self.assertEqual([(item.code, item.date, item.description, item.amount) for item in items],
+                         [('SDWF', datetime.date(1995, 5, 5), 'Test Item B', 50.5),
+                          ('DPWV', datetime.date(2000, 1, 1), 'Test Item A', 23.4)])
+
+        with self.assertRaises(KeyError):
+            Item.update_many({'DPWV': {'charge': 1}, 'DEIG': {'charge': 1}})
+        self.assertEqual(Item('DPWV').amount, 23.4)
+
+        for changes in ({None: {'charge': 1}}, {'DPWV': {'date': '2000-13-01'}}, {'DPWV': {'charge': 'free'}}):
+            with self.assertRaises(ValueError):
+                Item.update_many(changes)
+        self.assertEqual(Item('DPWV').date, datetime.date(2000, 1, 1))
+
     # TODO: get_all and get_unlogged tests
 
     def test_lt(self):
@@ -0,0 +1,59 @@
+import os
+import sys
+import random
+import unittest
+import urllib.parse
+
+sys.path.insert(0, os.path.abspath('..'))
+import pagination
+from loadtest import Histogram, next_page
+
+
+class TestHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        """Ensure that percentiles are within the precision of the histogram of the exact percentiles"""
+        values = [random.Random(424).lognormvariate(-4, 1) for _ in range(10000)]
+        histogram = Histogram()
+        for value in values:
+            histogram.record(value)
+        values = sorted(int(value * 1000000) for value in values)
+        for percent in (50, 90, 99, 99.9):
+            exact = values[int(len(values) * percent / 100) - 1]
+            self.assertAlmostEqual(histogram.percentile(percent), exact, delta=exact / 2 ** 6)
+        self.assertEqual(histogram.percentile(100), values[-1])
+        self.assertLess(len(histogram.counts), 2000)
+
+    def test_exact(self):
+        """Ensure that small latencies are counted exactly and an empty histogram has no percentiles"""
+        histogram = Histogram()
+        self.assertIsNone(histogram.percentile(50))
+        for microseconds in (5, 10, 100):
+            histogram.record(microseconds / 1000000)
+        self.assertEqual(histogram.percentile(50), 10)
+        self.assertEqual((histogram.min, histogram.max, histogram.count), (5, 100, 3))
+
+    def test_merge(self):
+        """Ensure that merging histograms counts the values of both"""
+        first, second = Histogram(), Histogram()
+        first.record(0.001)
+        second.record(0.5)
+        second.record(0.002)
+        first.merge(second)
+        self.assertEqual((first.count, first.min, first.max), (3, 1000, 500000))
+        self.assertAlmostEqual(first.percentile(50), 2000, delta=2000 / 2 ** 6)
+        self.assertEqual(first.dict()['count'], 3)
+
+
+class TestInvoicePages(unittest.TestCase):
+    def test_next_page(self):
+        """Ensure that the link to the following page of invoices is found, ignoring the link to the previous page"""
+        after, before = pagination.encode_cursor(pagination.AFTER, 5), pagination.encode_cursor(pagination.BEFORE, 10)
+        content = '<a href="/invoices?cursor={}">Back</a><a href="/invoices?cursor={}">Next</a>'.format(before, after)
+        path, query = next_page(content).split('?')
+        self.assertEqual(path, '/invoices')
+        self.assertEqual(urllib.parse.parse_qs(query)['cursor'], [after])
+        self.assertIsNone(next_page('<a href="/invoices?cursor={}">Previous</a>'.format(before)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+import migrations
+from database import database, IntegrityError
+
+
+class TestMigrations(unittest.TestCase):
+    def test_order(self):
+        """Ensure that the migration versions are unique and listed in increasing order"""
+        versions = [version for version, _, _ in migrations.MIGRATIONS]
+        self.assertEqual(versions, sorted(set(versions)))
+
+    def test_idempotent(self):
+        """Ensure that migrating records every version and that migrating again applies nothing"""
+        with database() as db:
+            migrations.migrate(db)
+            self.assertEqual(migrations.migrate(db), [])
+            self.assertEqual(migrations.applied_versions(db),
+                             {version for version, _, _ in migrations.MIGRATIONS})
+
+    def test_primary_keys(self):
+        """Ensure that the migrated tables reject duplicate keys"""
+        with database() as db:
+            migrations.migrate(db)
+        with self.assertRaises(IntegrityError):
+            with database() as db:
+                sql = 'INSERT INTO persons (person_name, address, email) VALUES (%s, %s, %s)'
+                db.query(sql, 'test_duplicate', '123 Fake Street', 'test@example.com')
+                db.query(sql, 'test_duplicate', '123 Fake Street', 'test@example.com')
+        with database() as db:
+            self.assertFalse(db.exists('persons', person_name='test_duplicate'))
+
+    def test_duplicate_keys(self):
+        """Ensure that adding primary keys lists the duplicated keys rather than failing partway through"""
+        with database() as db:
+            try:
+                # Temporary tables take the place of the migrated tables of the same name for this connection
+                db.query('CREATE TEMPORARY TABLE persons (person_name text)')
+                db.query('CREATE TEMPORARY TABLE items (item_code text)')
+                db.query('CREATE TEMPORARY TABLE invoices (invoice_number integer)')
+                db.query("INSERT INTO persons VALUES ('test_payer'), ('test_payer'), ('test_payee')")
+                db.query('INSERT INTO invoices VALUES (7), (7), (9), (9), (8)')
+                self.assertEqual(migrations.duplicate_keys(db, 'invoices', 'invoice_number'), [7, 9])
+                with self.assertRaises(ValueError) as context:
+                    migrations.add_primary_keys(db)
+                self.assertIn('persons test_payer; invoices 7, 9', str(context.exception))
+            finally:
+                schema = 'temp' if db.dialect == 'sqlite' else 'pg_temp'
+                for table in ('persons', 'items', 'invoices'):
+                    db.query('DROP TABLE IF EXISTS {}.{}'.format(schema, table))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+import outbox
+from database import database
+
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        """Create an invoice to queue emails of, only the messages of which are sent by the tests"""
+        with database() as db:
+            db.query("INSERT INTO persons (person_name, address, email) VALUES ('test_payer', '123 Fake Street', 'test@braewebb.com'), ('test_payee', '124 Fake Street', 'test@braewebb.com')")
+            db.query("INSERT INTO invoices (invoice_number, date, payer, payee) VALUES (424, '1990-02-05', 'test_payer', 'test_payee')")
+        self.sent = []
+
+    def tearDown(self):
+        """Remove the invoice along with its queued emails"""
+        with database() as db:
+            db.query("DELETE FROM invoices WHERE invoice_number = 424")
+            db.query("DELETE FROM persons WHERE person_name = 'test_payer' OR person_name = 'test_payee'")
+
+    def send(self, invoice_id, body):
+        """Record the emails the worker sends, failing those with a body of fail"""
+        if body == 'fail':
+            raise ConnectionError('Connection refused')
+        self.sent.append((invoice_id, body))
+
+    def test_enqueue(self):
+        """Ensure that queueing an email records a pending message and that a duplicate is not queued again"""
+        message = outbox.enqueue(424, 'Please pay')
+        self.assertEqual(outbox.enqueue(424, 'Please pay'), message)
+        self.assertNotEqual(outbox.enqueue(424, 'Please pay soon'), message)
+        status = outbox.status(message)
+        self.assertEqual(status['invoice'], 424)
+        self.assertEqual(status['status'], outbox.PENDING)
+        self.assertIsNone(outbox.status(-1))
+
+    def test_process(self):
+        """Ensure that processing the outbox sends the due messages and marks them as sent"""
+        message = outbox.enqueue(424, 'Please pay')
+        self.assertEqual(outbox.process(self.send, invoice_ids=[424]), 1)
+        self.assertEqual(self.sent, [(424, 'Please pay')])
+        self.assertEqual(outbox.status(message)['status'], outbox.SENT)
+        self.assertEqual(outbox.process(self.send, invoice_ids=[424]), 0)
+
+    def test_retry(self):
+        """Ensure that a message which fails to send is kept pending with the error until it is due again"""
+        message = outbox.enqueue(424, 'fail')
+        outbox.process(self.send, invoice_ids=[424])
+        status = outbox.status(message)
+        self.assertEqual(status['status'], outbox.PENDING)
+        self.assertEqual(status['attempts'], 1)
+        self.assertEqual(status['error'], 'Connection refused')
+        self.assertGreater(status['next_attempt'], status['created'])
+        self.assertEqual(outbox.process(self.send, invoice_ids=[424]), 0)
+
+    def test_backoff(self):
+        """Ensure that the delay between attempts doubles up to the maximum"""
+        self.assertEqual([outbox.backoff(attempts, 30, 100) for attempts in range(1, 5)], [30, 60, 100, 100])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+import pagination
+
+
+class TestPagination(unittest.TestCase):
+    def setUp(self):
+        """Create rows keyed by the numbers 1 to 12 and record the queries made to select them"""
+        self.rows = [(number, 'Row {}'.format(number)) for number in range(1, 13)]
+        self.queries = []
+
+    def select(self, where, *variables, order=None, limit=None):
+        """Select the rows the way the database would for the where clause, order and limit of a page"""
+        self.queries.append((where, variables, order, limit))
+        rows = self.rows
+        if where.startswith('key >'):
+            rows = [row for row in rows if row[0] > variables[0]]
+        elif where.startswith('key <'):
+            rows = [row for row in rows if row[0] < variables[0]]
+        rows = sorted(rows, reverse=order.endswith('DESC'))
+        return rows[:limit]
+
+    def keys(self, page):
+        return [row[0] for row in page]
+
+    def test_forward(self):
+        """Ensure that following the next cursors visits every row once in order"""
+        page = pagination.paginate(self.select, 'key', size=5)
+        self.assertEqual(self.keys(page), [1, 2, 3, 4, 5])
+        self.assertIsNone(page.previous_cursor)
+
+        page = pagination.paginate(self.select, 'key', page.next_cursor, size=5)
+        self.assertEqual(self.keys(page), [6, 7, 8, 9, 10])
+
+        page = pagination.paginate(self.select, 'key', page.next_cursor, size=5)
+        self.assertEqual(self.keys(page), [11, 12])
+        self.assertIsNone(page.next_cursor)
+        self.assertTrue(all(limit == 6 for _, _, _, limit in self.queries))
+
+    def test_backward(self):
+        """Ensure that the previous cursor returns to the rows before the page"""
+        first = pagination.paginate(self.select, 'key', size=5)
+        second = pagination.paginate(self.select, 'key', first.next_cursor, size=5)
+        page = pagination.paginate(self.select, 'key', second.previous_cursor, size=5)
+        self.assertEqual(self.keys(page), [1, 2, 3, 4, 5])
+        self.assertIsNone(page.previous_cursor)
+        self.assertIsNotNone(page.next_cursor)
+
+    def test_descending(self):
+        """Ensure that descending pages start from the largest key"""
+        page = pagination.paginate(self.select, 'key', size=5, descending=True)
+        self.assertEqual(self.keys(page), [12, 11, 10, 9, 8])
+        page = pagination.paginate(self.select, 'key', page.next_cursor, size=5, descending=True)
+        self.assertEqual(self.keys(page), [7, 6, 5, 4, 3])
+        page = pagination.paginate(self.select, 'key', page.previous_cursor, size=5, descending=True)
+        self.assertEqual(self.keys(page), [12, 11, 10, 9, 8])
+
+    def test_invalid_cursor(self):
+        """Ensure that an invalid cursor raises a ValueError"""
+        with self.assertRaises(ValueError):
+            pagination.paginate(self.select, 'key', 'not a cursor')
+        with self.assertRaises(ValueError):
+            pagination.paginate(self.select, 'key', pagination.encode_cursor('sideways', 1))
+        with self.assertRaises(ValueError):
+            pagination.paginate(self.select, 'key', pagination.encode_cursor(pagination.AFTER, {'key': 1}))
+        with self.assertRaises(ValueError):
+            pagination.paginate(self.select, 'key', pagination.encode_cursor(pagination.AFTER, '5'), key_type=int)
+        page = pagination.paginate(self.select, 'key', pagination.encode_cursor(pagination.AFTER, 5), key_type=int)
+        self.assertEqual(self.keys(page), [6, 7, 8, 9, 10, 11, 12])
+
+
+if __name__ == '__main__':
+    unittest.main()
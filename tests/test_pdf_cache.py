@@ -0,0 +1,59 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+from pdf_cache import PDFCache
+
+
+class TestPDFCache(unittest.TestCase):
+    def setUp(self):
+        """Create a PDF cache within a temporary directory"""
+        self.directory = tempfile.mkdtemp()
+        self.cache = PDFCache(os.path.join(self.directory, 'cache'), 10)
+
+    def tearDown(self):
+        """Remove the temporary directory of the cache"""
+        shutil.rmtree(self.directory)
+
+    def test_get(self):
+        """Ensure that a stored PDF is returned for the same html and missed for different html"""
+        self.assertIsNone(self.cache.get(424, '<p>Invoice</p>'))
+        self.cache.put(424, '<p>Invoice</p>', b'%PDF')
+        self.assertEqual(self.cache.get(424, '<p>Invoice</p>'), b'%PDF')
+        self.assertIsNone(self.cache.get(424, '<p>Changed Invoice</p>'))
+        self.assertIsNone(self.cache.get(425, '<p>Invoice</p>'))
+
+    def test_replace(self):
+        """Ensure that storing a PDF of changed html replaces the older copy of the invoice"""
+        self.cache.put(424, '<p>Invoice</p>', b'%PDF')
+        self.cache.put(424, '<p>Changed Invoice</p>', b'%PDF2')
+        self.assertIsNone(self.cache.get(424, '<p>Invoice</p>'))
+        self.assertEqual(self.cache.get(424, '<p>Changed Invoice</p>'), b'%PDF2')
+
+    def test_invalidate(self):
+        """Ensure that invalidating an invoice removes only the PDFs of that invoice"""
+        self.cache.put(4, '<p>Invoice</p>', b'%PDF')
+        self.cache.put(42, '<p>Invoice</p>', b'%PDF')
+        self.cache.invalidate(4)
+        self.assertIsNone(self.cache.get(4, '<p>Invoice</p>'))
+        self.assertEqual(self.cache.get(42, '<p>Invoice</p>'), b'%PDF')
+
+    def test_evict(self):
+        """Ensure that the least recently used PDFs are evicted when the cache exceeds its size"""
+        self.cache.put(1, 'a', b'1234')
+        self.cache.put(2, 'b', b'1234')
+        # Make the first PDF older than the second, then use it so the second is the least recently used
+        os.utime(self.cache.path(1, 'a'), (0, 0))
+        os.utime(self.cache.path(2, 'b'), (1, 1))
+        self.cache.get(1, 'a')
+        self.cache.put(3, 'c', b'1234')
+        self.assertEqual(self.cache.get(1, 'a'), b'1234')
+        self.assertIsNone(self.cache.get(2, 'b'))
+        self.assertEqual(self.cache.get(3, 'c'), b'1234')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import signal
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+import pdf_cache
+from pdf_service import RenderService
+
+
+class TestRenderService(unittest.TestCase):
+    def setUp(self):
+        """Create a render service storing PDFs in a temporary cache"""
+        self.directory = tempfile.mkdtemp()
+        self.cache_directory = pdf_cache.cache.directory
+        pdf_cache.cache.directory = self.directory
+        self.service = RenderService(workers=1, max_queue=1)
+
+    def tearDown(self):
+        """Stop the render service and remove the temporary cache"""
+        self.service.shutdown()
+        pdf_cache.cache.directory = self.cache_directory
+        shutil.rmtree(self.directory)
+
+    def test_render(self):
+        """Ensure that rendering returns the bytes of a PDF and records the render in the metrics"""
+        pdf = self.service.render(424, '<p>Invoice</p>')
+        self.assertTrue(pdf.startswith(b'%PDF'))
+        self.assertEqual(pdf_cache.cache.get(424, '<p>Invoice</p>'), pdf)
+        metrics = self.service.metrics()
+        self.assertEqual(metrics['completed'], 1)
+        self.assertEqual(metrics['queue_depth'], 0)
+
+    def test_reuse(self):
+        """Ensure that submitting the same invoice html twice joins the job in flight"""
+        first = self.service.submit(424, '<p>Invoice</p>')
+        second = self.service.submit(424, '<p>Invoice</p>')
+        self.assertIs(first, second)
+        first.result()
+        self.assertEqual(self.service.metrics()['submitted'], 1)
+
+    def test_full_queue(self):
+        """Ensure that a non-blocking submit is rejected while the queue is full"""
+        first = self.service.submit(424, '<p>Invoice</p>')
+        self.assertIsNone(self.service.submit(425, '<p>Invoice</p>', block=False))
+        first.result()
+        self.assertEqual(self.service.metrics()['rejected'], 1)
+
+    def test_broken_pool(self):
+        """Ensure that a pool whose worker process was killed is replaced rather than failing every later render"""
+        self.service.render(424, '<p>Invoice</p>')
+        for process in list(self.service._executor._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+        try:
+            self.service.render(425, '<p>Invoice</p>')
+        except Exception:
+            pass
+        self.assertTrue(self.service.render(426, '<p>Invoice</p>').startswith(b'%PDF'))
+        metrics = self.service.metrics()
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertEqual(metrics['restarted'], 1)
+        self.assertGreaterEqual(metrics['failed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -48,6 +48,15 @@ class TestItem(unittest.TestCase):
             results = db.query("SELECT * FROM persons WHERE person_name = 'test_person_b'")
             self.assertEqual(results, [])
 
+    def test_get_many(self):
+        """Ensure that get_many returns the requested persons in order and raises an error for unknown names"""
+        persons = Person.get_many(['test_person_b', 'test_person_a'])
+        self.assertEqual([person.name for person in persons], ['test_person_b', 'test_person_a'])
+        self.assertEqual(persons[0].email, 'boss@example.com')
+
+        with self.assertRaises(KeyError):
+            Person.get_many(['test_person_a', 'fake_person'])
+
     # TODO: test get_all
 
 if __name__ == '__main__':
@@ -0,0 +1,204 @@
+import datetime
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+import config
+import database
+import exporter
+import importer
+import migrations
+import outbox
+import sqlite_backend
+import totals
+import versions
+from invoice import Invoice, Item, Person
+
+
+class TestTranslate(unittest.TestCase):
+    def test_placeholders(self):
+        """Ensure that placeholders become ? and casts are removed, leaving string literals untouched"""
+        query, parameters = sqlite_backend.translate(
+            "SELECT %s::date, '%%s::text' WHERE a = %s AND b LIKE 'x%%'", ('2018-01-01', 5))
+        self.assertEqual(query, "SELECT ?, '%s::text' WHERE a = ? AND b LIKE 'x%'")
+        self.assertEqual(parameters, ['2018-01-01', 5])
+
+    def test_any(self):
+        """Ensure that = ANY(%s) is expanded into an IN list of every value"""
+        query, parameters = sqlite_backend.translate('SELECT 1 FROM items WHERE item_code = ANY(%s) AND charge > %s',
+                                                     (['A', 'B'], 2))
+        self.assertEqual(query, 'SELECT 1 FROM items WHERE item_code IN (?, ?) AND charge > ?')
+        self.assertEqual(parameters, ['A', 'B', 2])
+        query, parameters = sqlite_backend.translate('SELECT 1 WHERE a = ANY(%s)', ([],))
+        self.assertEqual(query, 'SELECT 1 WHERE a IN ()')
+        self.assertEqual(parameters, [])
+
+    def test_functions(self):
+        """Ensure that now, intervals, generate_series and row locks are translated"""
+        query, parameters = sqlite_backend.translate(
+            "SELECT now() + %s * interval '1 second' FROM t WHERE id IN (SELECT id FROM t FOR UPDATE SKIP LOCKED)",
+            (30,))
+        self.assertNotIn('now()', query)
+        self.assertNotIn('FOR UPDATE', query)
+        self.assertIn("? || ' seconds'", query)
+        self.assertEqual(parameters, [30])
+        self.assertTrue(sqlite_backend.locks('SELECT 1 FROM items FOR UPDATE'))
+        self.assertFalse(sqlite_backend.locks("SELECT 'FOR UPDATE' FROM items"))
+
+        connection = sqlite_backend.connect(':memory:')
+        cursor = connection.cursor()
+        cursor.execute('SELECT generate_series FROM generate_series(1, %s)', (3,))
+        self.assertEqual(cursor.fetchall(), [(1,), (2,), (3,)])
+        connection.close()
+
+    def test_variables(self):
+        """Ensure that the amount of variables must match the amount of placeholders"""
+        with self.assertRaises(IndexError):
+            sqlite_backend.translate('SELECT %s, %s', (1,))
+        with self.assertRaises(TypeError):
+            sqlite_backend.translate('SELECT %s', (1, 2))
+
+    def test_item_code(self):
+        """Ensure that item codes are scattered four character codes which never repeat"""
+        codes = [sqlite_backend.item_code(number) for number in range(1, 1000)]
+        self.assertEqual(len(set(codes)), len(codes))
+        self.assertTrue(all(len(code) == 4 and code.isalnum() for code in codes))
+        self.assertEqual(len(sqlite_backend.item_code(1679616)), 5)
+
+
+class TestSqliteBackend(unittest.TestCase):
+    def setUp(self):
+        """Use a new SQLite database in a temporary directory for every connection"""
+        self.directory = tempfile.mkdtemp()
+        self.settings = {name: getattr(config, name, None) for name in ('database_backend', 'sqlite_path')}
+        config.database_backend = 'sqlite'
+        config.sqlite_path = os.path.join(self.directory, 'work.sqlite3')
+        self.pool, database._pool = database._pool, None
+
+        with database.database(pooled=False) as connection:
+            self.assertFalse(database.tables_exist(connection))
+            database.create_tables(connection)
+        with database.database(pooled=False) as connection:
+            self.assertTrue(database.tables_exist(connection))
+            self.migrated = migrations.migrate(connection)
+        Person.create('test_payer', 'payer@example.com', '1 Payer Street')
+        Person.create('test_payee', 'payee@example.com', '2 Payee Street')
+
+    def tearDown(self):
+        """Restore the configured database and remove the SQLite database"""
+        database._pool.closeall()
+        database._pool = self.pool
+        for name, value in self.settings.items():
+            setattr(config, name, value)
+        shutil.rmtree(self.directory)
+
+    def test_migrate(self):
+        """Ensure that the migrations covered by the SQLite schema are recorded without being applied again"""
+        self.assertEqual(self.migrated, [(version, description, version > sqlite_backend.SCHEMA_VERSION)
+                                         for version, description, _ in migrations.MIGRATIONS])
+        with database.database() as db:
+            self.assertEqual(migrations.applied_versions(db), {version for version, _, _ in migrations.MIGRATIONS})
+            self.assertEqual(migrations.migrate(db), [])
+
+    def test_invoices(self):
+        """Ensure that items and invoices are created, changed and deleted with their totals kept up to date"""
+        first = Item.create(datetime.date(2018, 1, 1), 'Test Item A', 10.5)
+        second = Item.create(datetime.date(2018, 1, 2), 'Test Item B', 20)
+        self.assertNotEqual(first.code, second.code)
+        self.assertEqual(Item(first.code).date, datetime.date(2018, 1, 1))
+
+        invoice = Invoice.create(datetime.date(2018, 2, 1), 'test_payer', 'test_payee', [first.code, second.code])
+        invoice = Invoice(invoice.id)
+        self.assertEqual(invoice.date, datetime.date(2018, 2, 1))
+        self.assertEqual((invoice.amount, invoice.item_count), (30.5, 2))
+        self.assertEqual(invoice.payer.email, 'payer@example.com')
+        self.assertEqual(versions.get(versions.invoice(invoice.id))[0], 1)
+        self.assertIsInstance(versions.get(versions.GLOBAL)[1], datetime.datetime)
+
+        with self.assertRaises(KeyError):
+            Invoice.create(datetime.date(2018, 2, 1), 'test_payer', 'test_payee', [first.code, 'DEIG'])
+
+        changed = Item.update_many({first.code: {'charge': 15}, second.code: {'description': 'Changed', 'date': ''}})
+        self.assertEqual([item.amount for item in changed], [15, 20])
+        self.assertEqual(Item(second.code).description, 'Changed')
+        self.assertEqual(Item(second.code).date, datetime.date(2018, 1, 2))
+        self.assertEqual(Invoice(invoice.id).amount, 35)
+        self.assertEqual(versions.get(versions.invoice(invoice.id))[0], 2)
+        with database.database() as db:
+            self.assertEqual(totals.check(db), [])
+
+        invoice.delete()
+        with self.assertRaises(KeyError):
+            Invoice(invoice.id)
+        with self.assertRaises(KeyError):
+            Item(first.code)
+
+    def test_invoice_numbers(self):
+        """Ensure that the number of a deleted invoice is not issued again"""
+        item = Item.create(datetime.date(2018, 1, 1), 'Test Item', 10)
+        first = Invoice.create(datetime.date(2018, 2, 1), 'test_payer', 'test_payee', [item.code])
+        first.delete()
+        item = Item.create(datetime.date(2018, 1, 1), 'Test Item', 10)
+        second = Invoice.create(datetime.date(2018, 2, 1), 'test_payer', 'test_payee', [item.code])
+        self.assertGreater(second.id, first.id)
+
+    def test_row_locks(self):
+        """Ensure that a query locking rows takes the write lock of the database until its transaction ends"""
+        item = Item.create(datetime.date(2018, 1, 1), 'Test Item', 10)
+        first = sqlite_backend.connect(config.sqlite_path)
+        second = sqlite_backend.connect(config.sqlite_path, timeout=0)
+        try:
+            first.cursor().execute('SELECT charge FROM items WHERE item_code = %s FOR UPDATE', (item.code,))
+            self.assertEqual(first.status, sqlite_backend.STATUS_IN_TRANSACTION)
+            with self.assertRaises(sqlite3.OperationalError):
+                second.cursor().execute('UPDATE items SET charge = 20 WHERE item_code = %s', (item.code,))
+            second.rollback()
+
+            first.rollback()
+            second.cursor().execute('UPDATE items SET charge = 20 WHERE item_code = %s', (item.code,))
+            second.commit()
+        finally:
+            first.close()
+            second.close()
+        self.assertEqual(Item(item.code).amount, 20)
+
+    def test_import_export(self):
+        """Ensure that items are imported and exported without COPY"""
+        result = importer.import_items(io.StringIO('date,description,charge\n2018-03-01,Imported A,5\n'
+                                                   '2018-03-02,Imported B,7.25\n'))
+        self.assertEqual(len(result.codes), 2)
+        self.assertEqual(Item(result.codes[1]).amount, 7.25)
+        self.assertEqual(Item(result.codes[0]).date, datetime.date(2018, 3, 1))
+
+        Invoice.create(datetime.date(2018, 4, 1), 'test_payer', 'test_payee', result.codes)
+        file = io.StringIO()
+        self.assertEqual(exporter.copy_csv(file), 2)
+        lines = file.getvalue().splitlines()
+        self.assertEqual(lines[0], ','.join(name for name, _ in exporter.COLUMNS))
+        self.assertEqual(len(lines), 3)
+        self.assertIn('Imported A', file.getvalue())
+
+    def test_outbox(self):
+        """Ensure that outbox messages are deduplicated, claimed and rescheduled with SQLite timestamps"""
+        item = Item.create(datetime.date(2018, 1, 1), 'Test Item', 10)
+        invoice = Invoice.create(datetime.date(2018, 2, 1), 'test_payer', 'test_payee', [item.code])
+        message = outbox.enqueue(invoice.id, 'Body')
+        self.assertEqual(outbox.enqueue(invoice.id, 'Body'), message)
+
+        with database.database() as db:
+            claimed = outbox.claim(db, 10, 300)
+            self.assertEqual([row[0] for row in claimed], [message])
+            self.assertEqual(outbox.claim(db, 10, 300), [])
+            outbox.record(db, message, 1, 'Failed')
+        status = outbox.status(message)
+        self.assertEqual(status['status'], 'pending')
+        self.assertGreater(status['next_attempt'], status['created'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+import migrations
+import versions
+from database import database
+
+
+class TestVersions(unittest.TestCase):
+    def setUp(self):
+        """Ensure the data_versions table exists and the test invoice has no stamp left by other tests"""
+        with database() as db:
+            migrations.migrate(db)
+            db.query('DELETE FROM data_versions WHERE name = %s', versions.invoice(424))
+
+    def tearDown(self):
+        """Remove the stamp of the test invoice"""
+        with database() as db:
+            db.query('DELETE FROM data_versions WHERE name = %s', versions.invoice(424))
+
+    def test_etag(self):
+        """Ensure that the entity tag changes with the stamp, version and representation and nothing else"""
+        etag = versions.etag(versions.invoice(424), 1, 'html')
+        self.assertEqual(etag, versions.etag(versions.invoice(424), 1, 'html'))
+        self.assertNotEqual(etag, versions.etag(versions.invoice(424), 2, 'html'))
+        self.assertNotEqual(etag, versions.etag(versions.invoice(424), 1, 'pdf'))
+        self.assertNotEqual(etag, versions.etag(versions.invoice(425), 1, 'html'))
+
+    def test_bump(self):
+        """Ensure that bumping an invoice creates its stamp, then bumps it along with the global stamp"""
+        self.assertEqual(versions.get(versions.invoice(424)), (0, None))
+        with database() as db:
+            versions.bump(db, [424])
+        version, modified = versions.get(versions.invoice(424))
+        self.assertEqual(version, 1)
+        self.assertIsNotNone(modified)
+
+        global_version, _ = versions.get(versions.GLOBAL)
+        with database() as db:
+            versions.bump(db, ['424'])
+        self.assertEqual(versions.get(versions.invoice(424))[0], 2)
+        self.assertEqual(versions.get(versions.GLOBAL)[0], global_version + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
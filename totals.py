@@ -0,0 +1,59 @@
+"""Checks and rebuilds the invoice totals stored on the invoices table
+
+The amount and item count of every invoice are stored on the invoice row and kept up to date as items change, this
+module compares them against the totals calculated from the items of each invoice and rebuilds them if required.
+
+Run this file to report the invoices with incorrect totals, or with --rebuild to recalculate every total.
+"""
+import sys
+
+from database import database
+
+# The totals of every invoice calculated from the items linked to it
+CALCULATED_TOTALS = """SELECT invoices.invoice_number,
+                              COALESCE(SUM(items.charge), 0) AS amount,
+                              COUNT(items.item_code) AS item_count
+                       FROM invoices
+                       LEFT JOIN invoice_items ON invoice_items.invoice_number = invoices.invoice_number
+                       LEFT JOIN items ON items.item_code = invoice_items.item_code
+                       GROUP BY invoices.invoice_number"""
+
+# The difference in amount tolerated as incrementally adjusted amounts accumulate floating point error
+TOLERANCE = 1e-6
+
+
+def check(connection):
+    """Find the invoices whose stored totals do not match the totals calculated from their items
+
+    Returns a list of tuples of the invoice number, the stored amount and item count and the calculated amount and
+    item count
+    """
+    return connection.query("""SELECT invoices.invoice_number, invoices.amount, invoices.item_count,
+                                      calculated.amount, calculated.item_count
+                               FROM invoices JOIN ({}) calculated
+                               ON calculated.invoice_number = invoices.invoice_number
+                               WHERE abs(invoices.amount - calculated.amount) > %s
+                               OR invoices.item_count <> calculated.item_count
+                               ORDER BY invoices.invoice_number""".format(CALCULATED_TOTALS), TOLERANCE)
+
+
+def rebuild(connection):
+    """Recalculate the stored totals of every invoice from their items"""
+    connection.query("""UPDATE invoices SET amount = calculated.amount, item_count = calculated.item_count
+                        FROM ({}) calculated
+                        WHERE calculated.invoice_number = invoices.invoice_number""".format(CALCULATED_TOTALS))
+
+
+if __name__ == "__main__":
+    with database() as connection:
+        if '--rebuild' in sys.argv[1:]:
+            rebuild(connection)
+            print('Rebuilt the totals of every invoice')
+        else:
+            incorrect = check(connection)
+            for number, amount, item_count, calculated_amount, calculated_item_count in incorrect:
+                print('Invoice {}: stored amount {} of {} items, calculated amount {} of {} items'
+                      .format(number, amount, item_count, calculated_amount, calculated_item_count))
+            print('{} invoices with incorrect totals'.format(len(incorrect)))
+            if incorrect:
+                sys.exit(1)
@@ -0,0 +1,65 @@
+"""Version stamps of the data pages are rendered from, stored in the data_versions table
+
+Every invoice has a stamp which is bumped whenever the invoice or its items change, along with a global stamp which is
+bumped by any change to the invoices or items. The stamps are cheap to look up, so a client which already has the
+current page can be answered before any model is loaded or anything is rendered.
+"""
+import hashlib
+import os
+
+import config
+from database import database
+
+# The name of the stamp bumped by every change
+GLOBAL = 'all'
+
+# The templates the pages are rendered from, a change to which changes every page
+TEMPLATES = (os.path.join('invoices', 'invoice.html'),)
+
+_salt = None
+
+
+def invoice(invoice_id):
+    """Return the name of the stamp of an invoice"""
+    return 'invoice/{:d}'.format(int(invoice_id))
+
+
+def bump(db, invoice_ids=()):
+    """Bump the global stamp and the stamps of the invoices with the given ids
+
+    Run as the last statement of the transaction making the change, so the rows of the stamps are locked for as short
+    a time as possible
+    """
+    names = sorted({invoice(invoice_id) for invoice_id in invoice_ids}) + [GLOBAL]
+    db.query_values("""INSERT INTO data_versions (name) VALUES %s
+                       ON CONFLICT (name) DO UPDATE SET version = data_versions.version + 1, modified_at = now()""",
+                    [(name,) for name in names])
+
+
+def get(name):
+    """Return the version of a stamp and when it was last bumped, or 0 and None if it has never been bumped"""
+    with database() as db:
+        rows = db.query('SELECT version, modified_at FROM data_versions WHERE name = %s', name)
+    return rows[0] if rows else (0, None)
+
+
+def salt():
+    """Return a hash of everything besides the data that pages are rendered from, the templates and the details of
+    the business in the configuration file
+    """
+    global _salt
+    if _salt is None:
+        digest = hashlib.sha256()
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+        for template in TEMPLATES:
+            with open(os.path.join(directory, template), 'rb') as file:
+                digest.update(file.read())
+        digest.update(repr((config.abn, config.payment_details)).encode('utf-8'))
+        _salt = digest.hexdigest()
+    return _salt
+
+
+def etag(name, version, representation):
+    """Return the strong entity tag of a representation, such as html or pdf, of a version of a stamp"""
+    key = '{}\n{}\n{}\n{}'.format(salt(), name, version, representation)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
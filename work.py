@@ -1,10 +1,53 @@
+import io
+import tempfile
 from datetime import date
 
-from flask import Flask, render_template, request, redirect, jsonify, abort
-
+from flask import (Flask, Response, render_template, request, redirect, jsonify, abort, json, make_response,
+                   send_file, stream_with_context)
+
+import charts
+import config
+import exporter
+import identity_map
+import importer
+import instrumentation
+import outbox
+import pdf_service
+import versions
 from invoice import Invoice, Item, Person
 
 app = Flask(__name__)
+app.teardown_request(identity_map.clear)
+app.after_request(instrumentation.annotate)
+app.teardown_request(instrumentation.finish)
+
+
+def conditional(name, representation, build):
+    """Respond with the page built by a function unless the client already has the current version of the page
+
+    The version stamp of the page is checked before anything is loaded or rendered, so a client sending the entity tag
+    or modification date of the current version is answered with 304 Not Modified without building the page
+
+    name: the name of the version stamp of the data the page is built from
+    representation: the kind of page, such as html or pdf, so each kind has its own entity tag
+    build: a function returning the response of the page
+    """
+    version, modified = versions.get(name)
+    etag = versions.etag(name, version, representation)
+    if modified is not None:
+        # HTTP dates are only precise to the second
+        modified = modified.replace(microsecond=0)
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = (modified is not None and request.if_modified_since is not None
+                        and modified <= request.if_modified_since)
+    response = Response(status=304) if not_modified else make_response(build())
+    response.set_etag(etag)
+    if modified is not None:
+        response.last_modified = modified
+    return response
 
 
 def format_date(value):
@@ -21,18 +64,13 @@ def index():
                            contacts=Person.get_all())
 
 
-@app.route('/invoices', defaults={'page': 1})
-@app.route('/invoices/page/<int:page>')
-def invoices(page):
-    invoices_per_page = 5
-    invoice_count = Invoice.get_invoice_count()
-    page_count = invoice_count // invoices_per_page + int(invoice_count % invoices_per_page > 0)
-
-    start = max(invoice_count - (page * invoices_per_page), 0)
-    end = max(invoice_count - ((page - 1) * invoices_per_page), 0)
-
-    return render_template('invoices.html', invoices=list(reversed(Invoice.get_all(start=start, end=end))),
-                           page_count=page_count, page=page)
+@app.route('/invoices')
+def invoices():
+    try:
+        page = Invoice.get_page(request.args.get('cursor'), size=5)
+    except ValueError:
+        abort(400)
+    return render_template('invoices.html', invoices=page.items, page=page)
 
 
 @app.route('/api/item', methods=['POST'])
@@ -43,9 +81,56 @@ def api_log_item():
 
 @app.route('/api/item', methods=['GET'])
 def api_view_items():
+    if request.args.get('format') == 'ndjson':
+        def stream():
+            for item in Item.iterate_dicts():
+                yield json.dumps(item) + '\n'
+        return Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+
+    if 'cursor' in request.args or 'limit' in request.args:
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        try:
+            page = Item.get_page(request.args.get('cursor'), size=limit)
+        except ValueError:
+            abort(400)
+        return jsonify(items=[item.dict() for item in page], next=page.next_cursor, previous=page.previous_cursor)
+
     return jsonify([item.dict() for item in Item.get_all()])
 
 
+@app.route('/api/items', methods=['PATCH'])
+def api_edit_items():
+    body = request.get_json(silent=True)
+    if not isinstance(body, list):
+        abort(400)
+    changes = {}
+    for change in body:
+        if not isinstance(change, dict) or not isinstance(change.get('code'), str) or change['code'] in changes:
+            abort(400)
+        changes[change.get('code')] = {'date': change.get('date'), 'description': change.get('description'),
+                                       'charge': change.get('charge', change.get('amount'))}
+    try:
+        items = Item.update_many(changes)
+    except KeyError:
+        abort(404)
+    except ValueError:
+        abort(400)
+    return jsonify(items=[item.dict() for item in items])
+
+
+@app.route('/api/items/import', methods=['POST'])
+def api_import_items():
+    file_format = request.args.get('format')
+    if file_format is None:
+        file_format = 'ndjson' if request.mimetype in ('application/x-ndjson', 'application/json') else 'csv'
+    try:
+        result = importer.import_items(io.StringIO(request.get_data(as_text=True), newline=''), file_format,
+                                       skip_invalid=request.args.get('skip_invalid') == 'true')
+    except ValueError:
+        abort(400)
+    return jsonify(**result.dict()), 201 if result.codes else 400
+
+
 @app.route('/api/item/<item>', methods=['GET'])
 def api_view_item(item):
     try:
@@ -89,17 +174,13 @@ def api_delete_invoice(invoice):
     return 'Deleted'
 
 
-@app.route('/people', defaults={'page': 1})
-@app.route('/people/page/<int:page>')
-def people(page):
-    people_per_page = 10
-    people = Person.get_all()
-    people_count = len(people)
-
-    page_count = len(people) // people_per_page + int(len(people) % people_per_page > 0)
-
-    return render_template('people.html', people=list(people),
-                           page_count=page_count, page=page)
+@app.route('/people')
+def people():
+    try:
+        page = Person.get_page(request.args.get('cursor'), size=10)
+    except ValueError:
+        abort(400)
+    return render_template('people.html', people=page.items, page=page)
 
 
 @app.route('/api/person', methods=['POST'])
@@ -115,6 +196,63 @@ def api_delete_person(person):
     return 'Deleted'
 
 
+@app.route('/api/email/invoice/<invoice>', methods=['POST'])
+def send_email_invoice(invoice):
+    message = Invoice(invoice).email(request.form.get('body') or '')
+    return jsonify(**outbox.status(message)), 202
+
+
+@app.route('/api/email/<int:message>', methods=['GET'])
+def api_email_status(message):
+    status = outbox.status(message)
+    if status is None:
+        abort(404)
+    return jsonify(**status)
+
+
+@app.route('/api/email/invoices', methods=['POST'])
+def api_email_invoices():
+    try:
+        results = Invoice.email_many(request.form.getlist('invoices'), request.form.get('body') or '')
+    except ValueError:
+        abort(400)
+    return jsonify([{'invoice': invoice, 'message': message, 'error': error}
+                    for invoice, message, error in results]), 202
+
+
+@app.route('/api/pdf/metrics', methods=['GET'])
+def api_pdf_metrics():
+    return jsonify(**pdf_service.service.metrics())
+
+
+@app.route('/api/export/invoices', methods=['GET'])
+def api_export_invoices():
+    try:
+        start, end = exporter.parse_date(request.args.get('start')), exporter.parse_date(request.args.get('end'))
+    except ValueError:
+        abort(400)
+
+    if request.args.get('format') == 'parquet':
+        if exporter.pyarrow is None:
+            abort(501)
+        # Parquet files are written out before they can be read, so spool the export to disk rather than memory
+        output = tempfile.TemporaryFile()
+        exporter.write_parquet(output, start, end)
+        output.seek(0)
+        return send_file(output, mimetype='application/vnd.apache.parquet', as_attachment=True,
+                         download_name='invoices.parquet')
+
+    return Response(stream_with_context(exporter.iterate_csv(start, end)), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename="invoices.csv"'})
+
+
+@app.route('/api/debug/queries', methods=['GET'])
+def api_debug_queries():
+    if not (app.debug or getattr(config, 'query_debug', False)):
+        abort(404)
+    return jsonify(requests=instrumentation.history())
+
+
 @app.route('/statistics')
 def invoice_stats():
     return render_template('statistics.html')
@@ -122,20 +260,16 @@ def invoice_stats():
 
 @app.route('/statistics/invoices.svg')
 def generate_statistics_invoices():
-    canvas = Invoice.statistics()
-    canvas.savefig('invoices.svg')
-    with open('invoices.svg', 'rb') as img:
-        return img.read(), 200, {'Content-Type': 'image/svg+xml',
-                                 'Content-Disposition': 'attachment; filename="invoices.svg"'}
+    return conditional(versions.GLOBAL, 'invoices.svg', lambda: (
+        charts.invoices_svg(), 200, {'Content-Type': 'image/svg+xml',
+                                     'Content-Disposition': 'attachment; filename="invoices.svg"'}))
 
 
 @app.route('/statistics/items.svg')
 def generate_statistics_items():
-    canvas = Item.statistics()
-    canvas.savefig('items.svg')
-    with open('items.svg', 'rb') as img:
-        return img.read(), 200, {'Content-Type': 'image/svg+xml',
-                                 'Content-Disposition': 'attachment; filename="items.svg"'}
+    return conditional(versions.GLOBAL, 'items.svg', lambda: (
+        charts.items_svg(), 200, {'Content-Type': 'image/svg+xml',
+                                  'Content-Disposition': 'attachment; filename="items.svg"'}))
 
 
 def render(url, **funcs):
@@ -148,16 +282,18 @@ def render(url, **funcs):
     return inner_render
 
 
-app.add_url_rule('/invoice/<invoice>', 'view_invoice', lambda invoice: Invoice(invoice).html())
-app.add_url_rule('/invoice/<invoice>.pdf', 'view_invoice_pdf', lambda invoice: Invoice(invoice).pdf())
-app.add_url_rule('/invoice/<invoice>/download', 'download_invoice_pdf', lambda invoice: Invoice(invoice).download())
+app.add_url_rule('/invoice/<invoice>', 'view_invoice',
+                 lambda invoice: conditional(versions.invoice(invoice), 'html', lambda: Invoice(invoice).html()))
+app.add_url_rule('/invoice/<invoice>.pdf', 'view_invoice_pdf',
+                 lambda invoice: conditional(versions.invoice(invoice), 'pdf', lambda: Invoice(invoice).pdf()))
+app.add_url_rule('/invoice/<invoice>/download', 'download_invoice_pdf',
+                 lambda invoice: conditional(versions.invoice(invoice), 'download',
+                                             lambda: Invoice(invoice).download()))
 app.add_url_rule('/item/log', 'log_item', lambda: render_template('items/log.html', date=date.today()))
 app.add_url_rule('/invoice/log', 'log_invoice',
                  lambda: render_template('invoices/log.html', date=date.today(), people=Person.get_all(),
                                          items=Item.get_unlogged()))
 app.add_url_rule('/people/add', 'add_contact', lambda: render_template('people/add.html', ))
-app.add_url_rule('/api/email/invoice/<invoice>', 'send_email_invoice',
-                 lambda invoice: Invoice(invoice).email(request.form.get('body')), methods=['POST'])
 
 if __name__ == '__main__':
     app.run(debug=True)